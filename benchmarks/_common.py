@@ -0,0 +1,78 @@
+"""
+
+Script: _common.py
+Purpose: Helpers shared by the net_reminder.py benchmarks
+Author: Roger Hamilton, KK6LZB
+
+Every benchmark appends one JSON record per invocation to its results file.
+A record starts with the time, the net_reminder.py version, the Python
+version and the repeat count, followed by the benchmark's own fields.
+
+"""
+from datetime import datetime
+import json
+import os
+import sys
+
+SCRIPT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+SCRIPT = os.path.join(SCRIPT_DIR, "net_reminder.py")
+
+
+def script_version():
+    """Reads SCRIPT_VERSION from net_reminder.py without importing it
+
+        Args: None
+
+        Returns: STRING version
+    """
+    with open(SCRIPT, 'r', encoding='UTF-8') as f:
+        for line in f:
+            if line.startswith("SCRIPT_VERSION"):
+                return line.split('=', 1)[1].strip().strip('"')
+    return None
+
+
+def new_record(repeat, **fields):
+    """Starts a benchmark record
+
+        Args:   INTEGER repeat: Runs per scenario
+                DICTIONARY fields: Benchmark specific fields
+
+        Returns: DICTIONARY record
+    """
+    record = {'timestamp': datetime.now().isoformat(timespec='seconds'),
+              'version': script_version(),
+              'python': sys.version.split()[0],
+              'repeat': repeat}
+    record.update(fields)
+    return record
+
+
+def previous_record(output):
+    """Returns the last benchmark in the results file
+
+        Args: STRING output
+
+        Returns: DICTIONARY record, or None
+    """
+    if not os.path.exists(output):
+        return None
+
+    record = None
+    with open(output, 'r', encoding='UTF-8') as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+    return record
+
+
+def append_record(output, record):
+    """Appends a benchmark record to the results file
+
+        Args:   STRING output
+                DICTIONARY record
+
+        Returns: None
+    """
+    with open(output, 'a', encoding='UTF-8') as f:
+        f.write(json.dumps(record) + "\n")
@@ -0,0 +1,539 @@
+"""
+
+Script: pipeline_benchmark.py
+Purpose: To record the end-to-end, per-stage and peak memory cost of net_reminder.py
+Author: Roger Hamilton, KK6LZB
+
+Synthetic schedule and roster workbooks of several sizes are generated, and
+each scenario (test run with a cold and a warm workbook cache, delivery,
+personalized delivery and a fetch of the workbooks) is run in a fresh
+interpreter against a local SMTP sink and HTTP stand-in, so no network is
+needed. Wall time, peak RSS and the per-stage timings from the run's
+metrics_file are appended as one JSON line to the results file, and the
+medians are compared with the previous line.
+
+"""
+from datetime import datetime, timedelta
+import getopt
+import http.server
+import json
+import os
+import shutil
+import socketserver
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from functools import partial
+
+import yaml
+
+from _common import SCRIPT, SCRIPT_DIR, append_record, new_record, previous_record
+
+SCENARIOS = ('cold', 'warm', 'deliver', 'personalize', 'fetch')
+ROSTER_HEADER = ['Member', 'Callsign', 'Street', 'Email', 'Mobile Phone', 'Home Phone',
+                 'Work Phone']
+SCHEDULE_START = datetime(1990, 1, 1)
+
+
+def usage():
+    """ Shows script usage
+
+        Args: None
+        Returns: None
+    """
+    print("Usage: python3 benchmarks/pipeline_benchmark.py [OPTIONS]")
+    print("     -h,--help                  This help notice.")
+    print("     -s,--sizes <list>          Schedule rows and roster members per benchmark, \
+comma separated (default: 10,1000,10000; up to 100000).")
+    print("     -k,--sheets <count>        Roster sheets the members are spread over (default: 2).")
+    print("     -S,--scenarios <list>      Scenarios to run, comma separated \
+(default: cold,warm,deliver,personalize,fetch).")
+    print("     -r,--repeat <count>        Runs per scenario and size (default: 3).")
+    print("     -w,--workdir <dir>         Keeps the generated workbooks here for later runs \
+(default: a temporary directory).")
+    print("     -o,--output <file>         Results file, one JSON line per benchmark \
+(default: pipeline_benchmark.jsonl).")
+
+
+#######################################
+# Synthetic Workbooks
+#######################################
+def write_schedule(filename, rows):
+    """Writes a Net Control Schedule with one net a day
+
+        Args:   STRING filename
+                INTEGER rows
+
+        Returns: None
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    sheet = workbook.create_sheet('Schedule')
+    sheet.append(['Net Control Schedule'])
+    sheet.append(['DATE', None, 'PRIMARY', 'BACKUP', 'Net'])
+    for i in range(rows):
+        sheet.append([SCHEDULE_START + timedelta(days=i), None, f"Member {i % 97}",
+                      f"Member {(i + 1) % 97}", 'Weekly' if i % 4 else 'Travel'])
+    workbook.save(filename)
+
+
+def reminder_date(rows):
+    """Picks the reminder date: mid-schedule, with a net a week later
+
+        Args: INTEGER rows: Days in the schedule
+
+        Returns: DATETIME now
+    """
+    return SCHEDULE_START + timedelta(days=min(rows // 2, max(0, rows - 15)))
+
+
+def write_roster(filename, rows, sheets):
+    """Writes a roster with the members spread over several sheets
+
+        Args:   STRING filename
+                INTEGER rows: Members over all sheets
+                INTEGER sheets
+
+        Returns: LIST sheet_names
+    """
+    import openpyxl
+
+    workbook = openpyxl.Workbook(write_only=True)
+    names = [f"Sheet{n + 1}" for n in range(sheets)]
+    for n, name in enumerate(names):
+        sheet = workbook.create_sheet(name)
+        sheet.append(ROSTER_HEADER)
+        for i in range(n, rows, sheets):
+            sheet.append([f"Member {i}", f"K{i}BM", f"{i} Main St", f"member{i}@example.com",
+                          None, None, None])
+    workbook.save(filename)
+
+    return names
+
+
+def generate(workdir, size, sheets):
+    """Generates (or reuses) the workbooks for one size
+
+        Args:   STRING workdir
+                INTEGER size: Schedule rows and roster members
+                INTEGER sheets: Roster sheets
+
+        Returns: DICTIONARY schedule, roster, sheet_names and now
+    """
+    directory = os.path.join(workdir, f"size_{size}_{sheets}")
+    os.makedirs(directory, exist_ok=True)
+    schedule = os.path.join(directory, "Schedule.xlsx")
+    roster = os.path.join(directory, "Roster.xlsx")
+
+    start = time.perf_counter()
+    if not os.path.exists(schedule):
+        write_schedule(schedule, size)
+    if not os.path.exists(roster):
+        write_roster(roster, size, sheets)
+    elapsed = time.perf_counter() - start
+    if elapsed > 0.5:
+        print(f"Generated {size} row workbooks in {elapsed:.1f}s")
+
+    return {'directory': directory,
+            'schedule': schedule,
+            'roster': roster,
+            'sheet_names': [f"Sheet{n + 1}" for n in range(sheets)],
+            'now': reminder_date(size)}
+
+
+#######################################
+# Local Servers
+#######################################
+class SMTPSinkHandler(socketserver.StreamRequestHandler):
+    """Accepts every message and counts messages and recipients
+
+    Subclasses can refuse recipients by overriding rcpt_reply.
+    """
+
+    def reply(self, line):
+        """Writes one response line
+
+            Args: STRING line
+            Returns: None
+        """
+        self.wfile.write(line.encode('ascii') + b"\r\n")
+
+    def rcpt_reply(self, address):  # pylint: disable=unused-argument
+        """Chooses the response to a recipient
+
+            Args: STRING address
+            Returns: STRING response line, a 2xx code accepts the recipient
+        """
+        return "250 OK"
+
+    def handle(self):
+        self.reply("220 localhost benchmark sink")
+        recipients = 0
+
+        for raw in self.rfile:
+            command = raw.decode('ascii', 'replace').strip()
+            verb = command[:4].upper()
+
+            if verb == 'EHLO':
+                self.reply("250-localhost")
+                self.reply("250 8BITMIME")
+            elif verb in ('HELO', 'RSET', 'NOOP'):
+                recipients = 0
+                self.reply("250 OK")
+            elif verb == 'MAIL':
+                recipients = 0
+                self.reply("250 OK")
+            elif verb == 'RCPT':
+                address = command[command.find(':') + 1:].strip().strip('<>')
+                response = self.rcpt_reply(address)
+                if response.startswith('2'):
+                    recipients += 1
+                self.reply(response)
+            elif verb == 'DATA':
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                for line in self.rfile:
+                    if line in (b".\r\n", b".\n"):
+                        break
+                self.server.record(recipients)
+                self.reply("250 OK")
+            elif verb == 'QUIT':
+                self.reply("221 Bye")
+                return
+            else:
+                self.reply("502 Command not implemented")
+
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    """SMTP server on an ephemeral local port that discards what it receives"""
+
+    daemon_threads = True
+    allow_reuse_address = True
+
+    def __init__(self, handler=SMTPSinkHandler):
+        super().__init__(('127.0.0.1', 0), handler)
+        self._lock = threading.Lock()
+        self.messages = 0
+        self.recipients = 0
+
+    def record(self, recipients):
+        """Counts one received message
+
+            Args: INTEGER recipients
+            Returns: None
+        """
+        with self._lock:
+            self.messages += 1
+            self.recipients += recipients
+
+    def reset(self):
+        """Clears the counts
+
+            Args: None
+            Returns: (INTEGER messages, INTEGER recipients) before the reset
+        """
+        with self._lock:
+            counts = (self.messages, self.recipients)
+            self.messages = 0
+            self.recipients = 0
+        return counts
+
+
+class QuietHTTPHandler(http.server.SimpleHTTPRequestHandler):
+    """Serves the generated workbooks without logging every request"""
+
+    def log_message(self, *args):
+        pass
+
+
+def start_server(server):
+    """Serves in a background thread
+
+        Args: OBJECT server: socketserver server
+        Returns: OBJECT server
+    """
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+#######################################
+# Scenarios
+#######################################
+def write_config(filename, workbooks, scenario, smtp_port, http_port, workdir):
+    """Writes the net_reminder configuration for one scenario
+
+        Args:   STRING filename
+                DICTIONARY workbooks: From generate
+                STRING scenario
+                INTEGER smtp_port
+                INTEGER http_port
+                STRING workdir
+
+        Returns: DICTIONARY configuration
+    """
+    directory = workbooks['directory']
+    config = {
+        'url_roster': f"http://127.0.0.1:{http_port}/"
+                      f"{os.path.relpath(workbooks['roster'], workdir)}",
+        'url_schedule': f"http://127.0.0.1:{http_port}/"
+                        f"{os.path.relpath(workbooks['schedule'], workdir)}",
+        'url_user': 'benchmark',
+        'url_pass': 'benchmark',
+        'schedule_excel_file': workbooks['schedule'],
+        'schedule_sheet_name': 'Schedule',
+        'roster_excel_file': workbooks['roster'],
+        'roster_sheet_names': workbooks['sheet_names'],
+        'email_from': 'reminder@example.com',
+        'smtp_server': '127.0.0.1',
+        'smtp_port': smtp_port,
+        'smtp_ssl': False,
+        'smtp_auth_user': 'reminder@example.com',
+        'smtp_auth_pass': None,
+        'logo': os.path.join(SCRIPT_DIR, 'image_src', 'OIP.jpg'),
+        'email_subject_template': "LNACS {0} Net for {1}",
+        'no_net_control_email_subject_template': "ATTENTION: No Net Control Configured as of {0}",
+        'email_config': os.path.join(SCRIPT_DIR, 'html_src', 'net_reminder.html'),
+        'no_net_control_email_config': os.path.join(SCRIPT_DIR, 'html_src',
+                                                    'no_net_reminder.html'),
+        'email_reply_to': 'reply@example.com',
+        'script_maintainer_name': 'Script Maintainer',
+        'script_maintainer_email': 'script@example.com',
+        'excel_maintainer_name': 'Excel Maintainer',
+        'excel_maintainer_email': 'excel@example.com',
+        'switch_notify1_name': 'Notify One',
+        'switch_notify1_email': 'notify1@example.com',
+        'switch_notify2_name': 'Notify Two',
+        'switch_notify2_email': 'notify2@example.com',
+        'cache_dir': os.path.join(directory, f"cache_{scenario}"),
+        'metrics_file': os.path.join(directory, f"metrics_{scenario}.jsonl"),
+    }
+
+    if scenario == 'personalize':
+        config['personalize'] = True
+    elif scenario == 'fetch':
+        fetched = os.path.join(directory, 'fetched')
+        os.makedirs(fetched, exist_ok=True)
+        config['schedule_excel_file'] = os.path.join(fetched, 'Schedule.xlsx')
+        config['roster_excel_file'] = os.path.join(fetched, 'Roster.xlsx')
+
+    with open(filename, 'w', encoding='UTF-8') as f:
+        yaml.safe_dump(config, f)
+
+    return config
+
+
+def prepare(scenario, config):
+    """Resets what a scenario expects to find before each run
+
+        Args:   STRING scenario
+                DICTIONARY config: From write_config
+
+        Returns: None
+    """
+    if os.path.exists(config['metrics_file']):
+        os.unlink(config['metrics_file'])
+
+    if scenario != 'warm':
+        shutil.rmtree(config['cache_dir'], ignore_errors=True)
+    if scenario == 'fetch':
+        # Download the workbooks in full every run
+        shutil.rmtree(os.path.dirname(config['roster_excel_file']), ignore_errors=True)
+        os.makedirs(os.path.dirname(config['roster_excel_file']))
+
+
+def run_once(command):
+    """Runs a command in a fresh interpreter
+
+        Args: LIST command
+
+        Returns: TUPLE (FLOAT seconds, INTEGER peak RSS in KiB or None)
+    """
+    start = time.perf_counter()
+    if not hasattr(os, 'wait4'):
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        return time.perf_counter() - start, None
+
+    with subprocess.Popen(command, stdout=subprocess.DEVNULL) as process:
+        _, status, rusage = os.wait4(process.pid, 0)
+        elapsed = time.perf_counter() - start
+        process.returncode = os.WEXITSTATUS(status) if os.WIFEXITED(status) else 1
+    if process.returncode != 0:
+        raise subprocess.CalledProcessError(process.returncode, command)
+
+    # ru_maxrss is in KiB on Linux and in bytes on macOS
+    peak = rusage.ru_maxrss // 1024 if sys.platform == 'darwin' else rusage.ru_maxrss
+    return elapsed, peak
+
+
+def read_stages(metrics_file):
+    """Reads the stage timings a run wrote to its metrics_file
+
+        Args: STRING metrics_file
+
+        Returns: DICTIONARY {stage: FLOAT seconds}
+    """
+    stages = {}
+    if not os.path.exists(metrics_file):
+        return stages
+
+    with open(metrics_file, 'r', encoding='UTF-8') as f:
+        for line in f:
+            event = json.loads(line)
+            if event.get('event') == 'stage':
+                stages[event['stage']] = stages.get(event['stage'], 0.0) + event['seconds']
+    return stages
+
+
+def benchmark(scenario, workbooks, servers, workdir, repeat):
+    """Times one scenario at one size
+
+        Args:   STRING scenario
+                DICTIONARY workbooks: From generate
+                TUPLE servers: (SMTPSink, HTTP server)
+                STRING workdir
+                INTEGER repeat
+
+        Returns: DICTIONARY result
+    """
+    smtp, web = servers
+    config_file = os.path.join(workbooks['directory'], f"{scenario}.yaml")
+    config = write_config(config_file, workbooks, scenario, smtp.server_address[1],
+                          web.server_address[1], workdir)
+
+    command = [sys.executable, SCRIPT, "-c", config_file, "--log", os.devnull,
+               "--now", workbooks['now'].strftime('%m/%d/%Y')]
+    if scenario in ('cold', 'warm'):
+        command.append("--test")
+    if scenario == 'fetch':
+        command += ["--test", "--fetch_remote"]
+
+    if scenario == 'warm':
+        # Fill the cache once so every timed run is a hit
+        prepare('cold', config)
+        run_once(command)
+
+    times, peaks, stages = [], [], {}
+    smtp.reset()
+    for _ in range(repeat):
+        prepare(scenario, config)
+        elapsed, peak = run_once(command)
+        times.append(elapsed)
+        peaks.append(peak)
+        for name, seconds in read_stages(config['metrics_file']).items():
+            stages.setdefault(name, []).append(seconds)
+    messages, recipients = smtp.reset()
+
+    return {'min': min(times),
+            'median': statistics.median(times),
+            'max': max(times),
+            'peak_rss_kib': None if None in peaks else max(peaks),
+            'stages': {name: statistics.median(values) for name, values in sorted(stages.items())},
+            'messages': messages // repeat,
+            'recipients': recipients // repeat}
+
+
+def report(name, size, result, previous):
+    """Prints one result, with the change from the previous benchmark
+
+        Args:   STRING name: Scenario
+                INTEGER size
+                DICTIONARY result
+                DICTIONARY previous: Earlier record, or None
+
+        Returns: None
+    """
+    change = ''
+    try:
+        before = previous['results'][name][str(size)]['median']
+        change = f"  ({(result['median'] - before) / before:+.0%} vs {previous['version']})"
+    except (KeyError, TypeError, ZeroDivisionError):
+        pass
+
+    stages = ", ".join(f"{stage} {seconds:.3f}s" for stage, seconds
+                       in sorted(result['stages'].items(), key=lambda item: -item[1])[:3])
+    peak = '-' if result['peak_rss_kib'] is None else f"{result['peak_rss_kib'] / 1024:.0f}MiB"
+    print(f"{name:12} {size:>7}  median {result['median']:.3f}s  peak {peak:>7}  "
+          f"sent {result['messages']}/{result['recipients']}  {stages}{change}")
+
+
+def main(argv=None):
+    """Runs the benchmark
+
+        Args: LIST argv: Command line arguments (default: sys.argv[1:])
+
+        Returns: INTEGER exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    sizes = [10, 1000, 10000]
+    sheets = 2
+    scenarios = list(SCENARIOS)
+    repeat = 3
+    workdir = None
+    output = "pipeline_benchmark.jsonl"
+
+    try:
+        opts, _ = getopt.getopt(argv, "hs:k:S:r:w:o:",
+                                ["help", "sizes=", "sheets=", "scenarios=", "repeat=",
+                                 "workdir=", "output="])
+        for o, a in opts:
+            if o in ["-h", "--help"]:
+                usage()
+                return 0
+            if o in ["-s", "--sizes"]:
+                sizes = [int(size) for size in a.split(',') if size.strip()]
+            elif o in ["-k", "--sheets"]:
+                sheets = max(1, int(a))
+            elif o in ["-S", "--scenarios"]:
+                scenarios = [name.strip() for name in a.split(',') if name.strip()]
+            elif o in ["-r", "--repeat"]:
+                repeat = max(1, int(a))
+            elif o in ["-w", "--workdir"]:
+                workdir = a
+            elif o in ["-o", "--output"]:
+                output = a
+    except (getopt.GetoptError, ValueError) as e:
+        print(e)
+        usage()
+        return 2
+
+    unknown = sorted(set(scenarios) - set(SCENARIOS))
+    if unknown:
+        print(f"Unknown scenarios: {', '.join(unknown)}")
+        return 2
+
+    temporary = workdir is None
+    workdir = os.path.abspath(workdir or tempfile.mkdtemp(prefix="net_reminder_bench_"))
+    os.makedirs(workdir, exist_ok=True)
+
+    smtp = start_server(SMTPSink())
+    web = start_server(http.server.ThreadingHTTPServer(
+        ('127.0.0.1', 0), partial(QuietHTTPHandler, directory=workdir)))
+
+    previous = previous_record(output)
+    record = new_record(repeat, sheets=sheets, results={})
+
+    try:
+        for size in sizes:
+            workbooks = generate(workdir, size, sheets)
+            for name in scenarios:
+                result = benchmark(name, workbooks, (smtp, web), workdir, repeat)
+                record['results'].setdefault(name, {})[str(size)] = result
+                report(name, size, result, previous)
+    finally:
+        smtp.shutdown()
+        web.shutdown()
+        if temporary:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    append_record(output, record)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,155 @@
+"""
+
+Script: startup_benchmark.py
+Purpose: To record the import and first-run cost of net_reminder.py
+Author: Roger Hamilton, KK6LZB
+
+Each scenario is run in a fresh interpreter several times and the wall-clock
+times are appended as one JSON line to the results file, so regressions show
+up when comparing against earlier lines.
+
+"""
+import getopt
+import os
+import shutil
+import statistics
+import subprocess
+import sys
+import time
+
+import yaml
+
+from _common import SCRIPT, append_record, new_record
+
+
+
+def usage():
+    """ Shows script usage
+
+        Args: None
+        Returns: None
+    """
+    print("Usage: python3 benchmarks/startup_benchmark.py [OPTIONS]")
+    print("     -h,--help                This help notice.")
+    print("     -c,--config <file>       net_reminder configuration for the run scenarios \
+(default: None, import and help only).")
+    print("     -n,--now <mm/dd/YYYY>    Date passed to the run scenarios (default: current date).")
+    print("     -r,--repeat <count>      Runs per scenario (default: 5).")
+    print("     -o,--output <file>       Results file, one JSON line per benchmark \
+(default: startup_benchmark.jsonl).")
+
+
+def time_command(command, repeat, before=None):
+    """Times a command in fresh interpreters
+
+        Args:   LIST command
+                INTEGER repeat
+                FUNCTION before: Called before every run (e.g. to clear a cache)
+
+        Returns: DICTIONARY min, median and max seconds
+    """
+    times = []
+    for _ in range(repeat):
+        if before is not None:
+            before()
+        start = time.perf_counter()
+        subprocess.run(command, check=True, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        times.append(time.perf_counter() - start)
+
+    return {'min': min(times), 'median': statistics.median(times), 'max': max(times)}
+
+
+def heavy_imports(command, before=None):
+    """Lists which heavy dependencies a command imports
+
+        Args:   LIST command: python command line
+                FUNCTION before: Called before the run
+
+        Returns: LIST module names
+    """
+    if before is not None:
+        before()
+    result = subprocess.run([command[0], "-X", "importtime"] + command[1:], check=True,
+                            stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+    loaded = {line.rsplit('|', 1)[-1].strip() for line in result.stderr.splitlines()}
+    return sorted(loaded & {'pandas', 'numpy', 'openpyxl', 'jinja2', 'yaml', 'requests',
+                            'smtplib', 'aiosmtplib'})
+
+
+def main(argv=None):
+    """Runs the benchmark
+
+        Args: LIST argv: Command line arguments (default: sys.argv[1:])
+
+        Returns: INTEGER exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    config_file = None
+    now = None
+    repeat = 5
+    output = "startup_benchmark.jsonl"
+
+    try:
+        opts, _ = getopt.getopt(argv, "hc:n:r:o:",
+                                ["help", "config=", "now=", "repeat=", "output="])
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+        return 2
+
+    for o, a in opts:
+        if o in ["-h", "--help"]:
+            usage()
+            return 0
+        if o in ["-c", "--config"]:
+            config_file = a
+        elif o in ["-n", "--now"]:
+            now = a
+        elif o in ["-r", "--repeat"]:
+            repeat = int(a)
+        elif o in ["-o", "--output"]:
+            output = a
+
+    python = sys.executable
+    script_dir = os.path.dirname(os.path.abspath(SCRIPT))
+    scenarios = {
+        'import': [python, "-c", f"import sys; sys.path.insert(0, {script_dir!r}); "
+                                 "import net_reminder"],
+        'help': [python, SCRIPT, "--help"],
+    }
+    before = {}
+
+    if config_file is not None:
+        with open(config_file, 'r', encoding='UTF-8') as f:
+            cache_dir = (yaml.safe_load(f) or {}).get('cache_dir')
+
+        run = [python, SCRIPT, "-c", config_file, "--test", "--log", os.devnull]
+        if now is not None:
+            run += ["--now", now]
+
+        scenarios['first_run'] = run
+        if cache_dir is not None:
+            before['first_run'] = lambda: shutil.rmtree(cache_dir, ignore_errors=True)
+            scenarios['cached_run'] = run
+
+    record = new_record(repeat, scenarios={})
+
+    for name, command in scenarios.items():
+        if name == 'cached_run':
+            # Warm the cache once so every timed run is a hit
+            subprocess.run(command, check=True, stdout=subprocess.DEVNULL)
+        result = time_command(command, repeat, before.get(name))
+        result['imports'] = heavy_imports(command, before.get(name))
+        record['scenarios'][name] = result
+        print(f"{name:12} min {result['min']:.3f}s  median {result['median']:.3f}s  "
+              f"max {result['max']:.3f}s  imports: {', '.join(result['imports']) or '-'}")
+
+    append_record(output, record)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -4,56 +4,63 @@ Script: net_reminder.py
 Purpose: To send an HTML email weekly based on a user-defined template
 Author: Roger Hamilton, KK6LZB
 
+The script may also be imported as a library. Load a configuration once with
+load_config(), create a NetReminder from it and call NetReminder.run() for
+each date to process:
+
+    config = load_config("net_reminder.yaml")
+    reminder = NetReminder(config, test=True)
+    reminder.run(datetime(2024, 9, 18))
+
 """
+# Heavy dependencies (pandas, jinja2, requests, yaml, smtplib, the email
+# modules and the optional aiosmtplib) are imported where they are used, so
+# --help, configuration checks and cached runs start without loading them.
 # Date handling
-from datetime import datetime, timedelta
-# Import the email modules we'll need
-from email.mime.text import MIMEText
-from email.mime.image import MIMEImage
-from email.mime.multipart import MIMEMultipart
+from array import array
+from bisect import bisect_left, bisect_right
+from datetime import date, datetime, timedelta
 # Command line args
 import getopt
+# Workbook cache
+import hashlib
+import json
+import pickle
+import tempfile
 import logging
 from logging import handlers
 import os
+# Recipient addresses
+import re
 import sys
-# Import smtplib for the actual sending function
-import smtplib
-# Email templating
-from jinja2 import Template
-# Easy handling of data
-import pandas as pd
-from pandas.core.groupby.groupby import DataError
-# Configuration file
-import yaml
-import requests
+import threading
+import time
+# Transformed email templates
+import weakref
 
 #######################################
 # Script version
 #######################################
-SCRIPT_VERSION = "1.0.1"
+SCRIPT_VERSION = "1.2.0"
 
 #######################################
-# Declaring global vars
+# Defaults
 #######################################
-SCRIPT_CONFIG = None
-OPTS = None
-TEMPLATE = None
+DEFAULT_LOG_NAME = "net_reminder.log"
+DEFAULT_CONFIG_FILE = "net_reminder.yaml"
+DEFAULT_EMAIL_CONFIG = "net_reminder.html"
+DEFAULT_NO_NET_CONTROL_EMAIL_CONFIG_FILE = "no_net_reminder.html"
+DEFAULT_CHANGE_NOTICE_CONFIG_FILE = "change_notice.html"
+DEFAULT_EMAIL_SUBJECT_TEMPLATE = "{0} Net for {1}"
+DEFAULT_NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE = "Net for {0}"
+DEFAULT_CHANGE_NOTICE_SUBJECT_TEMPLATE = "Net Control Schedule change: {0}"
 
-#######################################
-# Command Line Options
-#######################################
-LOG_NAME = None
-CONFIG_FILE = None
-EMAIL_CONFIG = None
-NO_NET_CONTROL_EMAIL_CONFIG = None
-NOW = None
-TEST = False
-EMAIL_SUBJECT_TEMPLATE = None
-NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE = None
-TEST_EMAIL = None
-EMAIL_REPLY_TO = None
-FETCH_REMOTE_FILES = False
+# Saved ETag/Last-Modified of a fetched file, stored beside it
+VALIDATORS_SUFFIX = ".validators.json"
+
+logger = logging.getLogger(__name__)
+# Queue handler and listener installed by log_setup
+LOG_PIPELINE = {}
 
 #######################################
 # Sample email template
@@ -144,7 +151,35 @@ td {
 </html>
 '''
 
-#######################################
+DEFAULT_CHANGE_NOTICE_CONFIG = '''\
+<!DOCTYPE html>
+<head>
+<style>
+td, th {
+  vertical-align: top;
+  text-align: left;
+  padding-right: 12px;
+}
+</style>
+</head>
+<body>
+<h3>The Net Control Schedule has changed</h3>
+<table>
+<tr><th>Date</th><th>Net</th><th>Primary</th><th>Backup</th></tr>
+{% for change in changes %}
+<tr>
+<td>{{ change.net_date }}</td>
+<td>{{ change.net_type or '' }}{% if change.removed %} (removed){% elif change.added %} (added){% endif %}</td>
+<td>{% if change.previous_primary != change.primary %}<s>{{ change.previous_primary or '' }}</s> {% endif %}{{ change.primary or '' }}</td>
+<td>{% if change.previous_backup != change.backup %}<s>{{ change.previous_backup or '' }}</s> {% endif %}{{ change.backup or '' }}</td>
+</tr>
+{% endfor %}
+</table>
+<p>If you can't cover an assignment, please coordinate a replacement and notify <a href="mailto:{{switch_notify1_email}}">{{switch_notify1_name}}</a> or <a href="mailto:{{switch_notify2_email}}">{{switch_notify2_name}}</a>.</p>
+</body>
+</html>
+'''
+
 # Subroutines and Functions
 #######################################
 # Usage statement
@@ -171,6 +206,19 @@ def usage():
 output (default: False).")
     print(" -q, --test_email <email>  Run script using test emails provided \
 (default: None).")
+    print("     --start <mm/dd/YYYY>  Batch: first date to process (default: None).")
+    print("     --end <mm/dd/YYYY>    Batch: last date to process (default: --start).")
+    print("     --step <days>         Batch: days between dates (default: 7).")
+    print("     --dates <list>        Batch: comma-separated mm/dd/YYYY dates (default: None).")
+    print("     --output_dir <dir>    Batch: write .eml files instead of sending (default: None).")
+    print("     --mbox <file>         Batch: append to an mbox instead of sending (default: None).")
+    print("     --async_send          Batch: send concurrently with aiosmtplib (default: False).")
+    print("     --daemon              Stay resident and send each reminder on schedule \
+(default: False).")
+    print("     --profile <file>      Profile the run into a pstats file and <file>.txt report \
+(default: None).")
+    print("     --changes             Only notify of schedule changes since the last check \
+(default: False).")
     print("")
     print("Usage: python3 net_reminder.py [OPTIONS]")
     print("     -h,--help                This help notice.")
@@ -200,547 +248,4909 @@ email outputs before using in")
     print("                              production.")
     print("     -q,--test_email <email>  Run script and send email to provided email address(es) \
 (default: None).")
+    print("     --start <mm/dd/YYYY>     Batch mode. Process every date from --start to --end \
+stepping --step days,")
+    print("     --end <mm/dd/YYYY>       loading the schedule and roster once. Dates resolving to \
+the same net")
+    print("     --step <days>            produce a single reminder.")
+    print("     --dates <list>           Batch mode over an explicit comma-separated list of \
+mm/dd/YYYY dates.")
+    print("     --output_dir <dir>       Batch output: write one .eml file per reminder instead \
+of sending.")
+    print("     --mbox <file>            Batch output: append the reminders to an mbox file \
+instead of sending.")
+    print("     --async_send             Batch delivery: send the reminders concurrently. \
+Requires the aiosmtplib package.")
+    print("     --daemon                 Stay resident, sending each reminder daemon_lead_hours \
+before its net.")
+    print("                              Reloads the configuration and workbooks on SIGHUP or \
+when they change.")
+    print("     --profile <file>         Run under cProfile and tracemalloc. Writes a pstats file \
+and <file>.txt with")
+    print("                              the hotspots of each stage and the peak allocation sites. \
+Combine with --test.")
+    print("     --changes                Compare the schedule with the snapshot of the last check \
+and send a change")
+    print("                              notice to the operators concerned instead of the \
+reminder. With batch dates,")
+    print("                              re-renders only the reminders that mention a changed net.")
     print("")
 
 
-def fill_email_no_net_notice_template():
-    """Completes the email template
-    
-        Args: None
+class NetReminderError(Exception):
+    """Raised when the net reminder pipeline cannot complete"""
 
-        Return: STRING email_body
+
+def optional_import(name, feature):
+    """Imports an optional dependency, explaining which feature needs it
+
+    Args:   STRING name: Module name
+            STRING feature: Feature needing the module, for the error message
+
+    Returns: OBJECT module
     """
+    import importlib
+
+    try:
+        return importlib.import_module(name)
+    except ImportError as exc:
+        raise NetReminderError(f"{feature} requires the {name} package "
+                               f"(pip install {name})") from exc
+
+
+def load_config(filename):
+    """Loads the YAML script configuration
+
+    Args: STRING filename Ex: net_reminder.yaml
 
-    email_template = None
+    Returns: DICTIONARY script_config
+    """
+    import yaml
 
-        # Get the email configuration file from HTML template in file
-    with open(NO_NET_CONTROL_EMAIL_CONFIG, 'r', encoding='UTF-8') as email_file_template:
+    with open(filename, 'r', encoding='UTF-8') as yconfig_file:
         try:
-            logging.info("Using email configuration file: %s", NO_NET_CONTROL_EMAIL_CONFIG)
-            email_template = email_file_template.read()
-            email_file_template.close()
-        except IOError as exc:
-            logger.fatal(exc)
-            email_template = DEFAULT_NO_NET_CONTROL_EMAIL_CONFIG
-        finally:
-            email_file_template.close()
-
-    #
-    # HTML email template
-    #
-    t = Template(email_template)
-    email_body = t.render(net_date=NOW.strftime("%m/%d/%Y"),
-                          excel_maintainer_name=SCRIPT_CONFIG['excel_maintainer_name'],
-                          excel_maintainer_email=SCRIPT_CONFIG['excel_maintainer_email'],
-                          script_maintainer_name=SCRIPT_CONFIG['script_maintainer_name'],
-                          script_maintainer_email=SCRIPT_CONFIG['script_maintainer_email'],
-                          )
-
-    return email_body
-
-def create_no_net_email_subject():
-    """Completes the email subject template and returns it
-    
-    Args: None
+            script_config = yaml.safe_load(yconfig_file)
+        except yaml.YAMLError as exc:
+            raise NetReminderError(exc) from exc
+
+    if 'logo' not in script_config.keys():
+        script_config['logo'] = None
+
+    return script_config
+
+
+def read_validators(filename):
+    """Reads the HTTP validators stored beside a fetched file
+
+    Args: STRING filename: Fetched file
 
-    Returns: STRING email_subject
-    
+    Returns: DICTIONARY validators with etag and last_modified (empty when unknown)
     """
-    net_date = NOW.strftime("%m/%d/%Y")
-    email_subject = NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE.format(net_date)
-    logging.info("Email Subject: %s", email_subject)
+    try:
+        with open(filename + VALIDATORS_SUFFIX, 'r', encoding='UTF-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
 
-    return email_subject
 
+def write_atomic(filename, write):
+    """Writes a file through a temporary file in the same directory and a rename
 
-def gather_no_net_email_addresses():
-    """Generates the email address list from defined maintainers' emails
-    
-    Args: None
-    
-    Returns: STRING email_dist: Comma-separated list of emails
-    
+    Readers never see a partial file and the old one is kept on failure.
+
+    Args:   STRING filename
+            FUNCTION write: Called with the open binary temporary file
+
+    Returns: None
     """
-    email_dist = list([SCRIPT_CONFIG['excel_maintainer_email'],
-                       SCRIPT_CONFIG['script_maintainer_email']])
-    logging.info("Email Distribution List: %s", ",".join(email_dist),
-                 )
+    fd, tmp_name = tempfile.mkstemp(dir=os.path.dirname(os.path.abspath(filename)),
+                                    prefix=os.path.basename(filename) + '.', suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            write(f)
+        os.replace(tmp_name, filename)
+    except BaseException:
+        os.unlink(tmp_name)
+        raise
 
-    return email_dist
 
+def fetch_remote_file(url, filename, user, password, session=None, max_bytes=None,
+                      sha256=None, retries=3):
+    """Fetch file from Nextcloud
 
-def email_no_net_notice ():
-    """Sends a message to the maintainers that no net controls are present given the date
+    The request is conditional on the ETag and Last-Modified validators saved
+    beside the file by the previous fetch, so an unchanged file is answered
+    with 304 Not Modified and left untouched (keeping its workbook cache
+    entry valid).
 
-        Args: None
+    The body is streamed in chunks to filename.part. A dropped connection is
+    resumed with an HTTP Range request (guarded by If-Range) up to retries
+    times. Downloads larger than max_bytes are abandoned, and the result must
+    match the Content-Length and, when given, the expected SHA-256 before it
+    atomically replaces the previous copy. On any failure the previous copy
+    is left as it was.
 
-        Returns: None
+    Args:   STRING url
+            STRING filename
+            STRING user
+            STRING password
+            OBJECT session: requests.Session to reuse (default: a new one)
+            INTEGER max_bytes: Largest accepted file, None for no limit
+            STRING sha256: Expected hex SHA-256 of the file, None to skip the check
+            INTEGER retries: Resume attempts after a dropped connection
+
+    Return: BOOLEAN True when the file was downloaded, False when not modified
     """
-    email_body = fill_email_no_net_notice_template()
-    email_subject = create_no_net_email_subject()
-    email_dist = gather_no_net_email_addresses()
+    import requests
 
-    msg = MIMEMultipart()
-    text = MIMEText(email_body, 'html')
-    msg.attach(text)
+    if session is None:
+        with requests.Session() as new_session:
+            return fetch_remote_file(url, filename, user, password, new_session,
+                                     max_bytes, sha256, retries)
 
-    me = SCRIPT_CONFIG['smtp_auth_user']
-    logging.info("Email From: %s", me)
+    part_name = filename + '.part'
+    # Ask for the file as stored, so the bytes received match Content-Length
+    # and can be used as the Range offset to resume from
+    headers = {'Accept-Encoding': 'identity'}
 
-    if TEST is False:
-        msg['Subject'] = email_subject
-        msg['From'] = SCRIPT_CONFIG['email_from']
-        msg['X-Priority'] = '2'
+    if os.path.isfile(filename):
+        validators = read_validators(filename)
+        if validators.get('etag'):
+            headers['If-None-Match'] = validators['etag']
+        if validators.get('last_modified'):
+            headers['If-Modified-Since'] = validators['last_modified']
 
-        if TEST_EMAIL is not None:
-            logging.info("Sending test email")
-            msg['To'] = TEST_EMAIL
-            email_dist = [TEST_EMAIL]
-        else:
-            msg['To'] = ", ".join(email_dist)
+    digest = hashlib.sha256()
+    received = 0
+    total = None
+    etag = None
+    last_modified = None
+    encoded = False
 
-        logger.info("Subject: %s", msg['Subject'])
-        logger.info("From: %s", msg['From'])
-        logger.info("To: %s", msg['To'])
-        logger.info("CC: %s", msg['Cc'])
-        logger.info("BCC: %s", msg['Bcc'])
+    try:
+        with open(part_name, 'wb') as part:
+            for attempt in range(retries + 1):
+                request_headers = dict(headers)
+                if received:
+                    # Resume where the connection dropped, or start over when
+                    # the body was encoded
+                    request_headers = {'Accept-Encoding': 'identity'}
+                    if not encoded:
+                        request_headers['Range'] = f"bytes={received}-"
+                        if etag:
+                            request_headers['If-Range'] = etag
 
-        # Send the message via our own SMTP server, but don't include the
-        # envelope header.
-        s = smtplib.SMTP_SSL(SCRIPT_CONFIG['smtp_server'],
-                             port=SCRIPT_CONFIG['smtp_port'])
-        s.ehlo()
-        s.login(me, SCRIPT_CONFIG['smtp_auth_pass'])
-        s.sendmail(me, email_dist, msg.as_string())
-        s.close()
-    else:
-        logger.info("Test flag set on command line. Not sending email...")
-        print(email_body)
+                try:
+                    with session.get(url, headers=request_headers, auth=(user, password),
+                                     stream=True, timeout=30) as req:
+                        logger.info("File request %s status code: %s", url, req.status_code)
+
+                        if req.status_code == 304 and not received:
+                            logger.info("File %s not modified", filename)
+                            return False
+
+                        if req.status_code == 200:
+                            # Full body, either the first request or a server that
+                            # ignored (or refused, via If-Range) the resume
+                            part.seek(0)
+                            part.truncate()
+                            digest = hashlib.sha256()
+                            received = 0
+                            length = req.headers.get('Content-Length')
+                            total = int(length) if length is not None else None
+                            etag = req.headers.get('ETag')
+                            last_modified = req.headers.get('Last-Modified')
+                            encoded = req.headers.get('Content-Encoding',
+                                                      'identity').lower() != 'identity'
+                            if encoded:
+                                # Decoded sizes can't be checked against the encoded
+                                # length, nor resumed from
+                                logger.warning("Server sent %s with Content-Encoding %s",
+                                               filename, req.headers['Content-Encoding'])
+                                total = None
+                        elif req.status_code != 206 or not received:
+                            raise NetReminderError(
+                                f"Request for file {filename} failed: {req.reason}")
+
+                        if max_bytes is not None and total is not None and total > max_bytes:
+                            raise NetReminderError(
+                                f"File {filename} is {total} bytes, over the {max_bytes} limit")
 
+                        for chunk in req.iter_content(chunk_size=64 * 1024):
+                            if chunk: # filter out keep-alive new chunks
+                                received += len(chunk)
+                                if max_bytes is not None and received > max_bytes:
+                                    raise NetReminderError(
+                                        f"File {filename} exceeds the {max_bytes} byte limit")
+                                part.write(chunk)
+                                digest.update(chunk)
+                    break
+                except (requests.exceptions.ChunkedEncodingError,
+                        requests.exceptions.ConnectionError,
+                        requests.exceptions.Timeout) as exc:
+                    if attempt == retries:
+                        raise NetReminderError(
+                            f"Request for file {filename} failed: {exc}") from exc
+                    logger.warning("Download of %s interrupted at %s bytes (%s), resuming",
+                                   filename, received, exc)
 
-def fill_email_net_notice_template(net_vars):
-    """Completes the email template
-    
-        Args: DICTIONARY    net_vars
+        if total is not None and received != total:
+            raise NetReminderError(f"File {filename} is incomplete: "
+                                   f"{received} of {total} bytes")
 
-        Return: STRING email_body
+        if sha256 is not None and digest.hexdigest() != sha256.lower():
+            raise NetReminderError(f"File {filename} failed its checksum: "
+                                   f"{digest.hexdigest()} != {sha256}")
+
+        os.replace(part_name, filename)
+        logger.info("Fetched %s (%s bytes)", filename, received)
+        METRICS.count('bytes_fetched', received)
+
+        validators = {'etag': etag, 'last_modified': last_modified}
+        write_atomic(filename + VALIDATORS_SUFFIX,
+                     lambda f: f.write(json.dumps(validators).encode('UTF-8')))
+        return True
+
+    except IOError as e:
+        raise NetReminderError(e) from e
+    finally:
+        if os.path.exists(part_name):
+            os.unlink(part_name)
+
+
+def fetch_remote_files(files, user, password, max_workers=4, max_bytes=None):
+    """Fetches several remote files concurrently over one pooled session
+
+    Args:   LIST files: (STRING url, STRING filename, STRING sha256 or None) tuples
+            STRING user
+            STRING password
+            INTEGER max_workers: Concurrent downloads
+            INTEGER max_bytes: Largest accepted file, None for no limit
+
+    Return: DICTIONARY {filename: BOOLEAN downloaded, or the NetReminderError raised}
     """
-    email_template = None
-    logo_basename = None
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    import requests
 
-    if net_vars['logo'] is not None:
-        logo_basename = os.path.basename(net_vars['logo'])
+    results = {}
 
-    # Get the email configuration file from HTML template in file
-    with open(EMAIL_CONFIG, 'r', encoding='UTF-8') as email_file_template:
-        try:
-            logging.info("Using email configuration file: %s", EMAIL_CONFIG)
-            email_template = email_file_template.read()
-            email_file_template.close()
-        except IOError as exc:
-            logger.warning(exc)
-            email_template = DEFAULT_EMAIL_TEMPLATE
-        finally:
-            email_file_template.close()
-    #
-    # HTML email template
-    #
-    t = Template(email_template)
-    email_body = t.render(net_date=net_vars['net_date'],
-                          primary_net_control=net_vars['current_primary'],
-                          backup_net_control=net_vars['current_backup'],
-                          net_type=net_vars['net_type'],
-                          logo=logo_basename,
-                          primary_net_control_2wk=net_vars['next_primary'],
-                          backup_net_control_2wk=net_vars['next_backup'],
-                          net_date_2wk=net_vars['next_net_date'],
-                          switch_notify1_name=SCRIPT_CONFIG['switch_notify1_name'],
-                          switch_notify1_email=SCRIPT_CONFIG['switch_notify1_email'],
-                          switch_notify2_name=SCRIPT_CONFIG['switch_notify2_name'],
-                          switch_notify2_email=SCRIPT_CONFIG['switch_notify2_email'],
-                          excel_maintainer_name=SCRIPT_CONFIG['excel_maintainer_name'],
-                          excel_maintainer_email=SCRIPT_CONFIG['excel_maintainer_email'],
-                          script_maintainer_name=SCRIPT_CONFIG['script_maintainer_name'],
-                          script_maintainer_email=SCRIPT_CONFIG['script_maintainer_email'],
-                          )
-    return email_body
-
-
-def create_email_subject(net_vars):
-    """Completes the email subject template and returns it
-    
-    Args: None
+    with requests.Session() as session:
+        adapter = requests.adapters.HTTPAdapter(pool_maxsize=max(1, max_workers))
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+
+        with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+            futures = {executor.submit(fetch_remote_file, url, filename, user, password,
+                                       session, max_bytes, sha256): filename
+                       for url, filename, sha256 in files}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except NetReminderError as exc:
+                    logger.error("Fetching %s failed: %s", futures[future], exc)
+                    results[futures[future]] = exc
+
+    return results
+
+
+def file_digest(filename):
+    """Computes the SHA-256 of a file's contents
 
-    Returns: STRING email_subject
-    
+    Args: STRING filename
+
+    Returns: STRING hex digest
     """
-    email_subject = EMAIL_SUBJECT_TEMPLATE.format(net_vars['net_type'], net_vars['net_date'])
-    logging.info("Email Subject: %s", email_subject)
+    digest = hashlib.sha256()
+    with open(filename, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
 
-    return email_subject
+#######################################
+# Metrics
+#######################################
+class Metrics:
+    """Per-stage timings and counters of the pipeline
 
+    Stages (config_load, fetch, schedule_parse, roster_parse, render,
+    mime_build, smtp_connect, smtp_login, smtp_send, ...) accumulate their
+    call count and seconds; counters (bytes_fetched, rows_parsed,
+    recipients, refused, ...) accumulate values. Both are kept per tenant,
+    taken from the calling thread. Concurrent stages (async sends, tenant
+    workers) add up, so a stage can total more than the run's wall time.
 
-def gather_email_addresses():
-    """Generates the email address list from the roster sheets defined
-    
     Args: None
-    
-    Returns: STRING email_dist: Comma-separated list of emails
-    
     """
-    #
-    # Gathering the email addresses from the Amateur Radio Roster
-    #
-    df_list = pd.read_excel(SCRIPT_CONFIG['roster_excel_file'],
-                            sheet_name=SCRIPT_CONFIG['roster_sheet_name'],
-                            skiprows=0, header=0).dropna(how='any',
-                            subset=['Email']
-                            )
-    df_emeritus_list = pd.read_excel(SCRIPT_CONFIG['roster_excel_file'],
-                                     sheet_name=SCRIPT_CONFIG['emeritus_sheet_name'],
-                                     skiprows=0, header=0).dropna(how='any', subset=['Email']
-                                    )
 
-    email_dist = list(df_list['Email']) + list(df_emeritus_list['Email'])
-    logging.info("Email Distribution List: %s", ",".join(email_dist))
-    return email_dist
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.started = time.time()
+        self.stages = {}
+        self.counters = {}
+        self.profiler = None
+
+    def set_tenant(self, name):
+        """Attributes the calling thread's metrics to a tenant
+
+        Args: STRING name: Tenant name, None for a single-tenant run
+
+        Returns: None
+        """
+        self._local.tenant = name or ''
+
+    def tenant(self):
+        """Returns the tenant of the calling thread
+
+        Args: None
+
+        Returns: STRING name ('' for a single-tenant run)
+        """
+        return getattr(self._local, 'tenant', '')
+
+    def stage(self, name):
+        """Returns a context manager timing a pipeline stage
+
+        Args: STRING name
+
+        Returns: OBJECT context manager
+        """
+        from contextlib import contextmanager
+
+        @contextmanager
+        def timed():
+            start = time.perf_counter()
+            try:
+                if self.profiler is None:
+                    yield
+                else:
+                    with self.profiler.stage(name):
+                        yield
+            finally:
+                self.add_stage(name, time.perf_counter() - start)
+
+        return timed()
+
+    def add_stage(self, name, seconds):
+        """Records one timed call of a stage
+
+        Args:   STRING name
+                FLOAT seconds
+
+        Returns: None
+        """
+        key = (name, self.tenant())
+        with self._lock:
+            count, total = self.stages.get(key, (0, 0.0))
+            self.stages[key] = (count + 1, total + seconds)
+
+    def count(self, name, value=1):
+        """Adds to a counter
+
+        Args:   STRING name
+                INTEGER value
+
+        Returns: None
+        """
+        key = (name, self.tenant())
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def events(self):
+        """Lists the structured events summarizing the run
+
+        Args: None
+
+        Returns: LIST of DICTIONARY events, one per stage and tenant and one
+                 with the counters per tenant
+        """
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+
+        events = [{'event': 'stage', 'stage': name, 'tenant': tenant,
+                   'calls': count, 'seconds': round(seconds, 6)}
+                  for (name, tenant), (count, seconds) in stages]
+
+        totals = {}
+        for (name, tenant), value in counters:
+            totals.setdefault(tenant, {})[name] = value
+        events += [{'event': 'counters', 'tenant': tenant, **values}
+                   for tenant, values in sorted(totals.items())]
+
+        events.append({'event': 'run', 'started': round(self.started, 3),
+                       'seconds': round(time.time() - self.started, 6),
+                       'version': SCRIPT_VERSION})
+        return events
+
+    def prometheus(self):
+        """Formats the metrics in the Prometheus text exposition format
+
+        Args: None
+
+        Returns: STRING metrics
+        """
+        def labels(**values):
+            return ",".join('{}="{}"'.format(key, str(value).replace('\\', '\\\\')
+                                             .replace('"', '\\"'))
+                            for key, value in values.items())
+
+        with self._lock:
+            stages = sorted(self.stages.items())
+            counters = sorted(self.counters.items())
+
+        lines = ["# HELP net_reminder_stage_seconds Seconds spent in each pipeline stage",
+                 "# TYPE net_reminder_stage_seconds gauge"]
+        lines += [f"net_reminder_stage_seconds{{{labels(stage=name, tenant=tenant)}}} "
+                  f"{seconds:.6f}" for (name, tenant), (_, seconds) in stages]
+        lines += ["# HELP net_reminder_stage_calls Calls of each pipeline stage",
+                  "# TYPE net_reminder_stage_calls gauge"]
+        lines += [f"net_reminder_stage_calls{{{labels(stage=name, tenant=tenant)}}} {count}"
+                  for (name, tenant), (count, _) in stages]
+
+        for name in sorted({name for (name, _), _ in counters}):
+            lines += [f"# HELP net_reminder_{name} Run total of {name.replace('_', ' ')}",
+                      f"# TYPE net_reminder_{name} gauge"]
+            lines += [f"net_reminder_{name}{{{labels(tenant=tenant)}}} {value}"
+                      for (counter, tenant), value in counters if counter == name]
+
+        lines += ["# HELP net_reminder_run_seconds Wall time of the run",
+                  "# TYPE net_reminder_run_seconds gauge",
+                  f"net_reminder_run_seconds {time.time() - self.started:.6f}",
+                  "# HELP net_reminder_last_run_timestamp_seconds End of the run",
+                  "# TYPE net_reminder_last_run_timestamp_seconds gauge",
+                  f"net_reminder_last_run_timestamp_seconds {time.time():.3f}"]
+        return "\n".join(lines) + "\n"
+
+    def flush(self, script_config=None):
+        """Reports the run's metrics and starts a new run
+
+        Every event is logged as a JSON line, appended to metrics_file when
+        configured, and the Prometheus metrics are written to
+        metrics_textfile (e.g. for node_exporter's textfile collector).
+
+        Args: DICTIONARY script_config: Configuration with the optional outputs
+
+        Returns: LIST of DICTIONARY events
+        """
+        script_config = script_config or {}
+        events = self.events()
+
+        for event in events:
+            logger.info("metrics %s", json.dumps(event, sort_keys=True))
+
+        try:
+            if script_config.get('metrics_file') is not None:
+                with open(script_config['metrics_file'], 'a', encoding='UTF-8') as f:
+                    f.writelines(json.dumps(event, sort_keys=True) + "\n" for event in events)
+
+            if script_config.get('metrics_textfile') is not None:
+                text = self.prometheus()
+                write_atomic(script_config['metrics_textfile'],
+                             lambda f: f.write(text.encode('UTF-8')))
+        except OSError as exc:
+            logger.error("Unable to write metrics: %s", exc)
+
+        self.reset()
+        return events
+
+    def reset(self):
+        """Clears every stage and counter
+
+        Args: None
+
+        Returns: None
+        """
+        with self._lock:
+            self.started = time.time()
+            self.stages = {}
+            self.counters = {}
+
+
+# Metrics of the current run
+METRICS = Metrics()
+
+
+#######################################
+# Profiling
+#######################################
+class StageProfiler:
+    """Profiles a run with cProfile and tracemalloc, stage by stage
+
+    Every pipeline stage timed by METRICS gets its own cProfile profile,
+    switched in on entry and out on exit, so a hotspot is charged to the
+    stage it happened in. Time outside any stage is charged to "run". Only
+    the main thread is profiled per stage; stages in tenant or download
+    worker threads show up as waits in the stage that started them.
+
+    tracemalloc records each stage's peak traced memory (Python 3.9+). The
+    peak is reset whenever a stage starts, so before every reset the peak so
+    far is folded into each open stage and into the run's maximum. A snapshot
+    of the allocation sites is taken at the exit of the stage that reached
+    the highest peak, by which time some of its memory may have been freed.
+
+    Args: INTEGER top: Functions listed per stage, allocation sites listed
+    """
+
+    def __init__(self, top=15):
+        self.top = top
+        self.profiles = {}
+        self.calls = {}
+        self.peaks = {}
+        self.stack = []
+        self.tokens = 0
+        self.run_peak = 0
+        self.snapshot = None
+        self.snapshot_stage = None
+        self.snapshot_peak = 0
+        self.started = None
+        self.seconds = None
+
+    def start(self):
+        """Starts profiling the run
+
+        Args: None
+
+        Returns: None
+        """
+        import tracemalloc
+
+        tracemalloc.start(25)
+        self.started = time.perf_counter()
+        self.enter('run')
+
+    def stop(self):
+        """Stops profiling
+
+        Args: None
+
+        Returns: None
+        """
+        import tracemalloc
+
+        while self.stack:
+            self.exit()
+        self.seconds = time.perf_counter() - self.started
+        self.peaks['run'] = self.run_peak
+        if self.snapshot is None:
+            self.snapshot = tracemalloc.take_snapshot()
+            self.snapshot_stage = 'run'
+        tracemalloc.stop()
+
+    def enter(self, name):
+        """Switches profiling to a stage
+
+        Args: STRING name
+
+        Returns: INTEGER token to pass to exit
+        """
+        import cProfile
+        import tracemalloc
 
+        if self.stack:
+            self.profiles[self.stack[-1][1]].disable()
+        self.fold_peak()
+        if hasattr(tracemalloc, 'reset_peak'):
+            tracemalloc.reset_peak()
+        self.tokens += 1
+        # [token, name, peak traced memory while open]
+        self.stack.append([self.tokens, name, 0])
+        self.calls[name] = self.calls.get(name, 0) + 1
+        self.profiles.setdefault(name, cProfile.Profile()).enable()
+        return self.tokens
 
-def email_net_notice (net_vars):
-    """Sends an email reminder to the membership of the upcoming net
+    def exit(self, token=None):
+        """Ends the stage entered with token
 
-        Args: DICTIONARY    net_vars
+        Stages entered by interleaved coroutines can end in any order, so the
+        entry is found by its token rather than taken from the top. Ending a
+        stage that is not the innermost leaves the innermost one profiling.
+
+        Args: INTEGER token: From enter, None for the innermost stage
+
+        Returns: None
+        """
+        import tracemalloc
+
+        self.fold_peak()
+        index = len(self.stack) - 1
+        if token is not None:
+            index = next(i for i, entry in enumerate(self.stack) if entry[0] == token)
+        innermost = index == len(self.stack) - 1
+        _, name, peak = self.stack.pop(index)
+        if innermost:
+            self.profiles[name].disable()
+
+        if hasattr(tracemalloc, 'reset_peak'):
+            self.peaks[name] = max(self.peaks.get(name, 0), peak)
+            if peak > self.snapshot_peak:
+                self.snapshot_peak = peak
+                self.snapshot = tracemalloc.take_snapshot()
+                self.snapshot_stage = name
+
+        if innermost and self.stack:
+            self.profiles[self.stack[-1][1]].enable()
+
+    def fold_peak(self):
+        """Charges the peak since the last reset to every open stage and the run
+
+        Args: None
 
         Returns: None
+        """
+        import tracemalloc
+
+        peak = tracemalloc.get_traced_memory()[1]
+        for entry in self.stack:
+            entry[2] = max(entry[2], peak)
+        self.run_peak = max(self.run_peak, peak)
+
+    def stage(self, name):
+        """Returns a context manager profiling a stage (main thread only)
+
+        Args: STRING name
+
+        Returns: OBJECT context manager
+        """
+        from contextlib import contextmanager, nullcontext
+
+        if threading.current_thread() is not threading.main_thread():
+            return nullcontext()
+
+        @contextmanager
+        def profiled():
+            token = self.enter(name)
+            try:
+                yield
+            finally:
+                self.exit(token)
+
+        return profiled()
+
+    def write(self, filename):
+        """Writes the combined pstats file and a readable report beside it
+
+        Args: STRING filename: pstats file; the report goes to filename.txt
+
+        Returns: STRING report filename
+        """
+        import io
+        import pstats
+        import tracemalloc
+
+        profiles = list(self.profiles.values())
+        combined = pstats.Stats(profiles[0])
+        for profile in profiles[1:]:
+            combined.add(profile)
+        combined.dump_stats(filename)
+
+        out = io.StringIO()
+        out.write(f"net_reminder.py {SCRIPT_VERSION} profile, "
+                  f"{datetime.now().isoformat(timespec='seconds')}\n")
+        out.write(f"Run: {self.seconds:.3f}s, peak traced memory "
+                  f"{self.peaks.get('run', 0) / 2**20:.1f} MiB\n")
+        out.write("Only the main thread is profiled: stages run in tenant or download "
+                  "worker threads are not covered and show up as waits in the stage "
+                  "that started them\n")
+
+        for name in sorted(self.profiles, key=lambda stage: stage != 'run'):
+            stats = pstats.Stats(self.profiles[name], stream=out)
+            peak = f", peak {self.peaks[name] / 2**20:.1f} MiB" if name in self.peaks else ""
+            out.write(f"\n== Stage {name}: {self.calls[name]} calls, "
+                      f"{stats.total_tt:.3f}s profiled{peak} ==\n")
+            stats.strip_dirs().sort_stats('tottime').print_stats(self.top)
+
+        out.write(f"\n== Allocation sites at the exit of stage {self.snapshot_stage}, "
+                  f"the highest peak ==\n")
+        snapshot = self.snapshot.filter_traces(
+            [tracemalloc.Filter(False, tracemalloc.__file__)])
+        for stat in snapshot.statistics('lineno')[:self.top]:
+            frame = stat.traceback[0]
+            out.write(f"{stat.size / 1024:10.1f} KiB {stat.count:8} blocks  "
+                      f"{frame.filename}:{frame.lineno}\n")
+
+        report = filename + '.txt'
+        with open(report, 'w', encoding='UTF-8') as f:
+            f.write(out.getvalue())
+        return report
+
+
+#######################################
+# Workbook Readers
+#######################################
+def plain_value(value):
+    """Converts a cell value read by pandas into a plain Python value
+
+    Args: OBJECT value
+
+    Returns: OBJECT value with NaN/NaT as None and numpy scalars unwrapped
     """
+    if value is None or value != value:
+        return None
+    if hasattr(value, 'item'):
+        return value.item()
+    return value
 
-    logo = net_vars['logo']
 
-    email_body = fill_email_net_notice_template(net_vars)
-    email_subject = create_email_subject(net_vars)
-    email_dist = gather_email_addresses()
+def select_columns(sheet_name, header, rows, columns):
+    """Picks named columns out of a sheet's rows
 
-    if logo is not None:
-        img_data = None
-        with open(logo, 'rb') as f:
-            img_data = f.read()
+    Rows where every selected cell is empty are dropped.
 
-    msg = MIMEMultipart()
-    text = MIMEText(email_body, 'html')
-    msg.attach(text)
+    Args:   STRING sheet_name: For error messages
+            LIST header: Column names of the header row
+            ITERABLE rows: Remaining rows as sequences of cell values
+            LIST columns: Column names to keep, None for every named column
 
-    if logo is not None:
-        image = MIMEImage(img_data, name=os.path.basename(logo), maintype='image',
-                        subtype='png')
-        msg.attach(image)
+    Returns: DICTIONARY {column: LIST values}
+    """
+    header = [None if name is None else str(name).strip() for name in header]
+    if columns is None:
+        columns = [name for name in header if name]
 
-    me = SCRIPT_CONFIG['smtp_auth_user']
-    logging.info("Email From: %s", me)
+    positions = []
+    for column in columns:
+        if column not in header:
+            raise NetReminderError(f"Sheet {sheet_name} has no {column} column")
+        positions.append(header.index(column))
 
-    if TEST is False:
-        msg['Subject'] = email_subject
-        msg['From'] = SCRIPT_CONFIG['email_from']
+    values = {column: [] for column in columns}
+    for row in rows:
+        cells = [row[i] if i < len(row) else None for i in positions]
+        cells = [None if cell == '' else cell for cell in cells]
+        if all(cell is None for cell in cells):
+            continue
+        for column, cell in zip(columns, cells):
+            values[column].append(cell)
 
-        if EMAIL_REPLY_TO is None:
-            msg['Reply-to'] = SCRIPT_CONFIG['email_reply_to']
+    return values
 
-        if TEST_EMAIL is not None:
-            logging.info("Sending test email")
-            msg['To'] = TEST_EMAIL
-            email_dist = [TEST_EMAIL]
-        else:
-            msg['To'] = ", ".join(email_dist)
 
-        logger.info("Subject: %s", msg['Subject'])
-        logger.info("From: %s", msg['From'])
-        logger.info("To: %s", msg['To'])
-        logger.info("CC: %s", msg['Cc'])
-        logger.info("BCC: %s", msg['Bcc'])
+def read_sheets_openpyxl(filename, sheet_names, skiprows=0, columns=None):
+    """Streams sheets with openpyxl in read-only mode
 
-        if EMAIL_REPLY_TO is not None:
-            logger.info("Reply-to: %s", msg['Reply-to'],
-                        )
+    Args:   STRING filename: Excel workbook
+            LIST sheet_names
+            INTEGER skiprows: Rows above the header row
+            LIST columns: Column names to keep, None for every named column
 
-        # Send the message via our own SMTP server, but don't include the
-        # envelope header.
-        s = smtplib.SMTP_SSL(SCRIPT_CONFIG['smtp_server'],
-                             port=SCRIPT_CONFIG['smtp_port'])
-        s.ehlo()
-        s.login(me, SCRIPT_CONFIG['smtp_auth_pass'])
-        s.sendmail(me, email_dist, msg.as_string())
-        s.close()
-    else:
-        logger.info("Test flag set on command line. Not sending email...")
-        print(email_body)
+    Returns: DICTIONARY {sheet: {column: LIST values}}
+    """
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(filename, read_only=True, data_only=True)
+    try:
+        sheets = {}
+        for name in sheet_names:
+            if name not in workbook.sheetnames:
+                raise NetReminderError(f"Worksheet named '{name}' not found in {filename}")
 
+            rows = workbook[name].iter_rows(values_only=True)
+            for _ in range(skiprows):
+                next(rows, None)
+            sheets[name] = select_columns(name, next(rows, ()), rows, columns)
+        return sheets
+    finally:
+        workbook.close()
 
-def fetch_remote_file(url, filename, user, password):
-    """Fetch file from Nextcloud
-    
-    Args:   STRING url
-            STRING filename
-            STRING user
-            STRING password
-            
-    Return: None
+
+def read_sheets_csv(filename, sheet_names, skiprows=0, columns=None):
+    """Reads a CSV file as a single sheet
+
+    CSV files have no sheets, so every requested sheet name returns the
+    file's contents.
+
+    Args:   STRING filename: CSV file
+            LIST sheet_names
+            INTEGER skiprows: Rows above the header row
+            LIST columns: Column names to keep, None for every named column
+
+    Returns: DICTIONARY {sheet: {column: LIST values}}
+    """
+    import csv
+
+    with open(filename, 'r', encoding='UTF-8-sig', newline='') as f:
+        rows = csv.reader(f)
+        for _ in range(skiprows):
+            next(rows, None)
+        values = select_columns(filename, next(rows, []), rows, columns)
+
+    return {name: values for name in sheet_names}
+
+
+def read_sheets_pandas(filename, sheet_names, skiprows=0, columns=None):
+    """Reads sheets with pandas.read_excel (requires pandas)
+
+    Args:   STRING filename: Excel workbook
+            LIST sheet_names
+            INTEGER skiprows: Rows above the header row
+            LIST columns: Column names to keep, None for every named column
+
+    Returns: DICTIONARY {sheet: {column: LIST values}}
     """
+    pd = optional_import('pandas', "The pandas workbook backend")
 
     try:
+        frames = pd.read_excel(filename, sheet_name=list(sheet_names), skiprows=skiprows,
+                               header=0, usecols=None if columns is None else list(columns))
+    except ValueError as exc:
+        raise NetReminderError(f"Unable to read {filename}: {exc}") from exc
 
-        req = requests.request(method='get',
-                        url=url,
-                        auth=(user,password), timeout=30)
-        logger.info("File request %s status code: %s", url, req.status_code)
+    return {name: select_columns(name, list(frame.columns),
+                                 ([plain_value(value) for value in row]
+                                  for row in frame.itertuples(index=False)),
+                                 columns)
+            for name, frame in frames.items()}
 
-        if req.status_code == 200:
-            if os.path.isfile(filename):
-                os.unlink(filename)
 
-            with open(filename, 'wb') as f:
-                for chunk in req.iter_content(chunk_size=512 * 1024):
-                    if chunk: # filter out keep-alive new chunks
-                        f.write(chunk)
-                f.close()
-        else:
-            logger.fatal("Request for file %s failed: %s",
-                         filename,
-                         req.reason
-                         )
-            sys.exit()
+# Workbook reader backends by name
+WORKBOOK_BACKENDS = {
+    'openpyxl': read_sheets_openpyxl,
+    'pandas': read_sheets_pandas,
+    'csv': read_sheets_csv,
+}
 
-    except (IOError, requests.exceptions.Timeout) as e:
-        logger.fatal(e)
-        sys.exit()
 
+def read_workbook(filename, sheet_names, skiprows=0, columns=None, backend=None, build=None):
+    """Reads sheets of a workbook into plain Python columns
 
-def log_setup(filename):
-    """Setups up timed rotation of logging
-    
-    Args: STRING filename Ex: test.log
+    Args:   STRING filename: Workbook
+            LIST sheet_names
+            INTEGER skiprows: Rows above the header row
+            LIST columns: Column names to keep, None for every named column
+            STRING backend: Name in WORKBOOK_BACKENDS (default: csv for .csv files,
+                otherwise openpyxl)
+            FUNCTION build: Applied to the {sheet: {column: values}} result
 
-    Returns: OBJECT logger
+    Returns: OBJECT result of build, or the {sheet: {column: values}} result
     """
-    when_rotate = 'W6'
-    backup_count = 2
-    when_interval = 4
+    if backend is None:
+        backend = 'csv' if filename.lower().endswith('.csv') else 'openpyxl'
+    if backend not in WORKBOOK_BACKENDS:
+        raise NetReminderError(f"Unknown workbook backend: {backend}")
 
-    log_handler =  handlers.TimedRotatingFileHandler(filename,
-                                                     when=when_rotate,
-                                                     interval=when_interval,
-                                                     backupCount=backup_count)
-    formatter = logging.Formatter(
-        '%(asctime)s net_reminder.py [%(lineno)d]: %(message)s',
-        '%m/%d/%Y %H:%M:%S')
-    log_handler.setFormatter(formatter)
-    timed_logger = logging.getLogger()
-    timed_logger.addHandler(log_handler)
-    timed_logger.setLevel(logging.INFO)
+    sheets = WORKBOOK_BACKENDS[backend](filename, list(sheet_names), skiprows,
+                                        None if columns is None else list(columns))
+    METRICS.count('rows_parsed', sum(max(map(len, sheet.values()), default=0)
+                                     for sheet in sheets.values()))
+    return sheets if build is None else build(sheets)
 
-    return timed_logger
 
+# Part of every workbook cache key, with SCRIPT_VERSION: raise it whenever a
+# build function's result changes shape, so old pickles are never loaded
+WORKBOOK_CACHE_FORMAT = 1
 
-###########################################################
-# Begin Script
-###########################################################
 
-s_net_vars = {}
-
-# Grab the command line args
-try:
-    OPTS, args = getopt.getopt(sys.argv[1:], "c:l:hn:ts:e:q:x:f",
-                            ["help", "config=", "econfig=", "fetch_remote", "nconfig=", "log=",
-                                "now=","subject=","test","test_email="]
-                            )
-except getopt.GetoptError as e:
-    print(e)
-    usage()
-    sys.exit()
-
-try:
-    for o, a in OPTS:
-        if o in ["-c", "--config"]:
-            CONFIG_FILE = a
-        elif o in ["-h", "--help"]:
-            usage()
-            sys.exit()
-        elif o in ["-l","--log"]:
-            LOG_NAME = a
-        elif o in ["-e","--econfig"]:
-            EMAIL_CONFIG = a
-        elif o in ["-x","--nconfig"]:
-            NO_NET_CONTROL_EMAIL_CONFIG = a
-        elif o in ["-n","--now"]:
-            NOW = datetime.strptime(a, '%m/%d/%Y')
-        elif o in ["-s","--subject"]:
-            EMAIL_SUBJECT_TEMPLATE = a
-        elif o in ["-t","--test"]:
-            TEST = True
-        elif o in ["-f","--fetch_remote"]:
-            FETCH_REMOTE_FILES = True
-        elif o in ["-q","--test_email"]:
-            TEST_EMAIL = a
-        else:
-            usage()
-            sys.exit()
-except ValueError as e:
-    print(e)
-    sys.exit()
-
-if LOG_NAME is None:
-    LOG_NAME = "net_reminder.log"
-if CONFIG_FILE is None:
-    CONFIG_FILE = "net_reminder.yaml"
-if NOW is None:
-    NOW = datetime.now()
-
-# Setup logging
-logger = log_setup(LOG_NAME)
-logger.info("Starting net_reminder.py %s", SCRIPT_VERSION)
-
-with open(CONFIG_FILE, 'r', encoding='UTF-8') as yconfig_file:
+def read_workbook_cached(filename, sheet_names, skiprows=0, columns=None, backend=None,
+                         build=None, cache_dir=None):
+    """Reads sheets of a workbook through a persistent on-disk cache
+
+    The result of read_workbook is pickled in cache_dir under a key made from
+    the workbook path, build, the read arguments, SCRIPT_VERSION and
+    WORKBOOK_CACHE_FORMAT. It holds only plain
+    Python data, so loading it imports no workbook library. An entry is
+    reused while the workbook's size and modification time match. When they
+    change, the content hash decides whether the entry is still good (a
+    re-downloaded but identical file) or must be rebuilt.
+
+    Args:   STRING filename: Workbook
+            LIST sheet_names
+            INTEGER skiprows: Rows above the header row
+            LIST columns: Column names to keep, None for every named column
+            STRING backend: Name in WORKBOOK_BACKENDS
+            FUNCTION build: Converts the sheets into the data to cache
+            STRING cache_dir: Cache directory, None disables the cache
+
+    Returns: OBJECT result of build, or the {sheet: {column: values}} result
+    """
+    read_args = (list(sheet_names), skiprows, None if columns is None else list(columns),
+                 backend)
+
+    if cache_dir is None:
+        return read_workbook(filename, *read_args, build=build)
+
+    build_name = None if build is None else build.__name__
+    key = hashlib.sha256(repr((SCRIPT_VERSION, WORKBOOK_CACHE_FORMAT, os.path.abspath(filename),
+                               build_name, read_args)).encode('UTF-8')).hexdigest()
+    cache_file = os.path.join(cache_dir, key + '.pkl')
+    stat = os.stat(filename)
+    content_hash = None
+    entry = None
+
     try:
-        SCRIPT_CONFIG = yaml.safe_load(yconfig_file)
+        with open(cache_file, 'rb') as f:
+            entry = pickle.load(f)
+    except FileNotFoundError:
+        pass
+    except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError) as exc:
+        logger.warning("Ignoring unreadable cache entry %s: %s", cache_file, exc)
 
-        if 'email_config' in SCRIPT_CONFIG.keys():
-            EMAIL_CONFIG = SCRIPT_CONFIG['email_config']
+    if entry is not None:
+        if (entry['mtime_ns'], entry['size']) == (stat.st_mtime_ns, stat.st_size):
+            logger.info("Workbook cache hit: %s %s", filename, sheet_names)
+            METRICS.count('workbook_cache_hits')
+            return entry['data']
 
-        if 'no_net_control_email_config' in SCRIPT_CONFIG.keys():
-            NO_NET_CONTROL_EMAIL_CONFIG = SCRIPT_CONFIG['no_net_control_email_config']
+        content_hash = file_digest(filename)
+        if entry['sha256'] == content_hash:
+            logger.info("Workbook cache hit (content): %s %s", filename, sheet_names)
+            METRICS.count('workbook_cache_hits')
+            entry['mtime_ns'] = stat.st_mtime_ns
+            entry['size'] = stat.st_size
+            write_cache_entry(cache_file, entry)
+            return entry['data']
 
-        if 'logo' not in SCRIPT_CONFIG.keys():
-            SCRIPT_CONFIG['logo'] = None
+    logger.info("Workbook cache miss: %s %s", filename, sheet_names)
+    METRICS.count('workbook_cache_misses')
+    if content_hash is None:
+        content_hash = file_digest(filename)
+    data = read_workbook(filename, *read_args, build=build)
+    write_cache_entry(cache_file, {'mtime_ns': stat.st_mtime_ns,
+                                   'size': stat.st_size,
+                                   'sha256': content_hash,
+                                   'data': data})
+    return data
 
-        # If the email subject template is defined in the configuration file,
-        # then use it.
-        if 'email_subject_template' in SCRIPT_CONFIG.keys():
-            EMAIL_SUBJECT_TEMPLATE = SCRIPT_CONFIG['email_subject_template']
-
-        if 'no_net_control_email_subject_template' in SCRIPT_CONFIG.keys():
-            NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE = \
-                SCRIPT_CONFIG['no_net_control_email_subject_template']
-
-    except yaml.YAMLError as exc:
-        print(exc)
-        logger.fatal(exc)
-        sys.exit()
-
-try:
-
-    if FETCH_REMOTE_FILES is True:
-        logger.info("Fetching remote files")
-        fetch_remote_file(SCRIPT_CONFIG['url_roster'],
-                          SCRIPT_CONFIG['roster_excel_file'],
-                          SCRIPT_CONFIG['url_user'],
-                          SCRIPT_CONFIG['url_pass']
-                          )
-
-        fetch_remote_file(SCRIPT_CONFIG['url_schedule'],
-                          SCRIPT_CONFIG['schedule_excel_file'],
-                          SCRIPT_CONFIG['url_user'],
-                          SCRIPT_CONFIG['url_pass']
-                          )
-    else:
-        logger.info("Using local files")
-
-except KeyError as e:
-    print(e)
-    logger.fatal(e)
-    sys.exit()
-
-try:
-  # Use the email config default if all else fails
-    if EMAIL_CONFIG is None:
-        EMAIL_CONFIG = "net_reminder.html"
-
-  # Use the email config default if all else fails
-    if NO_NET_CONTROL_EMAIL_CONFIG is None:
-        NO_NET_CONTROL_EMAIL_CONFIG = "no_net_reminder.html"
-
-    # Use the email subject default if all else fails
-    if EMAIL_SUBJECT_TEMPLATE is None:
-        EMAIL_SUBJECT_TEMPLATE = "{0} Net for {1}"
-
-    # Use the email subject default if all else fails
-    if NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE is None:
-        NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE = "Net for {0}"
-
-    future_date_1wk = NOW + timedelta(days=7)
-    future_date_2wk = future_date_1wk + timedelta(days=7)
-    logging.info("Current Date: %s, Future Date 1wk: %s, Future Date 2wk: %s",
-                 NOW, future_date_1wk, future_date_2wk)
-
-    # Opening the Net Control Schedule to locate the Primary and Backup Net Control assignments
-    df_sched = pd.read_excel(SCRIPT_CONFIG['schedule_excel_file'],
-                             sheet_name=SCRIPT_CONFIG['schedule_sheet_name'],
-                             skiprows=1, header=0)
-
-    df_sched.DATE = pd.to_datetime(df_sched.DATE,format='%Y-%m-%d')
-
-    # Get this week's Net date
-    df_select_cur = df_sched[(df_sched.DATE >=
-                              NOW.strptime(str(NOW)[:10], '%Y-%m-%d')) &
-                             (df_sched.DATE <=
-                              future_date_1wk)]
-
-    if df_select_cur.empty:
-        logging.fatal("No configured net control or backup net control for this week!",
-                      )
-        email_no_net_notice()
-        sys.exit()
-
-    logging.info(df_select_cur.head())
-
-    # Get next future Net date
-    df_select_next = df_sched[(df_sched.DATE >=
-                               future_date_1wk.strptime(str(future_date_1wk)[:10], '%Y-%m-%d')) &
-                              (df_sched.DATE <=
-                               future_date_2wk)]
-    if df_select_next.empty:
-        logging.fatal("No configured net control or backup net control for next week!")
-        email_no_net_notice()
-        sys.exit()
-
-    logging.info(df_select_next.head())
-
-    F = "%Y-%m-%d"
-    date_val_cur = datetime.strptime( str(df_select_cur['DATE'].values[0])[:10], F)
-    date_val_next = datetime.strptime( str(df_select_next['DATE'].values[0])[:10], F)
-
-    # Dates for this week and next week's Nets
-    s_net_vars['net_date'] = date_val_cur.strftime("%m/%d/%Y")
-    s_net_vars['next_net_date'] = date_val_next.strftime("%m/%d/%Y")
-
-    # Current week net details
-    s_net_vars['current_primary'] = df_select_cur['PRIMARY'].values[0]
-    s_net_vars['current_backup'] = df_select_cur['BACKUP'].values[0]
-
-    # Next week net details
-    s_net_vars['next_primary'] = df_select_next['PRIMARY'].values[0]
-    s_net_vars['next_backup'] = df_select_next['BACKUP'].values[0]
-
-    logger.info("Date Value Current: %s, Date Value Next: %s",
-                s_net_vars['net_date'],
-                s_net_vars['next_net_date']
-                )
-    logger.info("Net Date: %s, Primary: %s, Backup: %s",
-                s_net_vars['net_date'],
-                s_net_vars['current_primary'],
-                s_net_vars['current_backup']
-                )
-    logger.info("Net Date: %s, Primary: %s, Backup: %s",
-                s_net_vars['next_net_date'],
-                s_net_vars['next_primary'],
-                s_net_vars['next_backup']
-                )
-
-    s_net_vars['net_type'] = df_select_cur['Net'].values[0]
-    s_net_vars['logo'] = SCRIPT_CONFIG['logo']
-
-    email_net_notice(s_net_vars)
-except (DataError, KeyError) as e:
-    print(e)
-    logging.fatal(e)
-    sys.exit(e)
-
-logging.info("Finished")
-sys.exit()
+
+def write_cache_entry(cache_file, entry):
+    """Atomically writes a pickled cache entry
+
+    Args:   STRING cache_file
+            DICTIONARY entry
+
+    Returns: None
+    """
+    cache_dir = os.path.dirname(cache_file)
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=cache_dir, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(entry, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_name, cache_file)
+        except BaseException:
+            os.unlink(tmp_name)
+            raise
+    except OSError as exc:
+        # The cache is an optimization only
+        logger.warning("Unable to write cache entry %s: %s", cache_file, exc)
+
+
+# Compiled template environments, one per template directory and cache
+TEMPLATE_ENVIRONMENTS = {}
+# Compiled built-in templates, keyed by their source
+DEFAULT_TEMPLATES = {}
+
+
+def template_environment(directory, cache_dir=None):
+    """Returns the shared Jinja2 environment for a template directory
+
+    Environments compile each template once and keep it in memory, checking
+    the file's modification time on use (auto_reload) so edited templates are
+    picked up. With a cache_dir, compiled bytecode is also stored on disk under
+    cache_dir/jinja2 and reused by later runs.
+
+    Args:   STRING directory: Directory holding the templates
+            STRING cache_dir: Cache directory, None for no bytecode cache
+
+    Returns: OBJECT jinja2.Environment
+    """
+    key = (os.path.abspath(directory), cache_dir)
+    env = TEMPLATE_ENVIRONMENTS.get(key)
+
+    if env is None:
+        from jinja2 import Environment, FileSystemBytecodeCache, FileSystemLoader
+
+        bytecode_cache = None
+        if cache_dir is not None:
+            bytecode_dir = os.path.join(cache_dir, 'jinja2')
+            os.makedirs(bytecode_dir, exist_ok=True)
+            bytecode_cache = FileSystemBytecodeCache(bytecode_dir)
+
+        env = Environment(loader=FileSystemLoader(directory),
+                          auto_reload=True,
+                          bytecode_cache=bytecode_cache)
+        TEMPLATE_ENVIRONMENTS[key] = env
+
+    return env
+
+
+def load_template(filename, default_source, cache_dir=None):
+    """Loads a compiled email template, falling back to a built-in default
+
+    Args:   STRING filename: Template file
+            STRING default_source: Template source used when the file can't be read
+            STRING cache_dir: Cache directory for compiled bytecode
+
+    Returns: OBJECT jinja2.Template
+    """
+    from jinja2 import TemplateNotFound
+
+    env = template_environment(os.path.dirname(filename) or '.', cache_dir)
+
+    try:
+        template = env.get_template(os.path.basename(filename))
+        logger.info("Using email configuration file: %s", filename)
+    except (TemplateNotFound, OSError) as exc:
+        logger.warning("Unable to read email configuration file %s (%s), using the default",
+                       filename, exc)
+        template = DEFAULT_TEMPLATES.get(default_source)
+        if template is None:
+            template = DEFAULT_TEMPLATES[default_source] = env.from_string(default_source)
+
+    return template
+
+
+def log_setup(filename, settings=None):
+    """Sets up logging through a queue to a rotating log file
+
+    Records are queued by the logging thread and formatted and written by a
+    QueueListener thread, so log I/O stays off the send path. Calling it
+    again (e.g. once the configuration is loaded) replaces the previous
+    handler after flushing it.
+
+    The configuration may set log_level (INFO), log_format, log_date_format,
+    log_when (W6), log_interval (4) and log_backup_count (2) for timed
+    rotation, or log_max_bytes to rotate by size instead, and log_max_items
+    (20), the longest list logged in full (see LogSummary).
+
+    Args:   STRING filename Ex: test.log
+            DICTIONARY settings: Configuration holding the log_* keys (default: None)
+
+    Returns: OBJECT logger
+    """
+    import atexit
+    import queue
+
+    settings = settings or {}
+
+    if settings.get('log_max_bytes'):
+        log_handler = handlers.RotatingFileHandler(filename,
+                                                   maxBytes=settings['log_max_bytes'],
+                                                   backupCount=settings.get('log_backup_count', 2))
+    else:
+        log_handler = handlers.TimedRotatingFileHandler(filename,
+                                                        when=settings.get('log_when', 'W6'),
+                                                        interval=settings.get('log_interval', 4),
+                                                        backupCount=settings.get('log_backup_count',
+                                                                                 2))
+    formatter = logging.Formatter(
+        settings.get('log_format', '%(asctime)s net_reminder.py [%(lineno)d]: %(message)s'),
+        settings.get('log_date_format', '%m/%d/%Y %H:%M:%S'))
+    log_handler.setFormatter(formatter)
+
+    log_queue = queue.SimpleQueue()
+    queue_handler = handlers.QueueHandler(log_queue)
+    listener = handlers.QueueListener(log_queue, log_handler)
+    listener.start()
+
+    timed_logger = logging.getLogger()
+    timed_logger.addHandler(queue_handler)
+    timed_logger.setLevel(str(settings.get('log_level', 'INFO')).upper())
+
+    if LOG_PIPELINE.get('handler') is not None:
+        timed_logger.removeHandler(LOG_PIPELINE['handler'])
+        LOG_PIPELINE['listener'].stop()
+        LOG_PIPELINE['listener'].handlers[0].close()
+    else:
+        atexit.register(log_shutdown)
+
+    LOG_PIPELINE.update(handler=queue_handler, listener=listener,
+                        max_items=settings.get('log_max_items', 20))
+    return timed_logger
+
+
+def log_shutdown():
+    """Writes out the queued log records and stops the log listener
+
+    Args: None
+
+    Returns: None
+    """
+    if LOG_PIPELINE.get('handler') is not None:
+        logging.getLogger().removeHandler(LOG_PIPELINE['handler'])
+        LOG_PIPELINE['listener'].stop()
+        LOG_PIPELINE['listener'].handlers[0].close()
+        LOG_PIPELINE['handler'] = None
+
+
+class LogSummary:
+    """Formats a long list for the log only when a handler takes the record
+
+    Nothing is formatted for a record below the log level. An emitted record
+    is formatted by QueueHandler.prepare in the thread that logs it, before
+    it is queued, so the list is read while it is still current.
+
+    Lists of up to log_max_items items, or any list while debug logging is
+    enabled, are written in full. Longer ones are written as their count,
+    first items and a digest, which still tells two runs apart.
+
+    Args:   LIST items: Items, or a ", " separated STRING of them (None logs as None)
+            INTEGER max_items: Overrides log_max_items
+    """
+
+    def __init__(self, items, max_items=None):
+        self.items = items.split(', ') if isinstance(items, str) else items
+        self.max_items = max_items
+
+    def __str__(self):
+        if self.items is None:
+            return 'None'
+
+        items = [str(item) for item in self.items]
+        max_items = LOG_PIPELINE.get('max_items', 20) if self.max_items is None \
+            else self.max_items
+        if len(items) <= max_items or logger.isEnabledFor(logging.DEBUG):
+            return ",".join(items)
+
+        digest = hashlib.sha256("\n".join(items).encode('UTF-8')).hexdigest()[:12]
+        return f"{len(items)} items ({','.join(items[:3])},...) sha256:{digest}"
+
+
+#######################################
+# Schedule and Roster Models
+#######################################
+def parse_schedule_date(value):
+    """Converts a schedule DATE cell into a date
+
+    Args: OBJECT value: datetime, date or a YYYY-MM-DD or mm/dd/YYYY string
+
+    Returns: DATE, or None for an empty or unreadable cell
+    """
+    if isinstance(value, datetime):
+        return value.date()
+    if isinstance(value, date):
+        return value
+    if isinstance(value, str):
+        for date_format in ('%Y-%m-%d', '%Y-%m-%d %H:%M:%S', '%m/%d/%Y'):
+            try:
+                return datetime.strptime(value.strip(), date_format).date()
+            except ValueError:
+                pass
+    return None
+
+
+def schedule_table(sheets):
+    """Converts the schedule sheet into sorted, plain Python columns
+
+    Rows without a readable DATE are dropped and the rest are sorted by date
+    (keeping the sheet order for equal dates).
+
+    Args: DICTIONARY sheets: {sheet: {column: values}} with the schedule sheet's
+              DATE, PRIMARY, BACKUP and Net columns
+
+    Returns: TUPLE (LIST day ordinals, LIST (primary, backup, net_type) rows)
+    """
+    sheet = next(iter(sheets.values()))
+    dated = []
+    for position, value in enumerate(sheet['DATE']):
+        net_date = parse_schedule_date(value)
+        if net_date is not None:
+            dated.append((net_date.toordinal(), position))
+    dated.sort()
+
+    ordinals = [ordinal for ordinal, _ in dated]
+    rows = [(sheet['PRIMARY'][position], sheet['BACKUP'][position], sheet['Net'][position])
+            for _, position in dated]
+    return ordinals, rows
+
+
+class NetAssignment:
+    """One net on the Net Control Schedule
+
+    Args:   INTEGER ordinal: Day ordinal of the net date
+            STRING primary: Primary net control
+            STRING backup: Backup net control
+            STRING net_type
+    """
+    __slots__ = ('ordinal', 'primary', 'backup', 'net_type')
+
+    def __init__(self, ordinal, primary, backup, net_type):
+        self.ordinal = ordinal
+        self.primary = primary
+        self.backup = backup
+        self.net_type = net_type
+
+    def __repr__(self):
+        return (f"NetAssignment({self.date.isoformat()}, {self.primary!r}, "
+                f"{self.backup!r}, {self.net_type!r})")
+
+    @property
+    def date(self):
+        """DATE of the net"""
+        return date.fromordinal(self.ordinal)
+
+    @property
+    def net_date(self):
+        """STRING date of the net as mm/dd/YYYY"""
+        return self.date.strftime("%m/%d/%Y")
+
+
+class Schedule:
+    """Sorted, binary-searchable Net Control Schedule
+
+    The net dates are kept as an array of day ordinals, so resolving the net
+    for any date is a bisect over machine integers instead of a scan of the
+    whole sheet. The assignments are built once and shared by every lookup.
+
+    Args:   LIST ordinals: Sorted day ordinals of the nets
+            LIST rows: (primary, backup, net_type) for each ordinal
+    """
+    __slots__ = ('ordinals', 'assignments')
+
+    def __init__(self, ordinals, rows):
+        self.ordinals = array('l', ordinals)
+        self.assignments = tuple(NetAssignment(ordinal, primary, backup, net_type)
+                                 for ordinal, (primary, backup, net_type) in zip(ordinals, rows))
+
+    def __len__(self):
+        return len(self.ordinals)
+
+    def net(self, position):
+        """Returns the net at a position in date order
+
+        Args: INTEGER position
+
+        Returns: OBJECT NetAssignment
+        """
+        return self.assignments[position]
+
+    def net_for(self, when, window_days=7):
+        """Finds the first net on or after a date within a look-ahead window
+
+        Args:   DATE when: Date (or datetime) to search from
+                INTEGER window_days: Days after when still counted (inclusive)
+
+        Returns: OBJECT NetAssignment, or None when no net falls in the window
+        """
+        start = when.toordinal()
+        position = bisect_left(self.ordinals, start)
+
+        if position == len(self.ordinals) or self.ordinals[position] > start + window_days:
+            return None
+
+        return self.assignments[position]
+
+    def next_nets(self, when, count):
+        """Lists the next nets on or after a date
+
+        Args:   DATE when: Date (or datetime) to search from
+                INTEGER count: Maximum number of nets to return
+
+        Returns: LIST of NetAssignment in date order
+        """
+        position = bisect_left(self.ordinals, when.toordinal())
+        return list(self.assignments[position:position + count])
+
+    def nets_between(self, start, end):
+        """Lists the nets from start to end, both inclusive
+
+        Args:   DATE start
+                DATE end
+
+        Returns: LIST of NetAssignment in date order
+        """
+        first = bisect_left(self.ordinals, start.toordinal())
+        last = bisect_right(self.ordinals, end.toordinal())
+        return list(self.assignments[first:last])
+
+
+class NetNotice:
+    """Everything needed to build one net reminder
+
+    Args:   OBJECT current: NetAssignment for this week
+            OBJECT following: NetAssignment for next week
+            LIST upcoming: NetAssignments after this week's
+            STRING logo: Logo file, or None
+    """
+    __slots__ = ('current', 'following', 'upcoming', 'logo')
+
+    def __init__(self, current, following, upcoming, logo=None):
+        self.current = current
+        self.following = following
+        self.upcoming = upcoming
+        self.logo = logo
+
+    def __repr__(self):
+        return f"NetNotice({self.current!r}, {self.following!r})"
+
+
+class Roster:
+    """Column-oriented member roster gathered from one or more sheets
+
+    Each column is a single tuple across all sheets (in sheet order), so a
+    roster costs one sequence per column rather than one dictionary per member.
+
+    Args: DICTIONARY columns: {column: values}, every column the same length
+    """
+    __slots__ = ('columns',)
+
+    def __init__(self, columns):
+        self.columns = {column: tuple(values) for column, values in columns.items()}
+
+    @classmethod
+    def from_sheets(cls, sheets, sheet_names, columns):
+        """Joins the roster sheets into a single roster
+
+        Args:   DICTIONARY sheets: {sheet: {column: values}} from read_workbook
+                LIST sheet_names: Sheets to join, in order
+                TUPLE columns: Columns to keep
+
+        Returns: OBJECT Roster
+        """
+        joined = {column: [] for column in columns}
+        for name in sheet_names:
+            for column in columns:
+                joined[column].extend(sheets[name][column])
+        return cls(joined)
+
+    def __len__(self):
+        return len(next(iter(self.columns.values()), ()))
+
+    def column(self, name):
+        """Returns one column of the roster
+
+        Args: STRING name
+
+        Returns: TUPLE values
+        """
+        return self.columns[name]
+
+    def emails(self, column='Email', index=None):
+        """Lists the member addresses
+
+        Cells are split and checked by a RecipientIndex: each address is kept
+        once (ignoring case) in its first spelling, and invalid or suppressed
+        addresses are dropped.
+
+        Args:   STRING column: Address column (default: Email)
+                OBJECT index: RecipientIndex to add to (default: a new one)
+
+        Returns: LIST of STRING addresses
+        """
+        return [email for email, _ in self.members((), column, index)]
+
+    def members(self, columns=(), email_column='Email', index=None):
+        """Lists every member address once with the member's fields
+
+        Addresses are cleaned up as in emails(); every address of a cell gets
+        the row's fields, and empty fields become ''.
+
+        Args:   TUPLE columns: Columns to return for each member
+                STRING email_column: Address column (default: Email)
+                OBJECT index: RecipientIndex to add to (default: a new one)
+
+        Returns: LIST of (STRING email, DICTIONARY {column: value}) tuples
+        """
+        if index is None:
+            index = RecipientIndex()
+
+        fields = [(column, self.columns[column]) for column in columns]
+        members = []
+        for position, value in enumerate(self.columns[email_column]):
+            addresses = index.add(value)
+            if addresses:
+                member = {column: '' if values[position] is None else values[position]
+                          for column, values in fields}
+                members.extend((email, member) for email in addresses)
+        return members
+
+
+#######################################
+# Schedule Changes
+#######################################
+class ScheduleChange:
+    """A net whose assignment differs from the stored schedule snapshot
+
+    Args:   DATE net_date: Net date
+            TUPLE before: (primary, backup, net_type) in the snapshot, None for a new net
+            TUPLE after: (primary, backup, net_type) now, None for a removed net
+    """
+
+    __slots__ = ('date', 'before', 'after')
+
+    def __init__(self, net_date, before, after):
+        self.date = net_date
+        self.before = before
+        self.after = after
+
+    def __repr__(self):
+        return f"ScheduleChange({self.date}, {self.before!r} -> {self.after!r})"
+
+    def operators(self):
+        """Lists the operators assigned before or after the change
+
+        Args: None
+
+        Returns: SET of STRING primary and backup names
+        """
+        return {str(name).strip() for row in (self.before, self.after) if row is not None
+                for name in row[:2] if name is not None and str(name).strip()}
+
+    def context(self):
+        """Returns the change as template variables
+
+        Args: None
+
+        Returns: DICTIONARY net_date, net_type, primary, backup and their previous_ values
+        """
+        before = self.before or (None, None, None)
+        after = self.after or (None, None, None)
+        return {'net_date': self.date.strftime("%m/%d/%Y"),
+                'net_type': after[2] or before[2],
+                'primary': after[0], 'backup': after[1],
+                'previous_primary': before[0], 'previous_backup': before[1],
+                'previous_net_type': before[2],
+                'added': self.before is None, 'removed': self.after is None}
+
+
+def schedule_nets(schedule):
+    """Lists each net's assignment as plain strings keyed by ISO date
+
+    Args: OBJECT schedule: Schedule
+
+    Returns: DICTIONARY {STRING date: LIST [primary, backup, net_type]}
+    """
+    return {net.date.isoformat(): [None if value is None else str(value)
+                                   for value in (net.primary, net.backup, net.net_type)]
+            for net in schedule.assignments}
+
+
+def schedule_snapshot(schedule, stat, digest):
+    """Records the schedule workbook and each net's assignment
+
+    Args:   OBJECT schedule: Schedule
+            OBJECT stat: os.stat of the workbook
+            STRING digest: sha256 of the workbook
+
+    Returns: DICTIONARY snapshot, JSON serializable
+    """
+    return {'mtime_ns': stat.st_mtime_ns,
+            'size': stat.st_size,
+            'sha256': digest,
+            'nets': schedule_nets(schedule)}
+
+
+def diff_schedule(nets, schedule, since):
+    """Compares the nets on or after a date with a snapshot's
+
+    Args:   DICTIONARY nets: 'nets' of a schedule_snapshot
+            OBJECT schedule: Schedule now
+            DATE since: First net date to compare
+
+    Returns: LIST of ScheduleChange in date order
+    """
+    current = schedule_nets(schedule)
+    start = since.isoformat()
+
+    changes = []
+    for key in sorted(set(nets) | set(current)):
+        if key < start or nets.get(key) == current.get(key):
+            continue
+        before, after = nets.get(key), current.get(key)
+        changes.append(ScheduleChange(date.fromisoformat(key),
+                                      None if before is None else tuple(before),
+                                      None if after is None else tuple(after)))
+    return changes
+
+
+#######################################
+# Recipients
+#######################################
+# Offline address syntax check: a dot-atom local part and a domain of two or
+# more labels. Quoted local parts, address literals and non-ASCII domains are
+# rejected.
+ADDRESS_PATTERN = re.compile(r"[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+"
+                             r"(?:\.[A-Za-z0-9!#$%&'*+/=?^_`{|}~-]+)*"
+                             r"@(?:[A-Za-z0-9](?:[A-Za-z0-9-]{0,61}[A-Za-z0-9])?\.)+"
+                             r"[A-Za-z]{2,63}")
+# Commas, semicolons and line breaks outside a quoted display name
+ADDRESS_SEPARATORS = re.compile(r'[,;\r\n](?=(?:[^"]*"[^"]*")*[^"]*$)')
+
+
+def split_addresses(value):
+    """Splits a roster cell into the addresses it holds
+
+    A cell may hold several addresses separated by commas, semicolons or line
+    breaks, written bare, as "Name <address>" or with a mailto: prefix. A
+    fragment that doesn't parse as a single address is returned as written,
+    so it is reported once as invalid.
+
+    Args: OBJECT value: Cell value
+
+    Returns: LIST of STRING addresses
+    """
+    from email.utils import getaddresses
+
+    if value is None:
+        return []
+
+    addresses = []
+    for fragment in ADDRESS_SEPARATORS.split(str(value)):
+        fragment = fragment.strip()
+        if fragment[:7].lower() == 'mailto:':
+            fragment = fragment[7:].strip()
+        if not fragment:
+            continue
+
+        parsed = getaddresses([fragment])
+        if len(parsed) == 1 and '@' in parsed[0][1]:
+            addresses.append(parsed[0][1].rstrip('.'))
+        else:
+            addresses.append(fragment)
+    return addresses
+
+
+class SuppressionList:
+    """Addresses never to send to, kept in a text file
+
+    One address per line, optionally followed by a note; blank lines and
+    lines starting with # are ignored. The addresses are held in a set, so
+    lookups stay constant time however long the list grows. The file is
+    reloaded by refresh() when it changes.
+
+    Args: STRING filename
+    """
+
+    def __init__(self, filename):
+        self.filename = filename
+        self.keys = set()
+        self.mtime_ns = None
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, address):
+        return address.lower() in self.keys
+
+    def refresh(self):
+        """Reloads the file when it was changed since it was read
+
+        Args: None
+
+        Returns: None
+        """
+        with self._lock:
+            try:
+                mtime_ns = os.stat(self.filename).st_mtime_ns
+            except FileNotFoundError:
+                self.keys, self.mtime_ns = set(), None
+                return
+
+            if mtime_ns == self.mtime_ns:
+                return
+
+            with open(self.filename, 'r', encoding='UTF-8') as f:
+                keys = {line.split(None, 1)[0].lower() for line in f
+                        if line.strip() and not line.lstrip().startswith('#')}
+            self.keys, self.mtime_ns = keys, mtime_ns
+        logger.info("Suppression list %s: %s addresses", self.filename, len(keys))
+
+    def add(self, addresses, note=''):
+        """Appends addresses to the list
+
+        Args:   LIST addresses
+                STRING note: Written after each address (e.g. the refusal)
+
+        Returns: INTEGER addresses added
+        """
+        with self._lock:
+            new = []
+            for address in addresses:
+                if address.lower() not in self.keys:
+                    self.keys.add(address.lower())
+                    new.append(address)
+            if not new:
+                return 0
+
+            stamp = datetime.now().strftime('%Y-%m-%d')
+            with open(self.filename, 'a', encoding='UTF-8') as f:
+                f.writelines(f"{address} {stamp} {note}".rstrip() + "\n" for address in new)
+            self.mtime_ns = os.stat(self.filename).st_mtime_ns
+            return len(new)
+
+
+class RecipientIndex:
+    """Normalizes, checks, dedupes and filters recipient addresses in one pass
+
+    Each address is kept with its first spelling; later ones matching it
+    ignoring case are duplicates. Addresses failing ADDRESS_PATTERN and those
+    in the suppression list are left out and counted.
+
+    Args: OBJECT suppressed: SuppressionList or set of lower-case addresses (default: None)
+    """
+
+    def __init__(self, suppressed=None):
+        self.suppressed = suppressed if suppressed is not None else frozenset()
+        self.seen = set()
+        self.accepted = 0
+        self.duplicates = 0
+        self.blocked = 0
+        self.invalid = []
+
+    def add(self, value):
+        """Adds the addresses of a cell
+
+        Args: OBJECT value: Cell value (see split_addresses)
+
+        Returns: LIST of STRING addresses not seen before, valid and not suppressed
+        """
+        accepted = []
+        for address in split_addresses(value):
+            key = address.lower()
+            if key in self.seen:
+                self.duplicates += 1
+                continue
+            self.seen.add(key)
+
+            if ADDRESS_PATTERN.fullmatch(address) is None:
+                self.invalid.append(address)
+            elif key in self.suppressed:
+                self.blocked += 1
+            else:
+                accepted.append(address)
+
+        self.accepted += len(accepted)
+        return accepted
+
+    def report(self):
+        """Logs and counts what was left out
+
+        Args: None
+
+        Returns: None
+        """
+        if self.invalid:
+            logger.warning("Skipping invalid addresses: %s", LogSummary(self.invalid))
+        logger.info("Recipients: %s, %s duplicates, %s invalid, %s suppressed",
+                    self.accepted, self.duplicates, len(self.invalid), self.blocked)
+        METRICS.count('recipients_duplicate', self.duplicates)
+        METRICS.count('recipients_invalid', len(self.invalid))
+        METRICS.count('recipients_suppressed', self.blocked)
+
+
+#######################################
+# Email Bodies
+#######################################
+# Jinja2 tokens, HTML comments and tags (which may hold Jinja2 tokens)
+TEMPLATE_TOKEN = re.compile(r"\{\{.*?\}\}|\{%.*?%\}|\{#.*?#\}|<!--.*?-->|"
+                            r"<[!/]?[A-Za-z](?:[^>{]|\{\{.*?\}\}|\{%.*?%\}|\{)*>", re.S)
+TAG_NAME = re.compile(r"<(/?)(!?[A-Za-z][\w-]*)")
+TAG_ATTRIBUTE = re.compile(r"""\s([\w:-]+)\s*=\s*("[^"]*"|'[^']*'|[^\s"'>]+)""")
+STYLE_ATTRIBUTE = re.compile(r"""\sstyle\s*=\s*("[^"]*"|'[^']*')""", re.I)
+# Type and class selectors, e.g. td, .font-small or td.note
+SIMPLE_SELECTOR = re.compile(r"([A-Za-z][\w-]*)?(?:\.([\w-]+))?")
+WHITESPACE = re.compile(r"\s+")
+TEXT_LINE_BREAK = re.compile(r"[ \t]*\n[ \t]*")
+TEXT_BLANK_LINES = re.compile(r"\n{3,}")
+# Elements whose content is kept as written
+RAW_TAGS = frozenset(('style', 'script', 'pre', 'textarea', 'title'))
+# Elements that start a new line, so the white space around them doesn't render
+BLOCK_TAGS = frozenset(('!doctype', 'html', 'head', 'body', 'meta', 'link', 'style', 'script',
+                        'title', 'table', 'thead', 'tbody', 'tfoot', 'tr', 'td', 'th', 'caption',
+                        'colgroup', 'col', 'p', 'div', 'center', 'ul', 'ol', 'li', 'dl', 'dt',
+                        'dd', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6', 'br', 'hr', 'blockquote',
+                        'pre', 'address', 'form'))
+# Elements style sheets don't apply to
+UNSTYLED_TAGS = frozenset(('html', 'head', 'meta', 'link', 'style', 'script', 'title', 'base',
+                           'br'))
+# Minified lines are broken at white space past this length, well short of
+# the 998 characters SMTP allows
+MINIFIED_LINE_LENGTH = 500
+# Elements followed by a blank line in the plain text
+PARAGRAPH_TAGS = frozenset(('p', 'table', 'ul', 'ol', 'h1', 'h2', 'h3', 'h4', 'h5', 'h6'))
+# Transformed templates by compiled template, so an edited template is
+# transformed again, then by options
+EMAIL_TEMPLATES = weakref.WeakKeyDictionary()
+EMAIL_TEMPLATES_LOCK = threading.Lock()
+
+
+def template_tokens(source):
+    """Splits an HTML template source into text, Jinja2 tokens, comments and tags
+
+    The content of style, script, pre, textarea and title elements is kept as
+    one raw token.
+
+    Args: STRING source
+
+    Returns: LIST of (STRING kind, STRING token, STRING name) tuples, kind being
+             text, jinja, comment, tag or raw and name the lower case tag name
+             (with a leading / for end tags) of tag and raw tokens
+    """
+    tokens = []
+    position = 0
+    lowered = None
+
+    while position < len(source):
+        match = TEMPLATE_TOKEN.search(source, position)
+        if match is None:
+            tokens.append(('text', source[position:], None))
+            break
+        if match.start() > position:
+            tokens.append(('text', source[position:match.start()], None))
+        token = match.group()
+        position = match.end()
+
+        if token[0] == '{':
+            tokens.append(('jinja', token, None))
+        elif token.startswith('<!--'):
+            tokens.append(('comment', token, None))
+        else:
+            slash, name = TAG_NAME.match(token).groups()
+            name = slash + name.lower()
+            tokens.append(('tag', token, name))
+            if name in RAW_TAGS:
+                if lowered is None:
+                    lowered = source.lower()
+                end = lowered.find('</' + name, position)
+                end = len(source) if end < 0 else end
+                tokens.append(('raw', source[position:end], name))
+                position = end
+
+    return tokens
+
+
+def tag_attributes(tag):
+    """Reads the quoted or bare attribute values of a tag
+
+    Args: STRING tag
+
+    Returns: DICTIONARY {STRING lower case name: STRING value}
+    """
+    return {name.lower(): value.strip('"\'') for name, value in TAG_ATTRIBUTE.findall(tag)}
+
+
+def parse_css(css):
+    """Splits a style sheet into the rules that can be inlined and the rest
+
+    Only type and class selectors (td, .font-small or td.note), alone or in
+    a comma separated group, are inlined, in the order class after type and
+    otherwise as written (no further specificity). Everything else is kept
+    in the style element on purpose, because it can't be written as a style
+    attribute or needs a real CSS engine to resolve: ids, attribute
+    selectors, pseudo-classes and pseudo-elements (a:hover), the universal
+    selector, combinators (table td, tr > td, h1 + p), selectors with more
+    than one class, and every @ rule (@media, @font-face, @import).
+    Declarations are copied as written, !important included.
+
+    Args: STRING css
+
+    Returns: TUPLE (LIST of (STRING tag, STRING class, LIST of (STRING property,
+             STRING value)), STRING css of the other rules)
+    """
+    css = re.sub(r"/\*.*?\*/", "", css, flags=re.S)
+    rules = []
+    rest = []
+    position = 0
+
+    while True:
+        start = css.find('{', position)
+        if start < 0:
+            break
+        end = start + 1
+        depth = 1
+        while end < len(css) and depth:
+            depth += {'{': 1, '}': -1}.get(css[end], 0)
+            end += 1
+        prelude = css[position:start].strip()
+        body = css[start + 1:end - 1]
+        position = end
+
+        selectors = [SIMPLE_SELECTOR.fullmatch(selector.strip())
+                     for selector in prelude.split(',')]
+        if prelude.startswith('@') or not all(match and match.group() for match in selectors):
+            rest.append(f"{prelude}{{{body}}}")
+            continue
+
+        declarations = [tuple(part.strip() for part in declaration.split(':', 1))
+                        for declaration in body.split(';') if ':' in declaration]
+        for match in selectors:
+            tag, class_name = match.groups()
+            rules.append((tag and tag.lower(), class_name, declarations))
+
+    # Class rules override type rules, later rules earlier ones
+    rules.sort(key=lambda rule: rule[1] is not None)
+    return rules, ''.join(rest)
+
+
+def add_style(tag, style):
+    """Puts declarations ahead of a tag's style attribute, so the attribute still wins
+
+    Args:   STRING tag
+            STRING style: Declarations
+
+    Returns: STRING tag
+    """
+    match = STYLE_ATTRIBUTE.search(tag)
+    if match is not None:
+        quote = match.group(1)[0]
+        existing = match.group(1)[1:-1].strip()
+        style = style.replace(quote, '"' if quote == "'" else "'")
+        value = f"{style};{existing}" if existing else style
+        return tag[:match.start()] + f" style={quote}{value}{quote}" + tag[match.end():]
+
+    end = len(tag) - (2 if tag.endswith('/>') else 1)
+    return tag[:end].rstrip() + ' style="' + style.replace('"', "'") + '"' + tag[end:]
+
+
+def inline_css(tokens):
+    """Moves the style sheets of a tokenized template into style attributes
+
+    The inlinable rules matching a tag are applied type rules first, then in
+    order. The other rules stay in their style element, which is dropped when
+    none are left. Style sheets holding Jinja2 tokens, and tags holding Jinja2
+    statements (which may decide which attributes are written), are left alone.
+
+    Args: LIST tokens: From template_tokens
+
+    Returns: LIST tokens
+    """
+    rules = []
+    rest = {}
+    for position, (kind, text, name) in enumerate(tokens):
+        if kind == 'raw' and name == 'style' and '{{' not in text and '{%' not in text:
+            found, rest[position] = parse_css(text)
+            rules += found
+
+    result = []
+    drop_end_tag = False
+    for position, (kind, text, name) in enumerate(tokens):
+        if position in rest:
+            if not rest[position].strip():
+                result.pop()
+                drop_end_tag = True
+                continue
+            text = rest[position]
+        elif drop_end_tag and kind == 'tag' and name == '/style':
+            drop_end_tag = False
+            continue
+        elif kind == 'tag' and name[0] not in '/!' and name not in UNSTYLED_TAGS and rules \
+                and '{%' not in text and '{#' not in text:
+            classes = set(tag_attributes(text).get('class', '').split())
+            declarations = {}
+            for tag, class_name, body in rules:
+                if tag in (None, name) and class_name in classes.union([None]):
+                    for prop, value in body:
+                        declarations.pop(prop.lower(), None)
+                        declarations[prop.lower()] = value
+            if declarations:
+                text = add_style(text, ';'.join(f"{prop}:{value}"
+                                                for prop, value in declarations.items()))
+        result.append((kind, text, name))
+
+    return result
+
+
+def minify_html(tokens):
+    """Drops the comments and the white space that doesn't render from a tokenized template
+
+    Runs of white space collapse to one space, and disappear next to block
+    elements. HTML comments, Jinja2 statements and comments and other white
+    space render nothing, so the elements past them count as the neighbours.
+    A run that held a line break becomes one once the line is
+    MINIFIED_LINE_LENGTH long, so the part can still be sent as it is.
+    Conditional comments, comments holding Jinja2 statements and the content
+    of pre, textarea and title elements are kept.
+
+    Args: LIST tokens: From template_tokens
+
+    Returns: LIST tokens
+    """
+    kept = []
+    for token in tokens:
+        if token[0] == 'comment' and not token[1].startswith('<!--[if') and '{%' not in token[1]:
+            continue
+        if token[0] == 'text' and kept and kept[-1][0] == 'text':
+            # Text either side of a dropped comment
+            kept[-1] = ('text', kept[-1][1] + token[1], None)
+        else:
+            kept.append(token)
+    tokens = kept
+
+    def breaks(position, step):
+        while 0 <= position < len(tokens):
+            kind, text, name = tokens[position]
+            if kind == 'tag' or kind == 'text' and text.strip() or \
+                    kind == 'jinja' and text[1] == '{':
+                return kind == 'tag' and name.lstrip('/') in BLOCK_TAGS
+            position += step
+        return True
+
+    result = []
+    column = 0
+    for position, (kind, text, name) in enumerate(tokens):
+        if kind == 'text':
+            words = WHITESPACE.split(text)
+            spaces = WHITESPACE.findall(text)
+            text = words[0]
+            for index, space in enumerate(spaces):
+                line = len(text) - text.rfind('\n') - 1 if '\n' in text else column + len(text)
+                if '\n' in space and line >= MINIFIED_LINE_LENGTH:
+                    text += '\n'
+                elif not (index == 0 and not words[0] and breaks(position - 1, -1) or
+                          index == len(spaces) - 1 and not words[-1] and breaks(position + 1, 1)):
+                    text += ' '
+                text += words[index + 1]
+            if not text:
+                continue
+        elif kind == 'raw' and name in ('style', 'script'):
+            text = WHITESPACE.sub(' ', text).strip()
+            if name == 'style':
+                text = re.sub(r"\s*([{};,])\s*", r"\1", text)
+        result.append((kind, text, name))
+        column = len(text) - text.rfind('\n') - 1 if '\n' in text else column + len(text)
+
+    return result
+
+
+def text_template_source(tokens):
+    """Converts a tokenized HTML template into a plain text template
+
+    Jinja2 tokens are kept, so the result renders with the same variables.
+    Block elements start new lines, list items get a bullet, images their alt
+    text and links their target, unless the link text already shows it.
+
+    Args: LIST tokens: From template_tokens
+
+    Returns: STRING template source
+    """
+    from html import unescape
+
+    output = []
+    links = []
+    for kind, text, name in tokens:
+        if kind == 'jinja':
+            output.append(text)
+        elif kind == 'text':
+            output.append(WHITESPACE.sub(' ', unescape(text)))
+        elif kind == 'raw' and name in ('pre', 'textarea'):
+            output.append(unescape(text))
+        elif kind == 'tag':
+            bare = name.lstrip('/')
+            if bare in BLOCK_TAGS and bare not in ('td', 'th'):
+                output.append('\n\n' if bare in PARAGRAPH_TAGS else '\n')
+            if name == 'li':
+                output.append('- ')
+            elif name in ('td', 'th'):
+                output.append(' ')
+            elif name == 'img':
+                output.append(tag_attributes(text).get('alt', ''))
+            elif name == 'a':
+                links.append((len(output), tag_attributes(text).get('href', '')))
+            elif name == '/a' and links:
+                start, href = links.pop()
+                target = href.strip()
+                if target[:7].lower() == 'mailto:':
+                    target = target[7:].strip()
+                if target and not target.startswith(('#', 'cid:')) and \
+                        target not in ''.join(output[start:]):
+                    output.append(f" <{target}>")
+
+    return ''.join(output)
+
+
+def tidy_text(text):
+    """Trims the white space a rendered plain text template is left with
+
+    Args: STRING text
+
+    Returns: STRING text
+    """
+    text = TEXT_LINE_BREAK.sub('\n', re.sub(r"[ \t]{2,}", ' ', text))
+    return TEXT_BLANK_LINES.sub('\n\n', text).strip() + '\n'
+
+
+class EmailTemplate:
+    """An email template rendering an HTML body and an optional plain text alternative
+
+    Args:   OBJECT html: jinja2.Template of the HTML body
+            OBJECT text: jinja2.Template of the plain text body, None for none
+    """
+    __slots__ = ('html', 'text')
+
+    def __init__(self, html, text=None):
+        self.html = html
+        self.text = text
+
+    def render(self, *args, **kwargs):
+        """Renders the bodies, taking the arguments of jinja2.Template.render
+
+        Returns: TUPLE (STRING html, STRING text or None)
+        """
+        text = None
+        if self.text is not None:
+            text = tidy_text(self.text.render(*args, **kwargs))
+        return self.html.render(*args, **kwargs), text
+
+
+def load_email_template(filename, default_source, cache_dir=None, css=False, minify=False,
+                        plain_text=False):
+    """Loads an email template, optionally transformed for sending
+
+    The transforms apply to the template source, before it is compiled, so
+    they run once per template version rather than on every render: css moves
+    the style sheet rules into style attributes, minify drops comments and the
+    white space that doesn't render, and plain_text derives a plain text
+    template from the HTML one. An edited template is reloaded and transformed
+    again.
+
+    Args:   STRING filename: Template file
+            STRING default_source: Template source used when the file can't be read
+            STRING cache_dir: Cache directory for compiled bytecode
+            BOOLEAN css: Inline the CSS
+            BOOLEAN minify: Minify the HTML
+            BOOLEAN plain_text: Also render a plain text body
+
+    Returns: OBJECT EmailTemplate
+    """
+    template = load_template(filename, default_source, cache_dir)
+    options = (css, minify, plain_text)
+    if not any(options):
+        return EmailTemplate(template)
+
+    with EMAIL_TEMPLATES_LOCK:
+        transformed = EMAIL_TEMPLATES.setdefault(template, {}).get(options)
+    if transformed is not None:
+        return transformed
+
+    if template.name is None:
+        source = default_source
+    else:
+        with open(template.filename, 'r', encoding='UTF-8') as f:
+            source = f.read()
+
+    from jinja2 import TemplateSyntaxError
+
+    tokens = template_tokens(source)
+    transformed = EmailTemplate(template)
+    try:
+        if plain_text:
+            transformed.text = template.environment.from_string(text_template_source(tokens))
+
+        if css or minify:
+            if css:
+                tokens = inline_css(tokens)
+            if minify:
+                tokens = minify_html(tokens)
+            html_source = ''.join(token for _, token, _ in tokens)
+            transformed.html = template.environment.from_string(html_source)
+            logger.info("Transformed email template %s: %s to %s characters",
+                        template.name or 'default', len(source), len(html_source))
+    except TemplateSyntaxError as exc:
+        # Markup the transforms don't understand; send the template as written
+        logger.warning("Unable to transform email template %s (%s), sending it as written",
+                       template.name or 'default', exc)
+        transformed = EmailTemplate(template)
+
+    with EMAIL_TEMPLATES_LOCK:
+        EMAIL_TEMPLATES.setdefault(template, {})[options] = transformed
+    return transformed
+
+
+#######################################
+# Message Parts
+#######################################
+# Leading bytes of the image formats mail clients display inline
+IMAGE_SIGNATURES = ((b'\x89PNG\r\n\x1a\n', 'png'),
+                    (b'\xff\xd8\xff', 'jpeg'),
+                    (b'GIF87a', 'gif'),
+                    (b'GIF89a', 'gif'),
+                    (b'BM', 'bmp'))
+INLINE_IMAGE_FILES = {}
+INLINE_IMAGE_PARTS = {}
+
+
+def image_subtype(data):
+    """Detects the image type from the leading bytes of an image
+
+    Args: BYTES data
+
+    Returns: STRING MIME subtype (e.g. png), or None when not a known image type
+    """
+    for signature, subtype in IMAGE_SIGNATURES:
+        if data.startswith(signature):
+            return subtype
+    if data[:4] == b'RIFF' and data[8:12] == b'WEBP':
+        return 'webp'
+    if b'<svg' in data[:1024]:
+        return 'svg+xml'
+    return None
+
+
+def inline_image(filename):
+    """Returns the encoded inline MIME part of an image file
+
+    The part's Content-ID is the file's basename, so templates reference it
+    as cid:<basename>. Parts are cached by content hash: an image is read and
+    base64 encoded once and the same part is attached to every message, until
+    the file changes on disk.
+
+    Args: STRING filename
+
+    Returns: OBJECT MIMEImage
+    """
+    from email.mime.image import MIMEImage
+
+    path = os.path.abspath(filename)
+    name = os.path.basename(filename)
+    try:
+        stat = os.stat(path)
+        known = INLINE_IMAGE_FILES.get(path)
+        if known is not None and known[:2] == (stat.st_mtime_ns, stat.st_size):
+            return INLINE_IMAGE_PARTS[(known[2], name)]
+
+        with open(path, 'rb') as f:
+            data = f.read()
+    except OSError as exc:
+        raise NetReminderError(f"Unable to read image {filename}: {exc}") from exc
+
+    digest = hashlib.sha256(data).hexdigest()
+    INLINE_IMAGE_FILES[path] = (stat.st_mtime_ns, stat.st_size, digest)
+
+    if (digest, name) not in INLINE_IMAGE_PARTS:
+        subtype = image_subtype(data)
+        if subtype is None:
+            raise NetReminderError(f"{filename} is not a PNG, JPEG, GIF, BMP, WebP or SVG image")
+
+        part = MIMEImage(data, subtype, name=name)
+        part.add_header('Content-ID', f"<{name}>")
+        part.add_header('Content-Disposition', 'inline', filename=name)
+        INLINE_IMAGE_PARTS[(digest, name)] = part
+        logger.info("Encoded inline image %s as image/%s", filename, subtype)
+
+    return INLINE_IMAGE_PARTS[(digest, name)]
+
+
+def mime_text(body, subtype):
+    """Builds a text part, quoted-printable when a line is too long for SMTP
+
+    Minified HTML may be one line, longer than the 998 characters SMTP allows.
+
+    Args:   STRING body
+            STRING subtype: html or plain
+
+    Returns: OBJECT MIMEText
+    """
+    from email.mime.text import MIMEText
+
+    if max(map(len, body.splitlines()), default=0) <= 998:
+        return MIMEText(body, subtype)
+
+    from email.charset import QP, Charset
+
+    charset = Charset('utf-8')
+    charset.body_encoding = QP
+    return MIMEText(body, subtype, charset)
+
+
+def body_part(html, text=None):
+    """Builds the body of a message
+
+    Args:   STRING html: HTML body
+            STRING text: Plain text body, None for none
+
+    Returns: OBJECT MIMEText, or a multipart/alternative of the plain text and HTML parts
+    """
+    part = mime_text(html, 'html')
+    if text is None:
+        return part
+
+    from email.mime.multipart import MIMEMultipart
+
+    alternative = MIMEMultipart('alternative')
+    alternative.attach(mime_text(text, 'plain'))
+    alternative.attach(part)
+    return alternative
+
+
+class PreparedMessage:
+    """A built message serialized once, with replaceable top-level headers
+
+    Everything below the top-level headers (the body and its attachments) is
+    kept as serialized text, so sending the message again with a different
+    To header, e.g. to a test address, doesn't serialize the parts again.
+
+    Args: OBJECT msg: Built email.message.Message
+    """
+    __slots__ = ('headers', 'body', 'policy')
+
+    def __init__(self, msg):
+        text = msg.as_string()
+        # as_string() writes the headers unfolded, then a blank line and the body
+        self.policy = msg.policy.clone(max_line_length=0)
+        self.headers = msg.items()
+        self.body = text[text.index('\n\n') + 2:]
+
+    def header(self, name):
+        """Returns the first value of a top-level header
+
+        Args: STRING name
+
+        Returns: STRING value, or None when not present
+        """
+        for key, value in self.headers:
+            if key.lower() == name.lower():
+                return value
+        return None
+
+    def head(self, replace=None):
+        """Serializes the top-level headers, replacing some of them
+
+        Args: DICTIONARY replace: {header name: new value} (default: None)
+
+        Returns: STRING headers
+        """
+        replace = {name.lower(): value for name, value in (replace or {}).items()}
+        return ''.join(self.policy.fold(name, replace.get(name.lower(), value))
+                       for name, value in self.headers)
+
+    def as_string(self, replace=None):
+        """Serializes the message, replacing some top-level headers
+
+        Args: DICTIONARY replace: {header name: new value} (default: None)
+
+        Returns: STRING message
+        """
+        return self.head(replace) + '\n' + self.body
+
+
+class MessageSkeleton:
+    """Multipart message whose shared parts are serialized once
+
+    The top-level headers and the parts every copy shares (such as the inline
+    images) are kept as text, so each copy only serializes its own first part,
+    e.g. a personalized HTML body, and the headers it replaces.
+
+    Args: OBJECT msg: MIMEMultipart with the top-level headers and the shared parts
+    """
+    __slots__ = ('prepared', 'boundary', 'shared')
+
+    def __init__(self, msg):
+        self.prepared = PreparedMessage(msg)
+        self.boundary = msg.get_boundary()
+        self.shared = ''.join(f"\n--{self.boundary}\n" + part.as_string()
+                              for part in msg.get_payload())
+
+    def as_string(self, part, replace=None):
+        """Serializes a copy of the message with its own first part
+
+        Args:   OBJECT part: MIME part placed before the shared parts
+                DICTIONARY replace: Top-level headers to replace {name: value}
+
+        Returns: STRING message
+        """
+        text = part.as_string()
+        if f"--{self.boundary}" in text:
+            raise NetReminderError("Message part contains the MIME boundary")
+
+        return (self.prepared.head(replace) + '\n' + f"--{self.boundary}\n" + text +
+                self.shared + f"\n--{self.boundary}--\n")
+
+
+#######################################
+# Outbox
+#######################################
+OUTBOX_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    data TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS deliveries (
+    scope TEXT NOT NULL,
+    net_date TEXT NOT NULL,
+    recipient TEXT NOT NULL,
+    kind TEXT NOT NULL,
+    address TEXT NOT NULL,
+    message_id INTEGER NOT NULL REFERENCES messages(id),
+    status TEXT NOT NULL DEFAULT 'pending',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL DEFAULT 0,
+    last_error TEXT,
+    updated REAL NOT NULL,
+    PRIMARY KEY (scope, net_date, recipient, kind)
+);
+CREATE INDEX IF NOT EXISTS deliveries_due ON deliveries (status, next_attempt);
+"""
+
+
+class Outbox:
+    """Durable SQLite queue of outgoing messages with one row per recipient
+
+    Messages are enqueued before anything is sent, keyed by (net date,
+    recipient, message kind) within a scope (the tenant name), and enqueueing
+    an existing key does nothing, so rerunning a date never mails anyone
+    twice. Each delivery moves from pending to sending (just before its SMTP
+    chunk goes out) to sent, or back to pending with an exponential backoff
+    after a temporary failure, or to failed after a permanent refusal or
+    max_attempts tries. A delivery left in sending by a crash is sent again.
+
+    Args:   STRING filename: SQLite database file
+            STRING scope: Keeps several tenants apart in one file (default: '')
+            INTEGER max_attempts: Tries before a delivery is marked failed
+            FLOAT retry_delay: Seconds before the first retry, doubled each try
+    """
+
+    def __init__(self, filename, scope='', max_attempts=5, retry_delay=60):
+        import sqlite3
+
+        self.scope = scope
+        self.max_attempts = max(1, max_attempts)
+        self.retry_delay = retry_delay
+        # Deliveries recorded as sent since the outbox was opened
+        self.sent = 0
+
+        directory = os.path.dirname(os.path.abspath(filename))
+        os.makedirs(directory, exist_ok=True)
+        self.db = sqlite3.connect(filename, timeout=30, isolation_level=None)
+        self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(OUTBOX_SCHEMA)
+
+    def close(self):
+        """Closes the database
+
+        Args: None
+
+        Returns: None
+        """
+        self.db.close()
+
+    def enqueue(self, net_date, kind, data, recipients):
+        """Queues one message for several recipients
+
+        Args:   DATE net_date
+                STRING kind: Message kind, e.g. net or no_net
+                STRING data: Serialized message
+                LIST recipients: Envelope recipients
+
+        Returns: INTEGER recipients newly queued
+        """
+        with self.transaction():
+            message_id = self.db.execute("INSERT INTO messages (data) VALUES (?)",
+                                         (data,)).lastrowid
+            queued = self.insert(net_date, kind, message_id, recipients)
+            if queued == 0:
+                self.db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+        return queued
+
+    def enqueue_each(self, net_date, kind, messages):
+        """Queues a separate message for each recipient
+
+        Args:   DATE net_date
+                STRING kind: Message kind, e.g. net or no_net
+                LIST messages: (STRING recipient, STRING data) tuples
+
+        Returns: INTEGER recipients newly queued
+        """
+        queued = 0
+        with self.transaction():
+            for recipient, data in messages:
+                message_id = self.db.execute("INSERT INTO messages (data) VALUES (?)",
+                                             (data,)).lastrowid
+                if self.insert(net_date, kind, message_id, [recipient]) == 0:
+                    self.db.execute("DELETE FROM messages WHERE id = ?", (message_id,))
+                else:
+                    queued += 1
+        return queued
+
+    def insert(self, net_date, kind, message_id, recipients):
+        """Adds the delivery rows of a message, skipping keys already queued
+
+        Args:   DATE net_date
+                STRING kind
+                INTEGER message_id
+                LIST recipients
+
+        Returns: INTEGER rows added
+        """
+        now = time.time()
+        added = 0
+        for address in recipients:
+            added += self.db.execute(
+                "INSERT OR IGNORE INTO deliveries (scope, net_date, recipient, kind, address, "
+                "message_id, updated) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                (self.scope, net_date.isoformat(), address.lower(), kind, address, message_id,
+                 now)).rowcount
+        return added
+
+    def known(self, net_date, kind):
+        """Lists the recipients already queued (in any state) for a net date and kind
+
+        Args:   DATE net_date
+                STRING kind
+
+        Returns: SET of lowercased addresses
+        """
+        rows = self.db.execute("SELECT recipient FROM deliveries WHERE scope = ? AND "
+                               "net_date = ? AND kind = ?",
+                               (self.scope, net_date.isoformat(), kind))
+        return {recipient for (recipient,) in rows}
+
+    def due(self):
+        """Lists the deliveries ready to be sent, grouped by message
+
+        Args: None
+
+        Returns: LIST of (STRING data, LIST of (INTEGER rowid, STRING address)) tuples
+        """
+        rows = self.db.execute(
+            "SELECT d.rowid, d.address, d.status, m.id, m.data FROM deliveries d "
+            "JOIN messages m ON m.id = d.message_id WHERE d.scope = ? AND "
+            "d.status IN ('pending', 'sending') AND d.next_attempt <= ? "
+            "ORDER BY m.id, d.rowid", (self.scope, time.time())).fetchall()
+
+        interrupted = sum(1 for row in rows if row[2] == 'sending')
+        if interrupted:
+            logger.warning("Resending %s deliveries interrupted while sending", interrupted)
+
+        groups = {}
+        for rowid, address, _, message_id, data in rows:
+            groups.setdefault(message_id, (data, []))[1].append((rowid, address))
+        return list(groups.values())
+
+    def sending(self, rowids):
+        """Marks deliveries as handed to the SMTP server
+
+        Args: LIST rowids
+
+        Returns: None
+        """
+        with self.transaction():
+            self.db.executemany("UPDATE deliveries SET status = 'sending', "
+                                "attempts = attempts + 1, updated = ? WHERE rowid = ?",
+                                [(time.time(), rowid) for rowid in rowids])
+
+    def record(self, deliveries, refused=None, error=None):
+        """Records the outcome of a send
+
+        Recipients refused with a 5xx code fail at once. Those refused with
+        a 4xx code, and all of them when the send raised an error, are
+        retried later until max_attempts.
+
+        Args:   LIST deliveries: (INTEGER rowid, STRING address) tuples that were sent
+                DICTIONARY refused: {address: (code, response)} from the server
+                STRING error: Error that stopped the whole send, if any
+
+        Returns: DICTIONARY refused {address: (code, response)} that failed for good
+        """
+        refused = refused or {}
+        failed = {}
+        now = time.time()
+
+        with self.transaction():
+            for rowid, address in deliveries:
+                if error is None and address not in refused:
+                    self.db.execute("UPDATE deliveries SET status = 'sent', last_error = NULL, "
+                                    "updated = ? WHERE rowid = ?", (now, rowid))
+                    self.sent += 1
+                    continue
+
+                code, response = refused.get(address, (None, error))
+                if isinstance(response, bytes):
+                    response = response.decode('UTF-8', 'replace')
+                attempts = self.db.execute("SELECT attempts FROM deliveries WHERE rowid = ?",
+                                           (rowid,)).fetchone()[0]
+
+                if (code is not None and code >= 500) or attempts >= self.max_attempts:
+                    failed[address] = (code, response)
+                    self.db.execute("UPDATE deliveries SET status = 'failed', last_error = ?, "
+                                    "updated = ? WHERE rowid = ?", (str(response), now, rowid))
+                else:
+                    self.db.execute("UPDATE deliveries SET status = 'pending', last_error = ?, "
+                                    "next_attempt = ?, updated = ? WHERE rowid = ?",
+                                    (str(response),
+                                     now + self.retry_delay * (2 ** (attempts - 1)), now, rowid))
+        return failed
+
+    def counts(self):
+        """Counts the deliveries by status
+
+        Args: None
+
+        Returns: DICTIONARY {status: count}
+        """
+        return dict(self.db.execute("SELECT status, COUNT(*) FROM deliveries WHERE scope = ? "
+                                    "GROUP BY status", (self.scope,)))
+
+    def transaction(self):
+        """Returns a context manager running its block in one transaction
+
+        Args: None
+
+        Returns: OBJECT context manager
+        """
+        from contextlib import contextmanager
+
+        @contextmanager
+        def immediate():
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                yield
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+
+        return immediate()
+
+
+#######################################
+# SMTP Delivery
+#######################################
+class SMTPPool:
+    """Reusable, authenticated SMTP connection with chunked delivery
+
+    The connection is opened on first use and kept for further messages until
+    messages_per_connection is reached or it has been idle for idle_timeout
+    seconds. Recipients are sent in chunks of at most max_recipients per
+    message. Recipients the server refuses with a temporary (4xx) code are
+    retried on their own, so one bad address never resends to everyone.
+
+    Args:   STRING server
+            INTEGER port
+            STRING user: Login user
+            STRING password: Login password, authentication is skipped without one
+            BOOLEAN use_ssl: Connect with SMTP over SSL (default: True)
+            BOOLEAN starttls: Upgrade a plain connection with STARTTLS
+            INTEGER timeout: Socket timeout in seconds
+            INTEGER max_recipients: Envelope recipients per message
+            INTEGER messages_per_connection: Messages before reconnecting
+            INTEGER retries: Retry rounds for temporarily refused recipients
+            FLOAT retry_delay: Seconds before the first retry round, doubled each round
+            FLOAT idle_timeout: Seconds an unused connection is trusted
+    """
+
+    def __init__(self, server, port, user=None, password=None, use_ssl=True, starttls=False,
+                 timeout=60, max_recipients=50, messages_per_connection=100, retries=2,
+                 retry_delay=5, idle_timeout=60):
+        self.server = server
+        self.port = port
+        self.user = user
+        self.password = password
+        self.use_ssl = use_ssl
+        self.starttls = starttls
+        self.timeout = timeout
+        self.max_recipients = max(1, max_recipients)
+        self.messages_per_connection = max(1, messages_per_connection)
+        self.retries = retries
+        self.retry_delay = retry_delay
+        self.idle_timeout = idle_timeout
+
+        self._smtp = None
+        self._sent_on_connection = 0
+        self._last_used = 0
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_config(cls, script_config):
+        """Creates a pool from the smtp_* keys of the script configuration
+
+        Args: DICTIONARY script_config
+
+        Returns: OBJECT SMTPPool
+        """
+        return cls(script_config['smtp_server'],
+                   script_config['smtp_port'],
+                   user=script_config.get('smtp_auth_user'),
+                   password=script_config.get('smtp_auth_pass'),
+                   use_ssl=script_config.get('smtp_ssl', True),
+                   starttls=script_config.get('smtp_starttls', False),
+                   timeout=script_config.get('smtp_timeout', 60),
+                   max_recipients=script_config.get('smtp_max_recipients', 50),
+                   messages_per_connection=script_config.get('smtp_messages_per_connection', 100),
+                   retries=script_config.get('smtp_retries', 2),
+                   retry_delay=script_config.get('smtp_retry_delay', 5),
+                   )
+
+    def connection(self):
+        """Returns an open, authenticated connection, reconnecting when needed
+
+        Args: None
+
+        Returns: OBJECT smtplib.SMTP
+        """
+        import smtplib
+
+        if self._smtp is not None and \
+                (self._sent_on_connection >= self.messages_per_connection or
+                 time.monotonic() - self._last_used > self.idle_timeout):
+            self.close()
+
+        if self._smtp is None:
+            with METRICS.stage('smtp_connect'):
+                if self.use_ssl:
+                    smtp = smtplib.SMTP_SSL(self.server, port=self.port, timeout=self.timeout)
+                else:
+                    smtp = smtplib.SMTP(self.server, port=self.port, timeout=self.timeout)
+                smtp.ehlo()
+                if self.starttls and not self.use_ssl:
+                    smtp.starttls()
+                    smtp.ehlo()
+            if self.user and self.password:
+                with METRICS.stage('smtp_login'):
+                    smtp.login(self.user, self.password)
+            logger.info("Connected to SMTP server %s:%s", self.server, self.port)
+
+            self._smtp = smtp
+            self._sent_on_connection = 0
+
+        self._last_used = time.monotonic()
+        return self._smtp
+
+    def close(self):
+        """Closes the pooled connection
+
+        Args: None
+
+        Returns: None
+        """
+        import smtplib
+
+        if self._smtp is None:
+            return
+
+        try:
+            self._smtp.quit()
+        except (smtplib.SMTPException, OSError):
+            self._smtp.close()
+        finally:
+            self._smtp = None
+
+    def send_chunk(self, from_addr, recipients, data):
+        """Sends one message to one chunk of recipients
+
+        A connection dropped by the server is reopened once.
+
+        Args:   STRING from_addr
+                LIST recipients
+                STRING data: Serialized message
+
+        Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        import smtplib
+
+        for attempt in range(2):
+            try:
+                smtp = self.connection()
+                with METRICS.stage('smtp_send'):
+                    refused = smtp.sendmail(from_addr, recipients, data)
+            except smtplib.SMTPRecipientsRefused as exc:
+                refused = exc.recipients
+            except (smtplib.SMTPServerDisconnected, ConnectionError) as exc:
+                self._smtp = None
+                if attempt > 0:
+                    raise
+                logger.warning("SMTP connection lost (%s), reconnecting", exc)
+                continue
+
+            self._sent_on_connection += 1
+            # smtplib reports the server's reply as bytes
+            return {recipient: (code, response.decode('UTF-8', 'replace')
+                                if isinstance(response, bytes) else response)
+                    for recipient, (code, response) in refused.items()}
+        return {}
+
+    def send(self, from_addr, recipients, data, retries=None):
+        """Sends a message to all recipients in chunks, retrying temporary refusals
+
+        The connection is only held while a chunk is sent, so other threads
+        can use it while this one waits to retry.
+
+        Args:   STRING from_addr: Envelope sender
+                LIST recipients: Envelope recipients
+                STRING data: Serialized message
+                INTEGER retries: Retry rounds (default: the pool's), 0 when the
+                    caller retries on its own, e.g. from the outbox
+
+        Returns: DICTIONARY refused {recipient: (code, response)} that were never delivered
+        """
+        if retries is None:
+            retries = self.retries
+        pending = list(recipients)
+        refused = {}
+
+        for attempt in range(retries + 1):
+            retry = []
+            for start in range(0, len(pending), self.max_recipients):
+                chunk = pending[start:start + self.max_recipients]
+                # One conversation at a time when the pool is shared between threads
+                with self._lock:
+                    chunk_refused = self.send_chunk(from_addr, chunk, data)
+                for recipient, (code, response) in chunk_refused.items():
+                    if 400 <= code < 500 and attempt < retries:
+                        retry.append(recipient)
+                    else:
+                        refused[recipient] = (code, response)
+
+            if not retry:
+                break
+
+            delay = self.retry_delay * (2 ** attempt)
+            logger.warning("Retrying %s temporarily refused recipients in %ss",
+                           len(retry), delay)
+            time.sleep(delay)
+            pending = retry
+
+        logger.info("Delivered to %s of %s recipients",
+                    len(recipients) - len(refused), len(recipients))
+        if len(refused) < len(recipients):
+            METRICS.count('messages_sent')
+        METRICS.count('recipients', len(recipients))
+        METRICS.count('refused', len(refused))
+        return refused
+
+
+#######################################
+# Asynchronous SMTP Delivery
+#######################################
+class AsyncRateLimiter:
+    """Spaces out sends to one server to at most rate messages per second
+
+    Args: FLOAT rate: Messages per second, None or 0 for no limit
+    """
+
+    def __init__(self, rate=None):
+        import asyncio
+
+        self.interval = 1.0 / rate if rate else 0
+        self._lock = asyncio.Lock()
+        self._next = 0
+
+    async def wait(self):
+        """Waits for this sender's next slot"""
+        import asyncio
+
+        if not self.interval:
+            return
+
+        async with self._lock:
+            loop = asyncio.get_running_loop()
+            delay = self._next - loop.time()
+            if delay > 0:
+                await asyncio.sleep(delay)
+            self._next = max(loop.time(), self._next) + self.interval
+
+
+async def async_connect(settings):
+    """Opens an authenticated aiosmtplib connection
+
+    Args: OBJECT settings: SMTPPool holding the server settings
+
+    Returns: OBJECT aiosmtplib.SMTP
+    """
+    aiosmtplib = optional_import('aiosmtplib', "Asynchronous delivery")
+
+    smtp = aiosmtplib.SMTP(hostname=settings.server,
+                           port=settings.port,
+                           use_tls=settings.use_ssl,
+                           start_tls=settings.starttls and not settings.use_ssl,
+                           timeout=settings.timeout)
+    with METRICS.stage('smtp_connect'):
+        await smtp.connect()
+    if settings.user and settings.password:
+        with METRICS.stage('smtp_login'):
+            await smtp.login(settings.user, settings.password)
+    logger.info("Connected to SMTP server %s:%s (async)", settings.server, settings.port)
+    return smtp
+
+
+async def async_send_chunks(smtp, settings, limiter, from_addr, recipients, data,
+                            semaphore=None):
+    """Sends one message in recipient chunks, retrying temporary refusals
+
+    Mirrors SMTPPool.send on an aiosmtplib connection. Like the pool's lock,
+    the caller's semaphore slot is given up while waiting to retry, so a
+    server that keeps deferring doesn't hold up sends to the others.
+
+    Args:   OBJECT smtp: Connection from async_connect
+            OBJECT settings: SMTPPool holding the chunk and retry settings
+            OBJECT limiter: AsyncRateLimiter for the server
+            STRING from_addr
+            LIST recipients
+            STRING data: Serialized message
+            OBJECT semaphore: asyncio.Semaphore the caller holds (default: None)
+
+    Returns: DICTIONARY refused {recipient: (code, response)}
+    """
+    import asyncio
+    aiosmtplib = optional_import('aiosmtplib', "Asynchronous delivery")
+
+    pending = list(recipients)
+    refused = {}
+
+    for attempt in range(settings.retries + 1):
+        retry = []
+        for start in range(0, len(pending), settings.max_recipients):
+            chunk = pending[start:start + settings.max_recipients]
+            await limiter.wait()
+            try:
+                with METRICS.stage('smtp_send'):
+                    errors, _ = await smtp.sendmail(from_addr, chunk, data)
+                chunk_refused = {r: (e.code, e.message) for r, e in errors.items()}
+            except aiosmtplib.SMTPRecipientsRefused as exc:
+                chunk_refused = {e.recipient: (e.code, e.message) for e in exc.recipients}
+
+            for recipient, (code, response) in chunk_refused.items():
+                if 400 <= code < 500 and attempt < settings.retries:
+                    retry.append(recipient)
+                else:
+                    refused[recipient] = (code, response)
+
+        if not retry:
+            break
+
+        if semaphore is not None:
+            semaphore.release()
+        try:
+            await asyncio.sleep(settings.retry_delay * (2 ** attempt))
+        finally:
+            if semaphore is not None:
+                await semaphore.acquire()
+        pending = retry
+
+    return refused
+
+
+async def async_server_worker(settings, queue, limiter, semaphore, results):
+    """Drains one server's queue over a single reused connection
+
+    Args:   OBJECT settings: SMTPPool holding the server settings
+            OBJECT queue: asyncio.Queue of (index, from_addr, recipients, data)
+            OBJECT limiter: AsyncRateLimiter shared by the server's workers
+            OBJECT semaphore: asyncio.Semaphore bounding concurrent sends overall
+            LIST results: Per-message result dictionaries, filled by index
+
+    Returns: None
+    """
+    import asyncio
+    aiosmtplib = optional_import('aiosmtplib', "Asynchronous delivery")
+
+    smtp = None
+    try:
+        while True:
+            try:
+                index, from_addr, recipients, data = queue.get_nowait()
+            except asyncio.QueueEmpty:
+                return
+
+            async with semaphore:
+                try:
+                    if smtp is None:
+                        smtp = await async_connect(settings)
+                    refused = await async_send_chunks(smtp, settings, limiter,
+                                                      from_addr, recipients, data, semaphore)
+                    results[index] = {'recipients': len(recipients),
+                                      'refused': refused,
+                                      'error': None}
+                except (aiosmtplib.SMTPException, OSError) as exc:
+                    logger.warning("Async send to %s failed: %s", settings.server, exc)
+                    results[index] = {'recipients': len(recipients),
+                                      'refused': {},
+                                      'error': str(exc)}
+                    if smtp is not None:
+                        smtp.close()
+                        smtp = None
+                except Exception as exc:  # pylint: disable=broad-except
+                    # Anything else (a timeout, bad message data) fails this
+                    # message only, so the rest of the batch is still accounted
+                    logger.exception("Async send to %s failed", settings.server)
+                    results[index] = {'recipients': len(recipients),
+                                      'refused': {},
+                                      'error': str(exc) or type(exc).__name__}
+                    if smtp is not None:
+                        smtp.close()
+                        smtp = None
+    finally:
+        if smtp is not None:
+            try:
+                await smtp.quit()
+            except (aiosmtplib.SMTPException, OSError, asyncio.TimeoutError):
+                smtp.close()
+
+
+async def deliver_async(jobs, concurrency=4):
+    """Delivers many messages concurrently, grouped by SMTP server
+
+    Every server gets its own queue, drained by smtp_async_connections
+    (default 2) connections and paced by smtp_rate_limit messages per second
+    (default unlimited). At most concurrency messages are in flight overall.
+
+    Args:   LIST jobs: (DICTIONARY script_config, STRING from_addr, LIST recipients,
+                STRING data) tuples
+            INTEGER concurrency: Messages in flight across all servers
+
+    Returns: LIST of result dictionaries in job order, each with recipients,
+             refused {recipient: (code, response)} and error (None on success)
+    """
+    import asyncio
+
+    optional_import('aiosmtplib', "Asynchronous delivery")
+
+    results = [None] * len(jobs)
+    semaphore = asyncio.Semaphore(max(1, concurrency))
+    servers = {}
+
+    for index, (script_config, from_addr, recipients, data) in enumerate(jobs):
+        settings = SMTPPool.from_config(script_config)
+        key = (settings.server, settings.port, settings.user)
+        if key not in servers:
+            servers[key] = (settings, asyncio.Queue(),
+                            AsyncRateLimiter(script_config.get('smtp_rate_limit')),
+                            script_config.get('smtp_async_connections', 2))
+        servers[key][1].put_nowait((index, from_addr, recipients, data))
+
+    workers = []
+    for settings, queue, limiter, connections in servers.values():
+        for _ in range(min(max(1, connections), queue.qsize())):
+            workers.append(async_server_worker(settings, queue, limiter, semaphore, results))
+
+    await asyncio.gather(*workers)
+
+    # A message whose worker never got to it still needs a result
+    for index, (_, _, recipients, _) in enumerate(jobs):
+        if results[index] is None:
+            results[index] = {'recipients': len(recipients), 'refused': {}, 'error': "not sent"}
+
+    failed = sum(1 for result in results if result['error'] is not None)
+    # Like SMTPPool.send, a message counts as sent once a recipient accepted it
+    sent = sum(1 for result in results
+               if result['error'] is None and len(result['refused']) < result['recipients'])
+    logger.info("Async delivery of %s messages to %s servers, %s sent, %s failed",
+                len(jobs), len(servers), sent, failed)
+    METRICS.count('messages_sent', sent)
+    METRICS.count('recipients', sum(result['recipients'] for result in results))
+    METRICS.count('refused', sum(len(result['refused']) for result in results))
+    return results
+
+
+#######################################
+# Net Reminder
+#######################################
+class NetReminder:
+    """Net reminder pipeline bound to a single loaded configuration
+
+    A NetReminder holds everything that stays the same between runs (the
+    script configuration, template and subject choices and the test flags)
+    so that a long-lived process can call run() many times without
+    re-reading the configuration.
+
+    Args:   DICTIONARY script_config: Loaded YAML configuration (see load_config)
+            STRING email_config: Email template file, overridden by the configuration
+            STRING no_net_control_email_config: No net control template file,
+                overridden by the configuration
+            STRING email_subject_template: Email subject, overridden by the configuration
+            STRING no_net_control_email_subject_template: No net control email subject,
+                overridden by the configuration
+            BOOLEAN test: Don't send mail, print the email body instead
+            STRING test_email: Send to this address instead of the roster
+            BOOLEAN async_send: Deliver batches concurrently with aiosmtplib
+            OBJECT resources: TenantResources shared with other tenants (default: None)
+    """
+
+    def __init__(self, script_config, email_config=None, no_net_control_email_config=None,
+                 email_subject_template=None, no_net_control_email_subject_template=None,
+                 test=False, test_email=None, async_send=False, resources=None):
+        self.script_config = script_config
+        self.cache_dir = script_config.get('cache_dir')
+        self.test = test
+        self.test_email = test_email
+        self.async_send = async_send or script_config.get('smtp_async', False)
+        self.resources = resources
+        self._smtp_pool = None
+        self._outbox = None
+        self._suppression_list = None
+
+        self.email_config = script_config.get('email_config', email_config) \
+            or DEFAULT_EMAIL_CONFIG
+        self.no_net_control_email_config = \
+            script_config.get('no_net_control_email_config', no_net_control_email_config) \
+            or DEFAULT_NO_NET_CONTROL_EMAIL_CONFIG_FILE
+
+        # If the email subject template is defined in the configuration file,
+        # then use it.
+        self.email_subject_template = \
+            script_config.get('email_subject_template', email_subject_template) \
+            or DEFAULT_EMAIL_SUBJECT_TEMPLATE
+        self.no_net_control_email_subject_template = \
+            script_config.get('no_net_control_email_subject_template',
+                              no_net_control_email_subject_template) \
+            or DEFAULT_NO_NET_CONTROL_EMAIL_SUBJECT_TEMPLATE
+
+    def fetch_remote_files(self):
+        """Fetches the roster, schedule and any remote_files from their configured URLs
+
+            A file that fails to download keeps its last good local copy, which
+            is used with a warning. It is an error only when no local copy exists.
+
+            Args: None
+
+            Returns: DICTIONARY {filename: BOOLEAN downloaded}
+        """
+        try:
+            logger.info("Fetching remote files")
+            files = [(self.script_config['url_roster'],
+                      self.script_config['roster_excel_file'],
+                      self.script_config.get('roster_sha256')),
+                     (self.script_config['url_schedule'],
+                      self.script_config['schedule_excel_file'],
+                      self.script_config.get('schedule_sha256'))]
+            files += [(remote['url'], remote['file'], remote.get('sha256'))
+                      for remote in self.script_config.get('remote_files', [])]
+
+            fetch = fetch_remote_files if self.resources is None \
+                else self.resources.fetch_remote_files
+            with METRICS.stage('fetch'):
+                results = fetch(files,
+                                self.script_config['url_user'],
+                                self.script_config['url_pass'],
+                                self.script_config.get('fetch_workers', 4),
+                                self.script_config.get('fetch_max_bytes'))
+        except KeyError as e:
+            raise NetReminderError(f"Missing configuration key: {e}") from e
+
+        for filename, result in results.items():
+            if isinstance(result, NetReminderError):
+                if not os.path.isfile(filename):
+                    raise result
+                logger.warning("Using the last good copy of %s", filename)
+                results[filename] = False
+
+        return results
+
+    def fill_email_no_net_notice_template(self, now):
+        """Completes the email template
+
+            Args: DATETIME now
+
+            Return: TUPLE (STRING html, STRING text or None)
+        """
+
+        #
+        # HTML email template
+        #
+        t = self.email_template(self.no_net_control_email_config,
+                                DEFAULT_NO_NET_CONTROL_EMAIL_CONFIG)
+        with METRICS.stage('render'):
+            email_body = t.render(
+                net_date=now.strftime("%m/%d/%Y"),
+                excel_maintainer_name=self.script_config['excel_maintainer_name'],
+                excel_maintainer_email=self.script_config['excel_maintainer_email'],
+                script_maintainer_name=self.script_config['script_maintainer_name'],
+                script_maintainer_email=self.script_config['script_maintainer_email'],
+            )
+
+        return email_body
+
+    def create_no_net_email_subject(self, now):
+        """Completes the email subject template and returns it
+
+        Args: DATETIME now
+
+        Returns: STRING email_subject
+
+        """
+        net_date = now.strftime("%m/%d/%Y")
+        email_subject = self.no_net_control_email_subject_template.format(net_date)
+        logger.info("Email Subject: %s", email_subject)
+
+        return email_subject
+
+    def gather_no_net_email_addresses(self):
+        """Generates the email address list from defined maintainers' emails
+
+        Args: None
+
+        Returns: LIST email_dist: List of emails
+
+        """
+        email_dist = list([self.script_config['excel_maintainer_email'],
+                           self.script_config['script_maintainer_email']])
+        logger.info("Email Distribution List: %s", LogSummary(email_dist))
+
+        return email_dist
+
+    def smtp_pool(self):
+        """Returns the SMTP pool shared by every message this reminder sends
+
+            Args: None
+
+            Returns: OBJECT SMTPPool
+        """
+        if self._smtp_pool is None:
+            if self.resources is not None:
+                self._smtp_pool = self.resources.smtp_pool(self.script_config)
+            else:
+                self._smtp_pool = SMTPPool.from_config(self.script_config)
+        return self._smtp_pool
+
+    def close(self):
+        """Closes the pooled SMTP connection
+
+            Args: None
+
+            Returns: None
+        """
+        # A shared pool is closed by its TenantResources
+        if self._smtp_pool is not None and self.resources is None:
+            self._smtp_pool.close()
+        if self._outbox is not None:
+            self._outbox.close()
+            self._outbox = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def send_email(self, msg, email_dist, replace=None, retries=None):
+        """Sends a completed message to the distribution list over the pooled connection
+
+            Args:   OBJECT msg: MIMEMultipart with its headers set, a PreparedMessage
+                        or the serialized message
+                    LIST email_dist: Envelope recipients
+                    DICTIONARY replace: Top-level headers to replace {name: value}
+                    INTEGER retries: Retry rounds for temporary refusals (default: smtp_retries)
+
+            Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        me = self.script_config['smtp_auth_user']
+
+        import smtplib
+
+        if isinstance(msg, str):
+            data = msg
+        elif isinstance(msg, PreparedMessage):
+            data = msg.as_string(replace)
+        else:
+            data = PreparedMessage(msg).as_string(replace)
+
+        # Send the message via our own SMTP server, but don't include the
+        # envelope header.
+        try:
+            refused = self.smtp_pool().send(me, email_dist, data, retries)
+        except smtplib.SMTPException as exc:
+            raise NetReminderError(f"Unable to send email: {exc}") from exc
+
+        for recipient, (code, response) in refused.items():
+            logger.warning("Recipient %s refused: %s %s", recipient, code, response)
+        self.suppress_refused(refused)
+
+        return refused
+
+    def outbox(self):
+        """Returns the durable outbox, when outbox_file is configured
+
+            Test runs and test emails bypass the outbox.
+
+            Args: None
+
+            Returns: OBJECT Outbox, or None
+        """
+        if self.script_config.get('outbox_file') is None or self.test or \
+                self.test_email is not None:
+            return None
+
+        if self._outbox is None:
+            self._outbox = Outbox(self.script_config['outbox_file'],
+                                  scope=str(self.script_config.get('name', '')),
+                                  max_attempts=self.script_config.get('outbox_max_attempts', 5),
+                                  retry_delay=self.script_config.get('outbox_retry_delay', 60))
+        return self._outbox
+
+    def drain_outbox(self):
+        """Sends every outbox delivery that is due, recording each outcome
+
+            A shared message goes out in chunks of smtp_max_recipients and is
+            recorded chunk by chunk (with async_send, message by message).
+
+            Args: None
+
+            Returns: DICTIONARY refused {recipient: (code, response)} that failed for good
+        """
+        outbox = self.outbox()
+        groups = outbox.due()
+        failed = {}
+
+        if groups and self.async_send:
+            import asyncio
+
+            me = self.script_config['smtp_auth_user']
+            for _, deliveries in groups:
+                outbox.sending([rowid for rowid, _ in deliveries])
+            jobs = [(self.script_config, me, [address for _, address in deliveries], data)
+                    for data, deliveries in groups]
+            results = asyncio.run(deliver_async(jobs,
+                                                self.script_config.get('smtp_concurrency', 4)))
+            for (_, deliveries), result in zip(groups, results):
+                error = None if result['error'] is None else str(result['error'])
+                failed.update(outbox.record(deliveries, result['refused'], error))
+                self.suppress_refused(result['refused'])
+        else:
+            chunk_size = max(1, self.script_config.get('smtp_max_recipients', 50))
+            for data, deliveries in groups:
+                for start in range(0, len(deliveries), chunk_size):
+                    chunk = deliveries[start:start + chunk_size]
+                    outbox.sending([rowid for rowid, _ in chunk])
+                    try:
+                        # Temporary refusals are left to the outbox's own retries
+                        refused = self.send_email(data, [address for _, address in chunk],
+                                                  retries=0)
+                    except (NetReminderError, OSError) as exc:
+                        outbox.record(chunk, error=str(exc))
+                        raise NetReminderError(f"Unable to send email: {exc}") from exc
+                    failed.update(outbox.record(chunk, refused))
+
+        if groups:
+            logger.info("Outbox: %s", ", ".join(f"{count} {status}" for status, count
+                                                in sorted(outbox.counts().items())))
+        return failed
+
+    def deliver(self, msg, email_dist, key=None):
+        """Sends a built message, honoring the test and test email options
+
+            With an outbox, the message is queued under key first and only the
+            recipients not already queued for that key are sent to.
+
+            Args:   OBJECT msg: Message from build_net_notice or build_no_net_notice
+                    LIST email_dist: Envelope recipients
+                    TUPLE key: (DATE net_date, STRING kind) for the outbox
+
+            Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        logger.info("Email From: %s", self.script_config['smtp_auth_user'])
+
+        if self.test is False:
+            with METRICS.stage('mime_build'):
+                prepared = PreparedMessage(msg)
+            replace = {}
+            if self.test_email is not None:
+                logger.info("Sending test email")
+                replace['To'] = self.test_email
+                email_dist = [self.test_email]
+
+            logger.info("Subject: %s", prepared.header('Subject'))
+            logger.info("From: %s", prepared.header('From'))
+            logger.info("To: %s", LogSummary(replace.get('To', prepared.header('To'))))
+            logger.info("CC: %s", prepared.header('Cc'))
+            logger.info("BCC: %s", prepared.header('Bcc'))
+            logger.info("Reply-to: %s", prepared.header('Reply-to'))
+
+            outbox = self.outbox()
+            if outbox is not None and key is not None:
+                queued = outbox.enqueue(key[0], key[1], prepared.as_string(), email_dist)
+                logger.info("Outbox: queued %s of %s recipients", queued, len(email_dist))
+                return self.drain_outbox()
+
+            return self.send_email(prepared, email_dist, replace)
+
+        logger.info("Test flag set on command line. Not sending email...")
+        print(html_body(msg))
+        return {}
+
+    def deliver_many(self, messages, keys=None):
+        """Delivers several built messages, concurrently when async_send is set
+
+            Args:   LIST messages: (DATETIME now, OBJECT msg, LIST email_dist) tuples
+                    LIST keys: (DATE net_date, STRING kind) outbox key of each message
+
+            Returns: LIST of result dictionaries in message order, each with
+                     recipients, refused and error
+        """
+        outbox = self.outbox()
+        if outbox is not None and keys is not None:
+            for (_, msg, email_dist), (net_date, kind) in zip(messages, keys):
+                with METRICS.stage('mime_build'):
+                    data = PreparedMessage(msg).as_string()
+                outbox.enqueue(net_date, kind, data, email_dist)
+            failed = self.drain_outbox()
+            return [{'recipients': len(dist),
+                     'refused': {r: failed[r] for r in dist if r in failed},
+                     'error': None}
+                    for _, _, dist in messages]
+
+        if self.test is True or not self.async_send:
+            return [{'recipients': len(dist), 'refused': self.deliver(msg, dist, key),
+                     'error': None}
+                    for (_, msg, dist), key in zip(messages, keys or [None] * len(messages))]
+
+        me = self.script_config['smtp_auth_user']
+        jobs = []
+        for _, msg, email_dist in messages:
+            replace = None
+            if self.test_email is not None:
+                replace = {'To': self.test_email}
+                email_dist = [self.test_email]
+            with METRICS.stage('mime_build'):
+                data = PreparedMessage(msg).as_string(replace)
+            jobs.append((self.script_config, me, email_dist, data))
+
+        import asyncio
+
+        results = asyncio.run(deliver_async(jobs,
+                                            self.script_config.get('smtp_concurrency', 4)))
+
+        for (_, msg, _), result in zip(messages, results):
+            for recipient, (code, response) in result['refused'].items():
+                logger.warning("Recipient %s refused: %s %s", recipient, code, response)
+            self.suppress_refused(result['refused'])
+            if result['error'] is not None:
+                logger.error("Sending \"%s\" failed: %s", msg['Subject'], result['error'])
+
+        return results
+
+    def build_no_net_notice(self, now):
+        """Builds the message telling the maintainers no net controls are present
+
+            Args: DATETIME now
+
+            Returns: TUPLE (OBJECT msg, LIST email_dist)
+        """
+        email_body = self.fill_email_no_net_notice_template(now)
+        email_subject = self.create_no_net_email_subject(now)
+        email_dist = self.gather_no_net_email_addresses()
+
+        from email.mime.multipart import MIMEMultipart
+
+        with METRICS.stage('mime_build'):
+            msg = MIMEMultipart()
+            msg.attach(body_part(*email_body))
+
+            msg['Subject'] = email_subject
+            msg['From'] = self.script_config['email_from']
+            msg['X-Priority'] = '2'
+            msg['To'] = ", ".join(email_dist)
+
+        return msg, email_dist
+
+    def email_no_net_notice(self, now):
+        """Sends a message to the maintainers that no net controls are present given the date
+
+            Args: DATETIME now
+
+            Returns: None
+        """
+        msg, email_dist = self.build_no_net_notice(now)
+        self.deliver(msg, email_dist, (now.date(), 'no_net'))
+
+    def net_notice_context(self, notice):
+        """Collects the email template variables for a net notice
+
+            Args: OBJECT    notice: NetNotice
+
+            Return: DICTIONARY template variables
+        """
+        logo_basename = None
+
+        if notice.logo is not None:
+            logo_basename = os.path.basename(notice.logo)
+        inline_images = [os.path.basename(image) for image in self.inline_image_files(notice)]
+
+        return dict(net_date=notice.current.net_date,
+                    primary_net_control=notice.current.primary,
+                    backup_net_control=notice.current.backup,
+                    net_type=notice.current.net_type,
+                    logo=logo_basename,
+                    primary_net_control_2wk=notice.following.primary,
+                    backup_net_control_2wk=notice.following.backup,
+                    net_date_2wk=notice.following.net_date,
+                    upcoming_nets=notice.upcoming,
+                    inline_images=inline_images,
+                    switch_notify1_name=self.script_config['switch_notify1_name'],
+                    switch_notify1_email=self.script_config['switch_notify1_email'],
+                    switch_notify2_name=self.script_config['switch_notify2_name'],
+                    switch_notify2_email=self.script_config['switch_notify2_email'],
+                    excel_maintainer_name=self.script_config['excel_maintainer_name'],
+                    excel_maintainer_email=self.script_config['excel_maintainer_email'],
+                    script_maintainer_name=self.script_config['script_maintainer_name'],
+                    script_maintainer_email=self.script_config['script_maintainer_email'],
+                    )
+
+    def fill_email_net_notice_template(self, notice):
+        """Completes the email template
+
+            Args: OBJECT    notice: NetNotice
+
+            Return: TUPLE (STRING html, STRING text or None)
+        """
+        #
+        # HTML email template
+        #
+        t = self.email_template(self.email_config, DEFAULT_EMAIL_TEMPLATE)
+        with METRICS.stage('render'):
+            email_body = t.render(self.net_notice_context(notice))
+        return email_body
+
+    def email_template(self, filename, default_source):
+        """Loads an email template with the inline_css, minify_html and plain_text options
+
+            Args:   STRING filename: Template file
+                    STRING default_source: Template source used when the file can't be read
+
+            Returns: OBJECT EmailTemplate
+        """
+        return load_email_template(filename, default_source, self.cache_dir,
+                                   css=self.script_config.get('inline_css', False),
+                                   minify=self.script_config.get('minify_html', False),
+                                   plain_text=self.script_config.get('plain_text', False))
+
+    def create_email_subject(self, notice):
+        """Completes the email subject template and returns it
+
+        Args: OBJECT    notice: NetNotice
+
+        Returns: STRING email_subject
+
+        """
+        email_subject = self.email_subject_template.format(notice.current.net_type,
+                                                           notice.current.net_date)
+        logger.info("Email Subject: %s", email_subject)
+
+        return email_subject
+
+    def roster_sheet_names(self):
+        """Lists the roster sheets to gather members from
+
+        Uses roster_sheet_names from the configuration when present, otherwise
+        the roster_sheet_name and emeritus_sheet_name pair.
+
+        Args: None
+
+        Returns: LIST sheet_names
+        """
+        if 'roster_sheet_names' in self.script_config:
+            return list(self.script_config['roster_sheet_names'])
+
+        return [self.script_config[key] for key in ('roster_sheet_name', 'emeritus_sheet_name')
+                if self.script_config.get(key) is not None]
+
+    def read_workbook(self, filename, sheet_names, **kwargs):
+        """Reads a workbook through the cache, shared with other tenants when set
+
+        Args:   STRING filename
+                LIST sheet_names
+                kwargs: Passed through to read_workbook_cached
+
+        Returns: OBJECT as read_workbook_cached
+        """
+        kwargs.setdefault('backend', self.script_config.get('workbook_backend'))
+        if self.resources is not None:
+            return self.resources.read_workbook(filename, sheet_names, cache_dir=self.cache_dir,
+                                                **kwargs)
+        return read_workbook_cached(filename, sheet_names, cache_dir=self.cache_dir, **kwargs)
+
+    def load_roster(self, columns=('Email',)):
+        """Reads the requested columns of every roster sheet in a single workbook pass
+
+        Args: TUPLE columns: Roster columns to read (default: Email only)
+
+        Returns: OBJECT Roster of the roster sheets, in sheet order
+        """
+        sheet_names = self.roster_sheet_names()
+
+        with METRICS.stage('roster_parse'):
+            sheets = self.read_workbook(self.script_config['roster_excel_file'],
+                                        sheet_names,
+                                        columns=columns)
+
+            return Roster.from_sheets(sheets, sheet_names, columns)
+
+    def gather_email_addresses(self):
+        """Generates the email address list from the roster sheets defined
+
+        Cells holding several addresses are split, duplicates across sheets
+        (ignoring case) are dropped keeping the first occurrence, and invalid
+        or suppressed addresses are left out.
+
+        Args: None
+
+        Returns: LIST email_dist: List of emails
+
+        """
+        #
+        # Gathering the email addresses from the Amateur Radio Roster
+        #
+        index = self.recipient_index()
+        email_dist = self.load_roster().emails(index=index)
+        index.report()
+
+        logger.info("Email Distribution List: %s", LogSummary(email_dist))
+        return email_dist
+
+    def suppression_list(self):
+        """Returns the suppression list, when suppression_file is configured
+
+            The file is re-read whenever it changes.
+
+            Args: None
+
+            Returns: OBJECT SuppressionList, or None
+        """
+        if self.script_config.get('suppression_file') is None:
+            return None
+
+        if self._suppression_list is None:
+            if self.resources is not None:
+                # Tenants appending to the same file must share its lock
+                self._suppression_list = self.resources.suppression_list(
+                    self.script_config['suppression_file'])
+            else:
+                self._suppression_list = SuppressionList(self.script_config['suppression_file'])
+        self._suppression_list.refresh()
+        return self._suppression_list
+
+    def recipient_index(self):
+        """Starts a RecipientIndex filtering against the suppression list
+
+            Args: None
+
+            Returns: OBJECT RecipientIndex
+        """
+        return RecipientIndex(self.suppression_list())
+
+    def suppress_refused(self, refused):
+        """Adds permanently refused recipients to the suppression list
+
+            Only when suppress_refused is set; 5xx refusals are permanent.
+
+            Args: DICTIONARY refused {recipient: (code, response)}
+
+            Returns: None
+        """
+        if not self.script_config.get('suppress_refused', False):
+            return
+
+        suppression = self.suppression_list()
+        if suppression is None:
+            return
+
+        for recipient, (code, response) in refused.items():
+            if code is not None and 500 <= code < 600:
+                if isinstance(response, bytes):
+                    response = response.decode('UTF-8', 'replace')
+                if suppression.add([recipient], f"refused {code} {response}".replace('\n', ' ')):
+                    logger.warning("Suppressing %s from now on", recipient)
+
+    def inline_image_files(self, notice):
+        """Lists the images to attach inline: the logo, then inline_images
+
+            Images are attached under their basename, so only the first of
+            several files sharing a basename is used.
+
+            Args: OBJECT notice: NetNotice
+
+            Returns: LIST of STRING filenames
+        """
+        files = [notice.logo] if notice.logo is not None else []
+        files += self.script_config.get('inline_images') or []
+
+        images = {}
+        for filename in files:
+            images.setdefault(os.path.basename(filename), filename)
+        return list(images.values())
+
+    def build_net_notice(self, notice, email_dist):
+        """Builds the email reminder of the upcoming net
+
+            Args:   OBJECT    notice: NetNotice
+                    LIST email_dist: Recipients for the To header
+
+            Returns: OBJECT msg
+        """
+        email_body = self.fill_email_net_notice_template(notice)
+
+        with METRICS.stage('mime_build'):
+            msg = self.net_notice_message(notice, email_dist, body_part(*email_body))
+
+        return msg
+
+    def net_notice_message(self, notice, email_dist, body=None):
+        """Assembles the net reminder around a body part
+
+            Args:   OBJECT    notice: NetNotice
+                    LIST email_dist: Recipients for the To header
+                    OBJECT body: First MIME part, None to leave it out
+
+            Returns: OBJECT msg
+        """
+        email_subject = self.create_email_subject(notice)
+
+        from email.mime.multipart import MIMEMultipart
+
+        msg = MIMEMultipart()
+        if body is not None:
+            msg.attach(body)
+
+        # The encoded image parts are cached and shared between messages
+        for image in self.inline_image_files(notice):
+            msg.attach(inline_image(image))
+
+        msg['Subject'] = email_subject
+        msg['From'] = self.script_config['email_from']
+
+        if self.script_config.get('email_reply_to') is not None:
+            msg['Reply-to'] = self.script_config['email_reply_to']
+
+        msg['To'] = ", ".join(email_dist)
+
+        return msg
+
+    def email_net_notice(self, notice, email_dist=None):
+        """Sends an email reminder to the membership of the upcoming net
+
+            Args:   OBJECT    notice: NetNotice
+                    LIST email_dist: Recipients (default: gathered from the roster)
+
+            Returns: None
+        """
+        if email_dist is None and self.script_config.get('personalize', False):
+            self.email_personalized_notice(notice)
+            return
+
+        if email_dist is None:
+            email_dist = self.gather_email_addresses()
+
+        msg = self.build_net_notice(notice, email_dist)
+        self.deliver(msg, email_dist, (notice.current.date, 'net'))
+
+    def personalized_members(self):
+        """Lists the members to send personalized reminders to
+
+            Args: None
+
+            Returns: LIST of (STRING email, DICTIONARY {column: value}) tuples
+        """
+        columns = tuple(self.script_config.get('personalize_columns', ['Member', 'Callsign']))
+        index = self.recipient_index()
+        members = self.load_roster(('Email',) + columns).members(columns, index=index)
+        index.report()
+        logger.info("Personalized distribution: %s members", len(members))
+        return members
+
+    def email_personalized_notice(self, notice):
+        """Sends every member their own rendering of the net reminder
+
+            The template is compiled once and rendered for each member with the
+            personalize_columns of the roster available as member.<column>. Each
+            message is addressed to its member only and shares the serialized
+            headers and inline images with the others. Messages are rendered
+            personalize_batch_size at a time, and each batch is sent over the
+            pooled SMTP connection (or concurrently with async_send). With
+            test_email, only the first member's message is sent, to the test
+            address.
+
+            Args: OBJECT notice: NetNotice
+
+            Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        members = self.personalized_members()
+        if self.test_email is not None:
+            members = [(self.test_email, fields) for _, fields in members[:1]]
+
+        t = self.email_template(self.email_config, DEFAULT_EMAIL_TEMPLATE)
+        context = self.net_notice_context(notice)
+
+        if self.test is True:
+            logger.info("Test flag set on command line. Not sending email...")
+            if members:
+                print(t.render(context, member=members[0][1])[0])
+            return {}
+
+        outbox = self.outbox()
+        if outbox is not None:
+            # Members already queued for this net are neither rendered nor queued again
+            known = outbox.known(notice.current.date, 'net')
+            members = [(email, fields) for email, fields in members if email.lower() not in known]
+
+        with METRICS.stage('mime_build'):
+            skeleton = MessageSkeleton(self.net_notice_message(notice, []))
+        batch_size = max(1, self.script_config.get('personalize_batch_size', 200))
+        refused = {}
+        accepted = 0
+        sent_before = outbox.sent if outbox is not None else 0
+
+        for start in range(0, len(members), batch_size):
+            chunk = members[start:start + batch_size]
+            with METRICS.stage('render'):
+                bodies = [t.render(context, member=fields) for _, fields in chunk]
+            with METRICS.stage('mime_build'):
+                batch = [(email, skeleton.as_string(body_part(*body), {'To': email}))
+                         for (email, _), body in zip(chunk, bodies)]
+            if outbox is not None:
+                outbox.enqueue_each(notice.current.date, 'net', batch)
+                refused.update(self.drain_outbox())
+            else:
+                batch_refused = self.send_rendered(batch)
+                accepted += sum(1 for email, _ in batch if email not in batch_refused)
+                refused.update(batch_refused)
+
+        if outbox is not None:
+            if not members:
+                # Still retry anything an earlier run left undelivered
+                refused.update(self.drain_outbox())
+            accepted = outbox.sent - sent_before
+
+        logger.info("Sent %s personalized reminders, %s refused", accepted, len(refused))
+        return refused
+
+    def send_rendered(self, batch):
+        """Sends serialized messages, one recipient each
+
+            Args: LIST batch: (STRING recipient, STRING message) tuples
+
+            Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        if not self.async_send:
+            refused = {}
+            for email, data in batch:
+                refused.update(self.send_email(data, [email]))
+            return refused
+
+        import asyncio
+
+        me = self.script_config['smtp_auth_user']
+        jobs = [(self.script_config, me, [email], data) for email, data in batch]
+        results = asyncio.run(deliver_async(jobs, self.script_config.get('smtp_concurrency', 4)))
+
+        refused = {}
+        for (email, _), result in zip(batch, results):
+            if result['error'] is not None:
+                logger.error("Sending to %s failed: %s", email, result['error'])
+                refused[email] = (None, str(result['error']))
+            for recipient, (code, response) in result['refused'].items():
+                logger.warning("Recipient %s refused: %s %s", recipient, code, response)
+                refused[recipient] = (code, response)
+        self.suppress_refused(refused)
+        return refused
+
+    def load_schedule(self):
+        """Opens the Net Control Schedule workbook
+
+            Args: None
+
+            Returns: OBJECT Schedule of the schedule sheet
+        """
+        with METRICS.stage('schedule_parse'):
+            ordinals, rows = self.read_workbook(self.script_config['schedule_excel_file'],
+                                                [self.script_config['schedule_sheet_name']],
+                                                skiprows=1,
+                                                columns=('DATE', 'PRIMARY', 'BACKUP', 'Net'),
+                                                build=schedule_table)
+
+        return Schedule(ordinals, rows)
+
+    def find_net_notice(self, schedule, now):
+        """Locates this week's and next week's Primary and Backup Net Control assignments
+
+            The look-ahead window (net_window_days, default 7) and the number of
+            nets listed in upcoming_nets (upcoming_net_count, default 2) come
+            from the configuration.
+
+            Args:   OBJECT schedule: Schedule from load_schedule
+                    DATETIME now
+
+            Returns: OBJECT NetNotice, or None when either week has no assignment
+        """
+        window_days = self.script_config.get('net_window_days', 7)
+        upcoming_count = self.script_config.get('upcoming_net_count', 2)
+
+        future_date_1wk = now + timedelta(days=window_days)
+        logger.info("Current Date: %s, Future Date: %s, Window: %s days",
+                    now, future_date_1wk, window_days)
+
+        # Get this week's Net date
+        net_cur = schedule.net_for(now, window_days)
+
+        if net_cur is None:
+            logger.fatal("No configured net control or backup net control for this week!",
+                         )
+            return None
+
+        # Get next future Net date
+        net_next = schedule.net_for(future_date_1wk, window_days)
+
+        if net_next is None:
+            logger.fatal("No configured net control or backup net control for next week!")
+            return None
+
+        logger.info("Net Date: %s, Primary: %s, Backup: %s",
+                    net_cur.net_date,
+                    net_cur.primary,
+                    net_cur.backup
+                    )
+        logger.info("Net Date: %s, Primary: %s, Backup: %s",
+                    net_next.net_date,
+                    net_next.primary,
+                    net_next.backup
+                    )
+
+        # Nets following this week's, for templates that list several
+        upcoming = schedule.next_nets(net_cur.date + timedelta(days=1), upcoming_count)
+
+        return NetNotice(net_cur, net_next, upcoming, self.script_config['logo'])
+
+    def schedule_snapshot_file(self):
+        """Returns where the schedule snapshot for change detection is kept
+
+            Args: None
+
+            Returns: STRING schedule_snapshot_file (default: cache_dir/schedule_snapshot.json),
+                     or None when neither is configured
+        """
+        if self.script_config.get('schedule_snapshot_file') is not None:
+            return self.script_config['schedule_snapshot_file']
+        if self.cache_dir is not None:
+            return os.path.join(self.cache_dir, 'schedule_snapshot.json')
+        return None
+
+    def check_schedule_changes(self, now, schedule=None):
+        """Compares the schedule with the stored snapshot and announces any changes
+
+            A workbook with the snapshot's size and modification time, or else
+            its content hash, is unchanged and the check ends there, without
+            parsing the workbook, rendering or connecting to SMTP. Otherwise
+            the nets from now on are compared with the snapshot's, and unless
+            change_notice is false a change notice goes to the operators
+            concerned and the switch_notify contacts. The first check only
+            stores the snapshot. Test runs print the notice and leave the
+            snapshot as it was.
+
+            Args:   DATETIME now: Nets before this date are not compared
+                    OBJECT schedule: Schedule already loaded (default: read when changed)
+
+            Returns: LIST of ScheduleChange, empty when nothing changed
+        """
+        snapshot_file = self.schedule_snapshot_file()
+        if snapshot_file is None:
+            raise NetReminderError("Schedule change detection needs schedule_snapshot_file "
+                                   "or cache_dir")
+
+        filename = self.script_config['schedule_excel_file']
+        stat = os.stat(filename)
+        previous = None
+        try:
+            with open(snapshot_file, 'r', encoding='UTF-8') as f:
+                previous = json.load(f)
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError) as exc:
+            logger.warning("Ignoring unreadable schedule snapshot %s: %s", snapshot_file, exc)
+
+        if previous is not None and \
+                (previous['mtime_ns'], previous['size']) == (stat.st_mtime_ns, stat.st_size):
+            logger.info("Schedule unchanged since the last check")
+            return []
+
+        digest = file_digest(filename)
+        if previous is not None and previous['sha256'] == digest:
+            logger.info("Schedule rewritten with the same content")
+            if not self.test:
+                previous.update(mtime_ns=stat.st_mtime_ns, size=stat.st_size)
+                self.write_schedule_snapshot(snapshot_file, previous)
+            return []
+
+        if schedule is None:
+            schedule = self.load_schedule()
+
+        changes = []
+        if previous is None:
+            logger.info("First schedule check, changes are reported from the next one")
+        else:
+            changes = diff_schedule(previous['nets'], schedule, now.date())
+            logger.info("Schedule changes: %s nets (%s)", len(changes),
+                        LogSummary([change.date.isoformat() for change in changes]))
+            if changes and self.script_config.get('change_notice', True):
+                self.email_change_notice(changes)
+
+        if not self.test:
+            self.write_schedule_snapshot(snapshot_file, schedule_snapshot(schedule, stat, digest))
+        return changes
+
+    @staticmethod
+    def write_schedule_snapshot(snapshot_file, snapshot):
+        """Stores a schedule snapshot
+
+            Args:   STRING snapshot_file
+                    DICTIONARY snapshot: From schedule_snapshot
+
+            Returns: None
+        """
+        os.makedirs(os.path.dirname(os.path.abspath(snapshot_file)), exist_ok=True)
+        write_atomic(snapshot_file, lambda f: f.write(json.dumps(snapshot).encode('UTF-8')))
+
+    def gather_change_notice_addresses(self, changes):
+        """Generates the change notice list: the operators concerned and switch_notify contacts
+
+            Operators are the primary and backup names before and after each
+            change, matched ignoring case against the roster's operator_columns
+            (default: Member and Callsign).
+
+            Args: LIST changes: ScheduleChange
+
+            Returns: LIST email_dist: List of emails
+        """
+        columns = tuple(self.script_config.get('operator_columns', ['Member', 'Callsign']))
+        names = {name.lower() for change in changes for name in change.operators()}
+
+        roster = self.load_roster(('Email',) + columns)
+        index = self.recipient_index()
+        email_dist = []
+        found = set()
+        emails = roster.column('Email')
+        for values in map(roster.column, columns):
+            for position, value in enumerate(values):
+                name = '' if value is None else str(value).strip().lower()
+                if name in names:
+                    found.add(name)
+                    email_dist += index.add(emails[position])
+
+        if names - found:
+            logger.warning("No roster address for operators: %s", ", ".join(sorted(names - found)))
+
+        for key in ('switch_notify1_email', 'switch_notify2_email'):
+            email_dist += index.add(self.script_config.get(key))
+        index.report()
+
+        logger.info("Change Notice Distribution List: %s", LogSummary(email_dist))
+        return email_dist
+
+    def build_change_notice(self, changes, email_dist):
+        """Builds the notice of schedule changes
+
+            Args:   LIST changes: ScheduleChange
+                    LIST email_dist: Recipients for the To header
+
+            Returns: OBJECT msg
+        """
+        t = self.email_template(self.script_config.get('change_notice_config',
+                                                       DEFAULT_CHANGE_NOTICE_CONFIG_FILE),
+                                DEFAULT_CHANGE_NOTICE_CONFIG)
+        context = {key: self.script_config.get(key) for key in
+                   ('switch_notify1_name', 'switch_notify1_email', 'switch_notify2_name',
+                    'switch_notify2_email', 'excel_maintainer_name', 'excel_maintainer_email')}
+        with METRICS.stage('render'):
+            email_body = t.render(context, changes=[change.context() for change in changes])
+
+        email_subject = self.script_config.get('change_notice_subject_template',
+                                               DEFAULT_CHANGE_NOTICE_SUBJECT_TEMPLATE).format(
+            ", ".join(change.date.strftime("%m/%d/%Y") for change in changes))
+        logger.info("Email Subject: %s", email_subject)
+
+        from email.mime.multipart import MIMEMultipart
+
+        with METRICS.stage('mime_build'):
+            msg = MIMEMultipart()
+            msg.attach(body_part(*email_body))
+
+            msg['Subject'] = email_subject
+            msg['From'] = self.script_config['email_from']
+            if self.script_config.get('email_reply_to') is not None:
+                msg['Reply-to'] = self.script_config['email_reply_to']
+            msg['To'] = ", ".join(email_dist)
+
+        return msg
+
+    def email_change_notice(self, changes):
+        """Sends the notice of schedule changes to the operators concerned
+
+            Args: LIST changes: ScheduleChange
+
+            Returns: DICTIONARY refused {recipient: (code, response)}
+        """
+        email_dist = self.gather_change_notice_addresses(changes)
+        if not email_dist:
+            logger.warning("Nobody to send the schedule change notice to")
+            return {}
+
+        return self.deliver(self.build_change_notice(changes, email_dist), email_dist)
+
+    def reminders_affected(self, dates, changes, schedule=None):
+        """Lists the dates whose reminder mentions a changed net
+
+            Args:   LIST dates: Reminder dates (datetimes)
+                    LIST changes: ScheduleChange
+                    OBJECT schedule: Schedule (default: read from the workbook)
+
+            Returns: LIST of the affected dates
+        """
+        if schedule is None:
+            schedule = self.load_schedule()
+        changed = {change.date for change in changes}
+
+        affected = []
+        for now in dates:
+            notice = self.find_net_notice(schedule, now)
+            if notice is not None and changed.intersection(
+                    net.date for net in (notice.current, notice.following, *notice.upcoming)):
+                affected.append(now)
+        return affected
+
+    def run(self, now=None, fetch_remote=False, schedule=None):
+        """Runs the reminder pipeline for a single date
+
+            Args:   DATETIME now: Date to send the reminder for (default: current date)
+                    BOOLEAN fetch_remote: Fetch the workbooks from their URLs first
+                    OBJECT schedule: Schedule already loaded (default: read from the workbook)
+
+            Returns: OBJECT NetNotice, or None when the no net control notice was sent
+        """
+        if now is None:
+            now = datetime.now()
+
+        if fetch_remote is True:
+            self.fetch_remote_files()
+        else:
+            logger.info("Using local files")
+
+        try:
+            # Opening the Net Control Schedule to locate the Primary and Backup
+            # Net Control assignments
+            if schedule is None:
+                schedule = self.load_schedule()
+            notice = self.find_net_notice(schedule, now)
+
+            if notice is None:
+                self.email_no_net_notice(now)
+                return None
+
+            self.email_net_notice(notice)
+        except KeyError as e:
+            raise NetReminderError(e) from e
+
+        return notice
+
+    def run_batch(self, dates, fetch_remote=False, output_dir=None, mbox=None):
+        """Runs the reminder pipeline for many dates with one schedule and roster load
+
+            Each date resolves to its net as in run(). Dates that resolve to a net
+            already handled are skipped, so a daily list of dates still yields one
+            reminder per net. The messages are written to output_dir (one .eml per
+            message) and/or appended to an mbox file; when neither is given they
+            are delivered like run() would, personalized when personalize is set.
+
+            Args:   LIST dates: Dates (datetimes) to process
+                    BOOLEAN fetch_remote: Fetch the workbooks from their URLs first
+                    STRING output_dir: Directory to write .eml files into
+                    STRING mbox: mbox file to append the messages to
+
+            Returns: LIST of (DATETIME now, OBJECT NetNotice or None) per message
+        """
+        if fetch_remote is True:
+            self.fetch_remote_files()
+
+        results = []
+        messages = []
+        keys = []
+        personalized = []
+        personalize = self.script_config.get('personalize', False) and \
+            output_dir is None and mbox is None
+        seen_ordinals = set()
+
+        try:
+            schedule = self.load_schedule()
+            email_dist = None
+
+            for now in dates:
+                notice = self.find_net_notice(schedule, now)
+
+                if notice is None:
+                    msg, no_net_dist = self.build_no_net_notice(now)
+                    messages.append((now, msg, no_net_dist))
+                    keys.append((now.date(), 'no_net'))
+                    results.append((now, None))
+                    continue
+
+                if notice.current.ordinal in seen_ordinals:
+                    continue
+                seen_ordinals.add(notice.current.ordinal)
+
+                if personalize:
+                    personalized.append(notice)
+                    results.append((now, notice))
+                    continue
+
+                if email_dist is None:
+                    email_dist = self.gather_email_addresses()
+
+                messages.append((now, self.build_net_notice(notice, email_dist), email_dist))
+                keys.append((notice.current.date, 'net'))
+                results.append((now, notice))
+        except KeyError as e:
+            raise NetReminderError(e) from e
+
+        logger.info("Batch of %s dates produced %s messages", len(dates), len(messages))
+
+        if output_dir is None and mbox is None:
+            self.deliver_many(messages, keys)
+            for notice in personalized:
+                self.email_personalized_notice(notice)
+        else:
+            write_messages(messages, output_dir, mbox)
+
+        return results
+
+
+def batch_dates(start, end, step_days=7):
+    """Lists the dates from start to end (inclusive) every step_days days
+
+        Args:   DATETIME start
+                DATETIME end
+                INTEGER step_days
+
+        Returns: LIST of DATETIME
+    """
+    if step_days < 1:
+        raise NetReminderError("Batch step must be at least one day")
+
+    dates = []
+    current = start
+    while current <= end:
+        dates.append(current)
+        current += timedelta(days=step_days)
+    return dates
+
+
+def html_body(msg):
+    """Extracts the HTML body of a built message
+
+        Args: OBJECT msg
+
+        Returns: STRING html, or None when the message has no HTML part
+    """
+    for part in msg.walk():
+        if part.get_content_type() == 'text/html':
+            return part.get_payload(decode=True).decode(part.get_content_charset() or 'UTF-8')
+    return None
+
+
+# Serializes appends to mbox files, which tenant threads may share
+MBOX_LOCK = threading.Lock()
+
+
+def write_messages(messages, output_dir=None, mbox=None):
+    """Writes built messages to a directory of .eml files and/or an mbox file
+
+        Several tenants may append to the same mbox, one after the other.
+
+        Args:   LIST messages: (DATETIME now, OBJECT msg, LIST email_dist) tuples
+                STRING output_dir
+                STRING mbox
+
+        Returns: None
+    """
+    if output_dir is not None:
+        os.makedirs(output_dir, exist_ok=True)
+        for now, msg, _ in messages:
+            filename = os.path.join(output_dir,
+                                    f"net_reminder_{now.strftime('%Y-%m-%d')}.eml")
+            with open(filename, 'wb') as f:
+                f.write(msg.as_bytes())
+            logger.info("Wrote %s", filename)
+
+    if mbox is not None:
+        import mailbox
+
+        with MBOX_LOCK:
+            try:
+                box = mailbox.mbox(mbox)
+                box.lock()
+                try:
+                    for _, msg, _ in messages:
+                        box.add(msg)
+                    box.flush()
+                finally:
+                    box.unlock()
+                    box.close()
+            except (mailbox.Error, OSError) as exc:
+                raise NetReminderError(f"Unable to write mbox {mbox}: {exc}") from exc
+        logger.info("Appended %s messages to %s", len(messages), mbox)
+
+
+def run(script_config, now=None, fetch_remote=False, **kwargs):
+    """Convenience wrapper that runs the pipeline once for a loaded configuration
+
+        Args:   DICTIONARY script_config: Loaded YAML configuration (see load_config)
+                DATETIME now: Date to send the reminder for (default: current date)
+                BOOLEAN fetch_remote: Fetch the workbooks from their URLs first
+                kwargs: Passed through to NetReminder
+
+        Returns: OBJECT NetNotice, or None when the no net control notice was sent
+    """
+    with NetReminder(script_config, **kwargs) as reminder:
+        return reminder.run(now, fetch_remote=fetch_remote)
+
+
+#######################################
+# Tenants
+#######################################
+def tenant_configs(script_config):
+    """Splits a configuration into one configuration per tenant
+
+    Every top-level key other than tenants is a shared default, overridden
+    by the keys of each entry in the tenants list. A configuration without
+    tenants is a single, unnamed tenant.
+
+    Args: DICTIONARY script_config: Loaded YAML configuration
+
+    Returns: LIST of (STRING name, DICTIONARY script_config) tuples
+    """
+    tenants = script_config.get('tenants')
+    if not tenants:
+        return [(None, script_config)]
+
+    shared = {key: value for key, value in script_config.items() if key != 'tenants'}
+    configs = []
+    for position, tenant in enumerate(tenants, start=1):
+        config = dict(shared)
+        config.update(tenant)
+        config['name'] = str(config.get('name', f"tenant{position}"))
+        configs.append((config['name'], config))
+
+    names = [name for name, _ in configs]
+    duplicates = sorted({name for name in names if names.count(name) > 1})
+    if duplicates:
+        raise NetReminderError(f"Duplicate tenant names: {', '.join(duplicates)}")
+
+    return configs
+
+
+class TenantResources:
+    """Workbooks, downloads, suppression lists and SMTP pools shared by the tenants of one run
+
+    A workbook several tenants read (with the same sheets and columns) is
+    parsed once, a file several tenants fetch is downloaded once, tenants
+    naming the same suppression file append to it under one lock, and
+    tenants sending through the same SMTP server and account share one
+    pooled connection. Safe to use from several threads.
+
+    Args: None
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._workbooks = {}
+        self._workbook_locks = {}
+        self._fetches = {}
+        self._fetch_urls = {}
+        self._suppression_lists = {}
+        self._smtp_pools = {}
+
+    def read_workbook(self, filename, sheet_names, cache_dir=None, **kwargs):
+        """Reads a workbook once per run, see read_workbook_cached
+
+        Args:   STRING filename
+                LIST sheet_names
+                STRING cache_dir: Workbook cache directory of the first reader
+                kwargs: Passed through to read_workbook_cached
+
+        Returns: OBJECT as read_workbook_cached
+        """
+        key = (os.path.abspath(filename), tuple(sheet_names), repr(sorted(kwargs.items())))
+
+        with self._lock:
+            lock = self._workbook_locks.setdefault(key, threading.Lock())
+
+        with lock:
+            if key not in self._workbooks:
+                self._workbooks[key] = read_workbook_cached(filename, sheet_names,
+                                                            cache_dir=cache_dir, **kwargs)
+            else:
+                logger.info("Shared workbook: %s %s", filename, list(sheet_names))
+            return self._workbooks[key]
+
+    def fetch_remote_files(self, files, user, password, max_workers=4, max_bytes=None):
+        """Fetches remote files once per run, see fetch_remote_files
+
+        Files another tenant already fetched (or is fetching) from the same
+        URL are not downloaded again; their result is shared. Two tenants
+        fetching different URLs into the same file is a configuration error.
+
+        Args:   LIST files: (STRING url, STRING filename, STRING sha256 or None) tuples
+                STRING user
+                STRING password
+                INTEGER max_workers: Concurrent downloads
+                INTEGER max_bytes: Largest accepted file, None for no limit
+
+        Return: DICTIONARY {filename: BOOLEAN downloaded, or the NetReminderError raised}
+        """
+        from concurrent.futures import Future
+
+        owned = []
+        futures = {}
+        with self._lock:
+            # Check every file before claiming any, so a conflict leaves no
+            # download claimed that would never complete
+            for url, filename, _ in files:
+                other = self._fetch_urls.get(os.path.abspath(filename), url)
+                if other != url:
+                    raise NetReminderError(f"File {filename} is fetched from both "
+                                           f"{other} and {url}")
+            for url, filename, sha256 in files:
+                self._fetch_urls[os.path.abspath(filename)] = url
+                key = (url, os.path.abspath(filename))
+                if key not in self._fetches:
+                    self._fetches[key] = Future()
+                    owned.append((url, filename, sha256))
+                futures[filename] = self._fetches[key]
+
+        if owned:
+            try:
+                results = fetch_remote_files(owned, user, password, max_workers, max_bytes)
+            except BaseException as exc:
+                for _, filename, _ in owned:
+                    futures[filename].set_exception(exc)
+                raise
+            for _, filename, _ in owned:
+                futures[filename].set_result(results[filename])
+
+        return {filename: future.result() for filename, future in futures.items()}
+
+    def suppression_list(self, filename):
+        """Returns the one SuppressionList of a file for all tenants
+
+        Args: STRING filename
+
+        Returns: OBJECT SuppressionList
+        """
+        key = os.path.abspath(filename)
+        with self._lock:
+            if key not in self._suppression_lists:
+                self._suppression_lists[key] = SuppressionList(filename)
+            return self._suppression_lists[key]
+
+    def smtp_pool(self, script_config):
+        """Returns the pool for the SMTP server and account of a configuration
+
+        Args: DICTIONARY script_config
+
+        Returns: OBJECT SMTPPool
+        """
+        key = (script_config['smtp_server'], script_config['smtp_port'],
+               script_config.get('smtp_auth_user'), script_config.get('smtp_auth_pass'),
+               script_config.get('smtp_ssl', True), script_config.get('smtp_starttls', False))
+
+        with self._lock:
+            if key not in self._smtp_pools:
+                self._smtp_pools[key] = SMTPPool.from_config(script_config)
+            return self._smtp_pools[key]
+
+    def close(self):
+        """Closes the shared SMTP connections
+
+        Args: None
+
+        Returns: None
+        """
+        for pool in self._smtp_pools.values():
+            pool.close()
+
+
+def run_tenants(script_config, action, max_workers=None, **kwargs):
+    """Runs an action for every tenant of a configuration in a worker pool
+
+    Each tenant gets its own NetReminder, sharing a TenantResources with the
+    others, so one slow tenant doesn't hold up the rest. A tenant that fails
+    is logged and reported without stopping the others.
+
+    Args:   DICTIONARY script_config: Loaded YAML configuration
+            FUNCTION action: Called with (STRING name, OBJECT NetReminder) per tenant
+            INTEGER max_workers: Tenants processed at once (default: tenant_workers or 4)
+            kwargs: Passed through to NetReminder
+
+    Returns: DICTIONARY {name: result of action, or the exception raised}
+    """
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+
+    configs = tenant_configs(script_config)
+    if max_workers is None:
+        max_workers = script_config.get('tenant_workers', 4)
+
+    resources = TenantResources()
+    results = {}
+
+    def run_tenant(name, config):
+        logger.info("Tenant %s: starting", name)
+        METRICS.set_tenant(name)
+        try:
+            with NetReminder(config, resources=resources, **kwargs) as reminder:
+                result = action(name, reminder)
+        finally:
+            METRICS.set_tenant(None)
+        logger.info("Tenant %s: finished", name)
+        return result
+
+    try:
+        with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(configs)))) as executor:
+            futures = {executor.submit(run_tenant, name, config): name
+                       for name, config in configs}
+            for future in as_completed(futures):
+                try:
+                    results[futures[future]] = future.result()
+                except NetReminderError as exc:
+                    logger.error("Tenant %s failed: %s", futures[future], exc)
+                    results[futures[future]] = exc
+                except Exception as exc:  # pylint: disable=broad-except
+                    # An unexpected error in one tenant must not stop the others
+                    logger.exception("Tenant %s failed", futures[future])
+                    results[futures[future]] = exc
+    finally:
+        resources.close()
+
+    return results
+
+
+#######################################
+# Daemon
+#######################################
+class ReminderDaemon:
+    """Resident scheduler that sends each reminder a set time before its net
+
+    The configuration, schedule and compiled templates stay loaded between
+    reminders. They are reloaded on SIGHUP, or when the configuration, a
+    workbook, a template or the logo changes on disk (checked every
+    daemon_poll_seconds). The reminder for a net is sent daemon_lead_hours
+    before daemon_net_time on the net date. A reminder that was due while the
+    daemon was down is sent at startup, as long as its net has not started.
+    The last net sent is recorded in daemon_state_file (default:
+    cache_dir/daemon_state.json), so a restart never sends it again. A test
+    daemon (--test or --test_email) reads the state but only tracks what it
+    sent in memory, so it never makes a real daemon skip a net.
+
+    Args:   STRING config_file: Configuration file, re-read on reload
+            DICTIONARY options: Passed through to NetReminder
+            BOOLEAN fetch_remote: Fetch the workbooks on load and before each reminder
+            STRING log_name: Log file, set up again with the log settings on every load
+                (default: None, leave logging alone)
+    """
+
+    def __init__(self, config_file, options=None, fetch_remote=False, log_name=None):
+        self.config_file = config_file
+        self.log_name = log_name
+        self.options = options or {}
+        self.fetch_remote = fetch_remote
+        self.reminder = None
+        self.schedule = None
+        self.watched = {}
+        self.last_sent = None
+        self.retry_at = None
+        self.announced = None
+        self.reload_requested = False
+        self.stop_requested = False
+        self.wake = threading.Event()
+
+    def setting(self, key, default):
+        """Reads a daemon setting from the loaded configuration
+
+        Args:   STRING key
+                OBJECT default
+
+        Returns: OBJECT value
+        """
+        return self.reminder.script_config.get(key, default)
+
+    def state_file(self):
+        """Returns the file recording the last net sent
+
+        Args: None
+
+        Returns: STRING filename, or None when neither daemon_state_file nor cache_dir is set
+        """
+        state_file = self.setting('daemon_state_file', None)
+        if state_file is None and self.reminder.cache_dir is not None:
+            state_file = os.path.join(self.reminder.cache_dir, 'daemon_state.json')
+        return state_file
+
+    def watched_files(self):
+        """Snapshots the modification times of the files a reload depends on
+
+        Args: None
+
+        Returns: DICTIONARY {filename: mtime_ns or None when missing}
+        """
+        script_config = self.reminder.script_config
+        files = [self.config_file,
+                 script_config.get('schedule_excel_file'),
+                 script_config.get('roster_excel_file'),
+                 self.reminder.email_config,
+                 self.reminder.no_net_control_email_config,
+                 script_config.get('logo')]
+        files += script_config.get('inline_images') or []
+
+        snapshot = {}
+        for filename in files:
+            if filename is None:
+                continue
+            try:
+                snapshot[filename] = os.stat(filename).st_mtime_ns
+            except OSError:
+                snapshot[filename] = None
+        return snapshot
+
+    def load(self):
+        """Loads the configuration and schedule, replacing the current ones
+
+        Args: None
+
+        Returns: None
+        """
+        script_config = load_config(self.config_file)
+        if script_config.get('tenants'):
+            raise NetReminderError("--daemon serves a single club, run one daemon per "
+                                   "tenant configuration")
+        if self.log_name is not None:
+            log_setup(self.log_name, script_config)
+
+        reminder = NetReminder(script_config, **self.options)
+        try:
+            if self.fetch_remote is True:
+                reminder.fetch_remote_files()
+            schedule = reminder.load_schedule()
+            if script_config.get('daemon_change_notices', False):
+                try:
+                    reminder.check_schedule_changes(datetime.now(), schedule)
+                except (OSError, NetReminderError) as e:
+                    # A failed notice must not keep the new schedule from loading
+                    logger.error("Schedule change check failed: %s", e)
+        except KeyError as e:
+            reminder.close()
+            raise NetReminderError(e) from e
+        except NetReminderError:
+            reminder.close()
+            raise
+
+        if self.reminder is not None:
+            self.reminder.close()
+        self.reminder = reminder
+        self.schedule = schedule
+        self.watched = self.watched_files()
+        self.retry_at = None
+
+        state_file = self.state_file()
+        if state_file is None:
+            logger.warning("No daemon_state_file or cache_dir, sent reminders are not "
+                           "remembered across restarts")
+        elif os.path.exists(state_file):
+            with open(state_file, 'r', encoding='UTF-8') as f:
+                stored = json.load(f).get('last_sent')
+            # A test daemon's in-memory progress is ahead of the file
+            if stored is not None and (self.last_sent is None or stored > self.last_sent):
+                self.last_sent = stored
+
+        logger.info("Daemon loaded %s with %s scheduled nets", self.config_file, len(schedule))
+
+    def reload(self):
+        """Reloads everything, keeping the previous data when the reload fails
+
+        Args: None
+
+        Returns: None
+        """
+        self.reload_requested = False
+        try:
+            self.load()
+        except (NetReminderError, OSError) as e:
+            # Don't retry a broken file on every poll, only once it changes again
+            self.watched = self.watched_files()
+            logger.error("Reload failed, keeping the previous configuration: %s", e)
+
+    def mark_sent(self, net):
+        """Records a net as sent
+
+        Test runs are only recorded in memory: their mail never reached the
+        roster, so a later real daemon must still send the net.
+
+        Args: OBJECT net: NetAssignment
+
+        Returns: None
+        """
+        self.last_sent = net.ordinal
+        state_file = self.state_file()
+        if state_file is None or self.reminder.test or self.reminder.test_email is not None:
+            return
+
+        state = json.dumps({'last_sent': net.ordinal, 'net_date': net.date.isoformat()})
+        os.makedirs(os.path.dirname(os.path.abspath(state_file)), exist_ok=True)
+        write_atomic(state_file, lambda f: f.write(state.encode('UTF-8')))
+
+    def next_reminder(self, now):
+        """Finds the next net still needing a reminder and when to send it
+
+        Args: DATETIME now
+
+        Returns: TUPLE (NetAssignment net, DATETIME send_at), or (None, None)
+        """
+        net_time = datetime.strptime(self.setting('daemon_net_time', '19:00'), '%H:%M').time()
+        lead = timedelta(hours=self.setting('daemon_lead_hours', 24))
+
+        start = now.toordinal()
+        if self.last_sent is not None:
+            start = max(start, self.last_sent + 1)
+
+        while True:
+            nets = self.schedule.next_nets(date.fromordinal(start), 1)
+            if not nets:
+                return None, None
+
+            net_start = datetime.combine(nets[0].date, net_time)
+            if net_start > now:
+                return nets[0], net_start - lead
+
+            # The net has already started, its reminder is no use any more
+            start = nets[0].ordinal + 1
+
+    def send(self, net):
+        """Sends the reminder for a net
+
+        Args: OBJECT net: NetAssignment
+
+        Returns: None
+        """
+        if self.fetch_remote is True:
+            self.reminder.fetch_remote_files()
+            if self.watched_files() != self.watched:
+                # Pick up the fetched workbooks; the loop sends once reloaded
+                self.reload()
+                return
+
+        logger.info("Sending the reminder for the %s net", net.net_date)
+        try:
+            self.reminder.run(datetime.combine(net.date, datetime.min.time()),
+                              schedule=self.schedule)
+        except (NetReminderError, OSError) as e:
+            retry_seconds = self.setting('daemon_retry_seconds', 300)
+            self.retry_at = datetime.now() + timedelta(seconds=retry_seconds)
+            logger.error("Reminder for the %s net failed, retrying in %s seconds: %s",
+                         net.net_date, retry_seconds, e)
+            return
+        finally:
+            # Every attempt reports what it (and the loop since the last one) cost
+            METRICS.flush(self.reminder.script_config)
+
+        self.retry_at = None
+        self.mark_sent(net)
+
+    def handle_signal(self, signum, _frame):
+        """Flags a reload (SIGHUP) or a stop (SIGTERM, SIGINT) and wakes the loop
+
+        Args:   INTEGER signum
+                OBJECT _frame
+
+        Returns: None
+        """
+        import signal
+
+        if signum == getattr(signal, 'SIGHUP', None):
+            logger.info("SIGHUP received, reloading")
+            self.reload_requested = True
+        else:
+            logger.info("Signal %s received, stopping", signum)
+            self.stop_requested = True
+        self.wake.set()
+
+    def run_forever(self):
+        """Runs the scheduler until SIGTERM or SIGINT
+
+        Args: None
+
+        Returns: None
+        """
+        import signal
+
+        for name in ('SIGHUP', 'SIGTERM', 'SIGINT'):
+            if hasattr(signal, name):
+                signal.signal(getattr(signal, name), self.handle_signal)
+
+        self.load()
+
+        try:
+            while not self.stop_requested:
+                self.wake.clear()
+
+                if self.reload_requested or self.watched_files() != self.watched:
+                    self.reload()
+
+                if self.reminder.outbox() is not None:
+                    try:
+                        self.reminder.drain_outbox()
+                    except (NetReminderError, OSError) as e:
+                        logger.error("Outbox delivery failed: %s", e)
+
+                now = datetime.now()
+                net, send_at = self.next_reminder(now)
+                if net is not None and self.retry_at is not None:
+                    send_at = max(send_at, self.retry_at)
+
+                if net is not None and send_at <= now:
+                    self.send(net)
+                    continue
+
+                timeout = self.setting('daemon_poll_seconds', 60)
+                if net is not None:
+                    timeout = min(timeout, (send_at - now).total_seconds())
+
+                if (net, send_at) != self.announced:
+                    self.announced = (net, send_at)
+                    if net is None:
+                        logger.warning("No upcoming nets in the schedule, waiting for a change")
+                    else:
+                        logger.info("Next reminder: %s net at %s", net.net_date, send_at)
+                self.wake.wait(timeout)
+        finally:
+            if self.reminder is not None:
+                self.reminder.close()
+
+        logger.info("Daemon stopped")
+
+
+###########################################################
+# Begin Script
+###########################################################
+def main(argv=None):
+    """Command line entry point
+
+        Args: LIST argv: Command line arguments (default: sys.argv[1:])
+
+        Returns: INTEGER exit status
+    """
+    if argv is None:
+        argv = sys.argv[1:]
+
+    log_name = DEFAULT_LOG_NAME
+    config_file = DEFAULT_CONFIG_FILE
+    now = None
+    fetch_remote = False
+    daemon = False
+    check_changes = False
+    profile = None
+    options = {}
+    batch = {'start': None, 'end': None, 'dates': None, 'step': 7,
+             'output_dir': None, 'mbox': None}
+
+    # Grab the command line args
+    try:
+        opts, _ = getopt.getopt(argv, "c:l:hn:ts:e:q:x:f",
+                                ["help", "config=", "econfig=", "fetch_remote", "nconfig=",
+                                 "log=", "now=", "subject=", "test", "test_email=",
+                                 "start=", "end=", "dates=", "step=", "output_dir=", "mbox=",
+                                 "async_send", "daemon", "profile=", "changes"]
+                                )
+    except getopt.GetoptError as e:
+        print(e)
+        usage()
+        return 2
+
+    try:
+        for o, a in opts:
+            if o in ["-c", "--config"]:
+                config_file = a
+            elif o in ["-h", "--help"]:
+                usage()
+                return 0
+            elif o in ["-l","--log"]:
+                log_name = a
+            elif o in ["-e","--econfig"]:
+                options['email_config'] = a
+            elif o in ["-x","--nconfig"]:
+                options['no_net_control_email_config'] = a
+            elif o in ["-n","--now"]:
+                now = datetime.strptime(a, '%m/%d/%Y')
+            elif o in ["-s","--subject"]:
+                options['email_subject_template'] = a
+            elif o in ["-t","--test"]:
+                options['test'] = True
+            elif o in ["-f","--fetch_remote"]:
+                fetch_remote = True
+            elif o in ["-q","--test_email"]:
+                options['test_email'] = a
+            elif o == "--start":
+                batch['start'] = datetime.strptime(a, '%m/%d/%Y')
+            elif o == "--end":
+                batch['end'] = datetime.strptime(a, '%m/%d/%Y')
+            elif o == "--dates":
+                batch['dates'] = [datetime.strptime(d.strip(), '%m/%d/%Y')
+                                  for d in a.split(',') if d.strip()]
+            elif o == "--step":
+                batch['step'] = int(a)
+            elif o == "--output_dir":
+                batch['output_dir'] = a
+            elif o == "--mbox":
+                batch['mbox'] = a
+            elif o == "--async_send":
+                options['async_send'] = True
+            elif o == "--daemon":
+                daemon = True
+            elif o == "--profile":
+                profile = a
+            elif o == "--changes":
+                check_changes = True
+            else:
+                usage()
+                return 2
+    except ValueError as e:
+        print(e)
+        return 2
+
+    if profile is not None and daemon is True:
+        print("--profile profiles a single run, it can't be combined with --daemon")
+        return 2
+
+    # Setup logging, then again with the configuration's log settings
+    log_setup(log_name)
+    logger.info("Starting net_reminder.py %s", SCRIPT_VERSION)
+    script_config = None
+
+    if profile is not None:
+        if not options.get('test'):
+            logger.warning("Profiling a run that sends mail, add --test to profile without sending")
+        METRICS.profiler = StageProfiler()
+        METRICS.profiler.start()
+
+    try:
+        if daemon is True:
+            ReminderDaemon(config_file, options, fetch_remote, log_name).run_forever()
+            return 0
+
+        with METRICS.stage('config_load'):
+            script_config = load_config(config_file)
+        log_setup(log_name, script_config)
+
+        dates = batch['dates']
+        if dates is None and batch['start'] is not None:
+            dates = batch_dates(batch['start'], batch['end'] or batch['start'], batch['step'])
+
+        def process(name, reminder):
+            run_dates = dates
+            fetch = fetch_remote
+            if check_changes is True:
+                if fetch_remote is True:
+                    reminder.fetch_remote_files()
+                    fetch = False
+                changes = reminder.check_schedule_changes(now or datetime.now())
+                if dates is None or not changes:
+                    return changes
+                # Only the reminders mentioning a changed net are rendered again
+                run_dates = reminder.reminders_affected(dates, changes)
+                logger.info("%s of %s reminders affected by the changes",
+                            len(run_dates), len(dates))
+                if not run_dates:
+                    return changes
+
+            if run_dates is None:
+                return reminder.run(now, fetch_remote=fetch)
+            # Each tenant writes its .eml files into its own directory
+            output_dir = batch['output_dir']
+            if output_dir is not None and name is not None:
+                output_dir = os.path.join(output_dir, name)
+            return reminder.run_batch(run_dates, fetch_remote=fetch,
+                                      output_dir=output_dir, mbox=batch['mbox'])
+
+        if script_config.get('tenants'):
+            results = run_tenants(script_config, process, **options)
+            failed = sorted(name for name, result in results.items()
+                            if isinstance(result, Exception))
+            if failed:
+                raise NetReminderError(f"Failed tenants: {', '.join(failed)}")
+        else:
+            with NetReminder(script_config, **options) as reminder:
+                process(None, reminder)
+    except NetReminderError as e:
+        print(e)
+        logger.fatal(e)
+        return 1
+    finally:
+        if METRICS.profiler is not None:
+            METRICS.profiler.stop()
+            report = METRICS.profiler.write(profile)
+            METRICS.profiler = None
+            logger.info("Profile written to %s and %s", profile, report)
+        if script_config is not None:
+            METRICS.flush(script_config)
+
+    logger.info("Finished")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,67 @@
+"""
+Test setup: imports net_reminder.py and the benchmark helpers from the
+repository, resets the module caches between tests and provides a local SMTP
+sink that refuses some recipients.
+"""
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+sys.path[:0] = [ROOT, os.path.join(ROOT, "benchmarks")]
+
+import net_reminder  # noqa: E402  pylint: disable=wrong-import-position
+from pipeline_benchmark import (SMTPSink, SMTPSinkHandler,  # noqa: E402  pylint: disable=wrong-import-position
+                                start_server)
+
+
+class RefusingHandler(SMTPSinkHandler):
+    """Refuses bad* recipients for good and temp* recipients once with a 451"""
+
+    def rcpt_reply(self, address):
+        if address.startswith("bad"):
+            return "550 no such user"
+        if address.startswith("temp") and self.server.first_try(address):
+            return "451 try again later"
+        return "250 OK"
+
+
+class RecordingSink(SMTPSink):
+    """SMTP sink keeping the accepted recipient count of every message"""
+
+    def __init__(self):
+        super().__init__(RefusingHandler)
+        self.sizes = []
+        self.tried = set()
+
+    def first_try(self, address):
+        """Returns True the first time an address is seen"""
+        with self._lock:
+            first = address not in self.tried
+            self.tried.add(address)
+        return first
+
+    def record(self, recipients):
+        super().record(recipients)
+        with self._lock:
+            self.sizes.append(recipients)
+
+
+@pytest.fixture(autouse=True)
+def reset_caches():
+    """Starts every test with empty template caches and metrics"""
+    net_reminder.TEMPLATE_ENVIRONMENTS.clear()
+    net_reminder.DEFAULT_TEMPLATES.clear()
+    net_reminder.METRICS.reset()
+    yield
+    net_reminder.METRICS.reset()
+
+
+@pytest.fixture
+def smtp_sink():
+    """Local SMTP sink on an ephemeral port, see RefusingHandler"""
+    sink = start_server(RecordingSink())
+    yield sink
+    sink.shutdown()
+    sink.server_close()
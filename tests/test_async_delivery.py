@@ -0,0 +1,73 @@
+"""
+Asynchronous delivery: a message counts as sent only when a recipient
+accepted it, and refused recipients are counted on their own.
+"""
+import asyncio
+
+import pytest
+
+import net_reminder as nr
+
+pytest.importorskip("aiosmtplib")
+
+FROM = "net@example.com"
+DATA = "Subject: Net reminder\r\n\r\nSee you on the net.\r\n"
+
+
+def counter(name):
+    return nr.METRICS.counters.get((name, ""), 0)
+
+
+def test_refusals_are_counted_apart_from_sent(smtp_sink):
+    config = {"smtp_server": "127.0.0.1", "smtp_port": smtp_sink.server_address[1],
+              "smtp_ssl": False, "smtp_timeout": 5, "smtp_retry_delay": 0}
+    jobs = [(config, FROM, ["one@example.com", "two@example.com"], DATA),
+            (config, FROM, ["bad@example.com", "temp@example.com"], DATA),
+            (config, FROM, ["bad1@example.com", "bad2@example.com"], DATA)]
+
+    results = asyncio.run(nr.deliver_async(jobs))
+
+    assert [result["error"] for result in results] == [None, None, None]
+    assert [sorted(result["refused"]) for result in results] == [
+        [], ["bad@example.com"], ["bad1@example.com", "bad2@example.com"]]
+    assert results[1]["refused"]["bad@example.com"][0] == 550
+    assert sorted(smtp_sink.sizes) == [1, 2]
+    assert counter("messages_sent") == 2
+    assert counter("recipients") == 6
+    assert counter("refused") == 3
+
+
+def test_any_failure_is_reported_per_message(smtp_sink, monkeypatch):
+    config = {"smtp_server": "127.0.0.1", "smtp_port": smtp_sink.server_address[1],
+              "smtp_ssl": False, "smtp_timeout": 5, "smtp_async_connections": 1}
+    send_chunks = nr.async_send_chunks
+
+    async def failing(smtp, settings, limiter, from_addr, recipients, data, semaphore=None):
+        if recipients == ["broken@example.com"]:
+            raise ValueError("bad message data")
+        return await send_chunks(smtp, settings, limiter, from_addr, recipients, data, semaphore)
+
+    monkeypatch.setattr(nr, "async_send_chunks", failing)
+    jobs = [(config, FROM, ["broken@example.com"], DATA),
+            (config, FROM, ["one@example.com"], DATA)]
+
+    results = asyncio.run(nr.deliver_async(jobs))
+
+    assert results[0]["error"] == "bad message data"
+    assert results[1]["error"] is None
+    assert counter("messages_sent") == 1
+
+
+def test_retry_wait_frees_the_send_slot(smtp_sink):
+    port = smtp_sink.server_address[1]
+    deferring = {"smtp_server": "127.0.0.1", "smtp_port": port, "smtp_ssl": False,
+                 "smtp_timeout": 5, "smtp_retry_delay": 0.5}
+    other = dict(deferring, smtp_auth_user="other@example.com")
+    jobs = [(deferring, FROM, ["temp@example.com"], DATA),
+            (other, FROM, ["one@example.com", "two@example.com"], DATA)]
+
+    results = asyncio.run(nr.deliver_async(jobs, concurrency=1))
+
+    assert [result["refused"] for result in results] == [{}, {}]
+    # The other server's message went out while the first waited to retry
+    assert smtp_sink.sizes == [2, 1]
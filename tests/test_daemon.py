@@ -0,0 +1,90 @@
+"""
+Daemon scheduling: when each reminder is due, and the state file recording
+the last net sent, which test daemons must never write.
+"""
+import json
+import os
+from datetime import datetime
+
+import pytest
+
+import net_reminder as nr
+
+SCHEDULE = """Net Control Schedule
+DATE,,PRIMARY,BACKUP,Net
+06/20/2024,,Member 1,Member 2,Weekly
+06/27/2024,,Member 2,Member 3,Weekly
+07/04/2024,,Member 3,Member 4,Weekly
+"""
+STATE_FILE = os.path.join("cache", "daemon_state.json")
+
+
+@pytest.fixture
+def config_file(tmp_path, monkeypatch):
+    """Configuration with a CSV schedule and a cache_dir, in the working directory"""
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / "schedule.csv").write_text(SCHEDULE, encoding="UTF-8")
+    (tmp_path / "net_reminder.yaml").write_text(
+        "schedule_excel_file: schedule.csv\n"
+        "schedule_sheet_name: Schedule\n"
+        "cache_dir: cache\n"
+        "daemon_net_time: '19:00'\n"
+        "daemon_lead_hours: 24\n", encoding="UTF-8")
+    return "net_reminder.yaml"
+
+
+def daemon(config_file, **options):
+    """Loaded daemon"""
+    reminder_daemon = nr.ReminderDaemon(config_file, options)
+    reminder_daemon.load()
+    return reminder_daemon
+
+
+def due(reminder_daemon, now):
+    """Returns (net date, send time) of the next reminder"""
+    net, send_at = reminder_daemon.next_reminder(now)
+    return (None, None) if net is None else (net.net_date, send_at)
+
+
+def test_next_reminder(config_file):
+    reminder_daemon = daemon(config_file)
+    assert due(reminder_daemon, datetime(2024, 6, 19, 12)) == (
+        "06/20/2024", datetime(2024, 6, 19, 19))
+    # A net that has started no longer needs its reminder
+    assert due(reminder_daemon, datetime(2024, 6, 20, 19, 30)) == (
+        "06/27/2024", datetime(2024, 6, 26, 19))
+    assert due(reminder_daemon, datetime(2024, 7, 5)) == (None, None)
+
+
+def test_mark_sent_is_remembered_across_restarts(config_file):
+    reminder_daemon = daemon(config_file)
+    net, _ = reminder_daemon.next_reminder(datetime(2024, 6, 19, 12))
+    reminder_daemon.mark_sent(net)
+    assert due(reminder_daemon, datetime(2024, 6, 19, 20)) == (
+        "06/27/2024", datetime(2024, 6, 26, 19))
+
+    with open(STATE_FILE, encoding="UTF-8") as f:
+        assert json.load(f) == {"last_sent": net.ordinal, "net_date": "2024-06-20"}
+
+    restarted = daemon(config_file)
+    assert restarted.last_sent == net.ordinal
+    assert due(restarted, datetime(2024, 6, 19, 20))[0] == "06/27/2024"
+
+
+@pytest.mark.parametrize("options", [{"test": True}, {"test_email": "tester@example.com"}])
+def test_test_daemon_does_not_write_the_state(config_file, options):
+    real = daemon(config_file)
+    first, _ = real.next_reminder(datetime(2024, 6, 19, 12))
+    real.mark_sent(first)
+
+    test_daemon = daemon(config_file, **options)
+    assert test_daemon.last_sent == first.ordinal
+    second, _ = test_daemon.next_reminder(datetime(2024, 6, 19, 20))
+    test_daemon.mark_sent(second)
+
+    # Tracked in memory, also across a reload, but the file is unchanged
+    test_daemon.reload()
+    assert due(test_daemon, datetime(2024, 6, 19, 20))[0] == "07/04/2024"
+    with open(STATE_FILE, encoding="UTF-8") as f:
+        assert json.load(f)["last_sent"] == first.ordinal
+    assert due(daemon(config_file), datetime(2024, 6, 19, 20))[0] == "06/27/2024"
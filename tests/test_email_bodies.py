@@ -0,0 +1,157 @@
+"""
+Email template transforms: CSS inlining, minification and the plain text
+alternative, pinned for the shipped templates and checked on awkward markup.
+"""
+import os
+
+import pytest
+
+import net_reminder as nr
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+
+CONTEXT = dict(net_date="06/20/2024", net_type="Weekly", logo="OIP.png",
+               primary_net_control="Member 2", backup_net_control="Member 3",
+               primary_net_control_2wk="Member 3", backup_net_control_2wk="Member 4",
+               net_date_2wk="06/27/2024", upcoming_nets=[], inline_images=["OIP.png"],
+               switch_notify1_name="Switch One", switch_notify1_email="one@example.com",
+               switch_notify2_name="Switch Two", switch_notify2_email="two@example.com",
+               excel_maintainer_name="Excel Keeper", excel_maintainer_email="excel@example.com",
+               script_maintainer_name="Script Keeper",
+               script_maintainer_email="script@example.com")
+
+
+def transform(source, css=True, minify=True):
+    """Runs the HTML transforms on a template source"""
+    tokens = nr.template_tokens(source)
+    if css:
+        tokens = nr.inline_css(tokens)
+    if minify:
+        tokens = nr.minify_html(tokens)
+    return ''.join(token for _, token, _ in tokens)
+
+
+def load(tmp_path, source, **options):
+    """Writes a template and loads it with every transform enabled"""
+    filename = tmp_path / "t.html"
+    filename.write_text(source, encoding="UTF-8")
+    options = dict(dict(css=True, minify=True, plain_text=True), **options)
+    return nr.load_email_template(str(filename), "", **options)
+
+
+def expected(name):
+    with open(os.path.join(DATA, name), encoding="UTF-8") as f:
+        return f.read()
+
+
+@pytest.mark.parametrize("name", ["net_reminder", "no_net_reminder"])
+def test_shipped_templates(name):
+    template = nr.load_email_template(os.path.join(ROOT, "html_src", f"{name}.html"), "",
+                                      css=True, minify=True, plain_text=True)
+    html, text = template.render(CONTEXT)
+
+    assert html + "\n" == expected(f"{name}.html")
+    assert text == expected(f"{name}.txt")
+    assert "<style>" not in html
+    assert max(len(line) for line in html.splitlines()) < 998
+
+
+def test_rules_inlined_by_type_then_class():
+    source = ("<style>.note { color: red } td, p { color: blue; margin: 0 }</style>"
+              "<td class='note' style='color: green'>x</td><p>y</p>")
+
+    assert transform(source, minify=False) == (
+        "<td class='note' style='margin:0;color:red;color: green'>x</td>"
+        '<p style="color:blue;margin:0">y</p>')
+
+
+def test_rules_not_inlined_stay_in_style():
+    source = ("<style>td b { color: red } #i { color: blue } a:hover { color: green }"
+              "@media (max-width: 600px) { td { display: block } } p { margin: 0 }</style>"
+              "<p id='i'>x</p>")
+
+    assert transform(source) == (
+        "<style>td b{color: red}#i{color: blue}a:hover{color: green}"
+        "@media (max-width: 600px){td{display: block}}</style><p id='i' style=\"margin:0\">x</p>")
+
+
+@pytest.mark.parametrize("selector", [
+    "*", "td[align]", "tr > td", "h1 + p", "h1 ~ p", ".note.small", "p::first-line", "#i td"])
+def test_selectors_left_in_style(selector):
+    rules, rest = nr.parse_css(f"{selector} {{ color: red }} td {{ margin: 0 }}")
+    assert rules == [("td", None, [("margin", "0")])]
+    assert rest == f"{selector}{{ color: red }}"
+
+
+def test_jinja_in_tags_and_style():
+    source = ("<style>td { color: red }</style>\n"
+              "<td {% if wide %}colspan=\"2\"{% endif %}>a</td>\n"
+              "<td class=\"{{ kind }}\" title=\"{{ 'a > b' }}\">b</td>")
+
+    assert transform(source) == (
+        "<td {% if wide %}colspan=\"2\"{% endif %}>a</td>"
+        "<td class=\"{{ kind }}\" title=\"{{ 'a > b' }}\" style=\"color:red\">b</td>")
+
+    kept = "<style>td { color: {{ color }} }</style><td>a</td>"
+    assert transform(kept, minify=False) == kept
+
+
+def test_minify_keeps_what_renders():
+    source = ("<p>\n  Hello   <b>{{ name }}</b>\n  {% if x %} <i>x</i> {% endif %}\n</p>\n"
+              "<!-- dropped -->\n<!--[if mso]><table><![endif]-->\n"
+              "<!-- {% if y %} -->\n<pre>  a\n   b</pre>\na < b")
+
+    assert transform(source, css=False) == (
+        "<p>Hello <b>{{ name }}</b> {% if x %} <i>x</i>{% endif %}</p>"
+        "<!--[if mso]><table><![endif]--><!-- {% if y %} --><pre>  a\n   b</pre>a < b")
+
+
+def test_minify_breaks_long_lines():
+    source = "<p>\n" + "word\n" * 1000 + "</p>"
+    html = transform(source, css=False)
+
+    assert max(len(line) for line in html.splitlines()) <= nr.MINIFIED_LINE_LENGTH + 5
+    assert html.split() == source.replace("<p>\n", "<p>").replace("\n</p>", "</p>").split()
+
+
+def test_plain_text(tmp_path):
+    template = load(tmp_path, "<h3>Net for {{ day }}</h3><ul><li>One &amp; two<li>Three</ul>"
+                              "<p><img src='cid:logo.png' alt='Logo'> "
+                              "<a href='mailto:{{ email }}'>{{ email }}</a>, "
+                              "<a href='https://example.com/schedule'>schedule</a></p>")
+    html, text = template.render(day="Monday", email="nc@example.com")
+
+    assert html.startswith("<h3>Net for Monday</h3>")
+    assert text == ("Net for Monday\n\n- One & two\n- Three\n\n"
+                    "Logo nc@example.com, schedule <https://example.com/schedule>\n")
+
+
+def test_transformed_once_per_template_version(tmp_path):
+    first = load(tmp_path, "<p>one</p>")
+    filename = tmp_path / "t.html"
+    assert nr.load_email_template(str(filename), "", css=True, minify=True,
+                                  plain_text=True) is first
+
+    filename.write_text("<p>two</p>", encoding="UTF-8")
+    stat = os.stat(filename)
+    os.utime(filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 10 ** 9))
+
+    second = nr.load_email_template(str(filename), "", css=True, minify=True, plain_text=True)
+    assert second is not first
+    assert second.render() == ("<p>two</p>", "two\n")
+
+
+def test_untransformable_template_sent_as_written(tmp_path, monkeypatch):
+    monkeypatch.setattr(nr, "minify_html", lambda tokens: tokens + [('jinja', '{% if', None)])
+    template = load(tmp_path, "<p>{{ x }}</p>\n")
+
+    assert template.text is None
+    assert template.render(x=1) == ("<p>1</p>", None)
+
+
+def test_long_lines_sent_quoted_printable():
+    assert nr.mime_text("<p>short</p>", "html")['Content-Transfer-Encoding'] == "7bit"
+    part = nr.mime_text("<p>" + "x" * 2000 + "</p>", "html")
+    assert part['Content-Transfer-Encoding'] == "quoted-printable"
+    assert max(len(line) for line in part.as_string().splitlines()) <= 998
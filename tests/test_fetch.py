@@ -0,0 +1,136 @@
+"""
+Workbook fetch: conditional requests on the saved ETag, and a dropped
+download resumed with a Range request.
+"""
+import hashlib
+import http.server
+import os
+import socket
+from functools import partial
+
+import pytest
+
+import net_reminder as nr
+from pipeline_benchmark import QuietHTTPHandler, start_server
+
+pytest.importorskip("requests")
+
+
+class WorkbookHandler(QuietHTTPHandler):
+    """Serves files with an ETag, honouring If-None-Match and Range
+
+    While the server's drop flag is set, a full response is cut off halfway.
+    """
+
+    def do_GET(self):
+        with open(self.translate_path(self.path), "rb") as f:
+            body = f.read()
+        etag = '"' + hashlib.sha256(body).hexdigest()[:16] + '"'
+        self.server.requests.append(dict(self.headers))
+
+        if self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+
+        start = 0
+        if self.headers.get("Range") and self.headers.get("If-Range", etag) == etag:
+            start = int(self.headers["Range"].split("=")[1].rstrip("-"))
+            self.send_response(206)
+            self.send_header("Content-Range", f"bytes {start}-{len(body) - 1}/{len(body)}")
+        else:
+            self.send_response(200)
+        self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body) - start))
+        self.end_headers()
+
+        if self.server.drop and start == 0:
+            self.server.drop = False
+            self.wfile.write(body[:len(body) // 2])
+            self.wfile.flush()
+            self.connection.shutdown(socket.SHUT_RDWR)
+            self.close_connection = True
+            return
+        self.wfile.write(body[start:])
+
+
+@pytest.fixture
+def web(tmp_path):
+    """HTTP stand-in serving tmp_path/served"""
+    served = tmp_path / "served"
+    served.mkdir()
+    server = start_server(http.server.ThreadingHTTPServer(
+        ("127.0.0.1", 0), partial(WorkbookHandler, directory=str(served))))
+    server.drop = False
+    server.requests = []
+    server.served = served
+    yield server
+    server.shutdown()
+    server.server_close()
+
+
+def publish(web, body):
+    """Puts a workbook on the stand-in and returns its URL"""
+    (web.served / "schedule.xlsx").write_bytes(body)
+    return f"http://127.0.0.1:{web.server_address[1]}/schedule.xlsx"
+
+
+def test_unchanged_file_is_not_downloaded_again(web, tmp_path):
+    body = os.urandom(100_000)
+    url = publish(web, body)
+    filename = str(tmp_path / "schedule.xlsx")
+
+    assert nr.fetch_remote_file(url, filename, "user", "secret") is True
+    assert nr.fetch_remote_file(url, filename, "user", "secret") is False
+
+    with open(filename, "rb") as f:
+        assert f.read() == body
+    first, second = web.requests
+    assert "If-None-Match" not in first
+    assert second["If-None-Match"] == f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+    assert second["Accept-Encoding"] == "identity"
+    assert nr.METRICS.counters[("bytes_fetched", "")] == len(body)
+
+
+def test_changed_file_is_downloaded(web, tmp_path):
+    url = publish(web, b"first version")
+    filename = str(tmp_path / "schedule.xlsx")
+    assert nr.fetch_remote_file(url, filename, "user", "secret") is True
+
+    publish(web, b"second version")
+    assert nr.fetch_remote_file(url, filename, "user", "secret") is True
+    with open(filename, "rb") as f:
+        assert f.read() == b"second version"
+
+
+def test_dropped_download_resumes_with_range(web, tmp_path):
+    body = os.urandom(200_000)
+    url = publish(web, body)
+    filename = str(tmp_path / "schedule.xlsx")
+    web.drop = True
+
+    assert nr.fetch_remote_file(url, filename, "user", "secret",
+                                sha256=hashlib.sha256(body).hexdigest()) is True
+
+    with open(filename, "rb") as f:
+        assert f.read() == body
+    assert len(web.requests) == 2
+    resumed = web.requests[1]
+    assert 0 < int(resumed["Range"][len("bytes="):-1]) <= len(body) // 2
+    assert resumed["If-Range"] == f'"{hashlib.sha256(body).hexdigest()[:16]}"'
+    assert not os.path.exists(filename + ".part")
+
+
+def test_incomplete_download_keeps_previous_copy(web, tmp_path):
+    filename = str(tmp_path / "schedule.xlsx")
+    with open(filename, "wb") as f:
+        f.write(b"previous copy")
+    url = publish(web, os.urandom(50_000))
+    web.drop = True
+
+    with pytest.raises(nr.NetReminderError):
+        nr.fetch_remote_file(url, filename, "user", "secret", retries=0)
+
+    with open(filename, "rb") as f:
+        assert f.read() == b"previous copy"
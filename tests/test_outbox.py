@@ -0,0 +1,92 @@
+"""
+Outbox: a rerun of a date mails nobody twice, and a delivery a crash left in
+'sending' is sent again exactly once.
+"""
+import os
+import sqlite3
+from datetime import datetime
+
+import pytest
+
+import net_reminder as nr
+
+ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), os.pardir)
+NOW = datetime(2024, 6, 18)
+SCHEDULE = """Net Control Schedule
+DATE,,PRIMARY,BACKUP,Net
+06/20/2024,,Member 1,Member 2,Weekly
+06/27/2024,,Member 2,Member 3,Weekly
+"""
+ROSTER = """Member,Callsign,Street,Email,Mobile Phone,Home Phone,Work Phone
+Member 1,K1AAA,,one@example.com,,,
+Member 2,K2BBB,,two@example.com,,,
+Member 3,K3CCC,,three@example.com,,,
+"""
+
+
+@pytest.fixture
+def config(tmp_path, smtp_sink):
+    """Configuration sending the shipped templates to the SMTP sink through an outbox"""
+    (tmp_path / "schedule.csv").write_text(SCHEDULE, encoding="UTF-8")
+    (tmp_path / "roster.csv").write_text(ROSTER, encoding="UTF-8")
+    contacts = {f"{role}_{field}": f"{role}@example.com" if field == "email" else role
+                for role in ("script_maintainer", "excel_maintainer",
+                             "switch_notify1", "switch_notify2")
+                for field in ("name", "email")}
+    return dict(contacts,
+                schedule_excel_file=str(tmp_path / "schedule.csv"),
+                schedule_sheet_name="Schedule",
+                roster_excel_file=str(tmp_path / "roster.csv"),
+                roster_sheet_name="Active",
+                email_config=os.path.join(ROOT, "html_src", "net_reminder.html"),
+                no_net_control_email_config=os.path.join(ROOT, "html_src",
+                                                         "no_net_reminder.html"),
+                email_subject_template="{0} Net for {1}",
+                logo=os.path.join(ROOT, "image_src", "OIP.jpg"),
+                email_from="net@example.com",
+                email_reply_to="net@example.com",
+                smtp_server="127.0.0.1",
+                smtp_port=smtp_sink.server_address[1],
+                smtp_ssl=False,
+                smtp_auth_user="net@example.com",
+                outbox_file=str(tmp_path / "outbox.sqlite3"))
+
+
+def run(config):
+    with nr.NetReminder(config) as reminder:
+        reminder.run(NOW)
+
+
+def statuses(config):
+    with sqlite3.connect(config["outbox_file"]) as db:
+        return dict(db.execute("SELECT address, status FROM deliveries"))
+
+
+@pytest.mark.parametrize("personalize", [False, True])
+def test_rerun_sends_nothing(config, smtp_sink, personalize):
+    config["personalize"] = personalize
+    run(config)
+    sent = smtp_sink.reset()
+    assert sent[1] == 3
+    assert set(statuses(config).values()) == {"sent"}
+
+    run(config)
+    assert smtp_sink.reset() == (0, 0)
+
+
+def test_interrupted_delivery_is_resent_once(config, smtp_sink):
+    config["personalize"] = True
+    run(config)
+    assert smtp_sink.reset() == (3, 3)
+
+    # A crash between handing the message to the server and recording it
+    with sqlite3.connect(config["outbox_file"]) as db:
+        db.execute("UPDATE deliveries SET status = 'sending' WHERE address = ?",
+                   ("two@example.com",))
+
+    run(config)
+    assert smtp_sink.reset() == (1, 1)
+    assert statuses(config)["two@example.com"] == "sent"
+
+    run(config)
+    assert smtp_sink.reset() == (0, 0)
@@ -0,0 +1,74 @@
+"""
+Stage profiler: stages entered by interleaved coroutines end in any order and
+each is charged to its own entry; peak memory is charged to every stage open
+when it was reached.
+"""
+import asyncio
+import tracemalloc
+
+import pytest
+
+import net_reminder as nr
+
+MIB = 2 ** 20
+
+
+def test_exit_matches_its_own_entry():
+    profiler = nr.StageProfiler()
+    profiler.start()
+    first = profiler.enter("smtp_send")
+    second = profiler.enter("render")
+    profiler.exit(first)
+    assert [entry[1] for entry in profiler.stack] == ["run", "render"]
+    profiler.exit(second)
+    assert [entry[1] for entry in profiler.stack] == ["run"]
+    profiler.stop()
+    assert profiler.calls == {"run": 1, "smtp_send": 1, "render": 1}
+
+
+def test_interleaved_async_stages(tmp_path):
+    profiler = nr.StageProfiler()
+
+    async def send(name, delay):
+        with profiler.stage("smtp_send"):
+            await asyncio.sleep(delay)
+        with profiler.stage(name):
+            pass
+
+    async def run():
+        await asyncio.gather(send("mime_build", 0.02), send("render", 0.01))
+
+    profiler.start()
+    asyncio.run(run())
+    assert [entry[1] for entry in profiler.stack] == ["run"]
+    profiler.stop()
+    assert profiler.calls["smtp_send"] == 2
+    report = profiler.write(str(tmp_path / "run.prof"))
+    with open(report, encoding="UTF-8") as f:
+        text = f.read()
+    assert "Only the main thread is profiled" in text
+    assert "== Stage mime_build: 1 calls" in text
+
+
+@pytest.mark.skipif(not hasattr(tracemalloc, "reset_peak"), reason="needs Python 3.9+")
+def test_peaks_of_nested_stages():
+    profiler = nr.StageProfiler()
+    profiler.start()
+    with profiler.stage("fetch"):
+        block = bytearray(20 * MIB)
+        del block
+        with profiler.stage("render"):
+            pass
+        with profiler.stage("mime_build"):
+            block = bytearray(10 * MIB)
+            del block
+    with profiler.stage("smtp_send"):
+        pass
+    profiler.stop()
+
+    assert profiler.peaks["fetch"] >= 20 * MIB
+    assert profiler.peaks["render"] < 5 * MIB
+    assert 10 * MIB <= profiler.peaks["mime_build"] < 20 * MIB
+    assert profiler.peaks["smtp_send"] < 5 * MIB
+    assert profiler.peaks["run"] >= 20 * MIB
+    assert profiler.snapshot_stage == "fetch"
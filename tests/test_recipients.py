@@ -0,0 +1,32 @@
+"""
+Roster cells: addresses are split on commas, semicolons and line breaks only,
+and each fragment that isn't an address is reported once.
+"""
+import pytest
+
+import net_reminder as nr
+
+
+@pytest.mark.parametrize("cell, addresses", [
+    (None, []),
+    ("one@example.com", ["one@example.com"]),
+    ("one@example.com; two@example.com,three@example.com", [
+        "one@example.com", "two@example.com", "three@example.com"]),
+    ("one@example.com\nmailto:two@example.com", ["one@example.com", "two@example.com"]),
+    ("Jane Doe <jane@example.com>, \"Doe, John\" <john@example.com>", [
+        "jane@example.com", "john@example.com"]),
+    ("jane@example.com.", ["jane@example.com"]),
+    (" ;, ", []),
+    ("not an address", ["not an address"]),
+    ("one@example.com two@example.com", ["one@example.com two@example.com"]),
+])
+def test_split_addresses(cell, addresses):
+    assert nr.split_addresses(cell) == addresses
+
+
+def test_invalid_fragment_is_reported_once():
+    index = nr.RecipientIndex(suppressed={"blocked@example.com"})
+    assert index.add("not an address; Jane Doe <jane@example.com>") == ["jane@example.com"]
+    assert index.add("JANE@example.com, blocked@example.com") == []
+    assert index.invalid == ["not an address"]
+    assert (index.accepted, index.duplicates, index.blocked) == (1, 1, 1)
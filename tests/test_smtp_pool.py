@@ -0,0 +1,70 @@
+"""
+SMTP pool: recipients are sent in chunks, temporary refusals are retried on
+their own without holding the connection, and permanent ones are reported.
+"""
+import net_reminder as nr
+
+FROM = "net@example.com"
+DATA = "Subject: Net reminder\r\n\r\nSee you on the net.\r\n"
+
+
+def pool(sink, **kwargs):
+    """Pool on the local sink, without SSL or retry delays"""
+    settings = dict(use_ssl=False, timeout=5, retry_delay=0)
+    settings.update(kwargs)
+    return nr.SMTPPool("127.0.0.1", sink.server_address[1], **settings)
+
+
+def counter(name):
+    return nr.METRICS.counters.get((name, ""), 0)
+
+
+def test_recipients_are_chunked(smtp_sink):
+    smtp = pool(smtp_sink, max_recipients=2)
+    recipients = [f"member{i}@example.com" for i in range(5)]
+    try:
+        assert smtp.send(FROM, recipients, DATA) == {}
+    finally:
+        smtp.close()
+    assert smtp_sink.sizes == [2, 2, 1]
+    assert counter("messages_sent") == 1
+    assert counter("recipients") == 5
+
+
+def test_temporary_refusals_are_retried_alone(smtp_sink, monkeypatch):
+    smtp = pool(smtp_sink, retries=2, retry_delay=5)
+    held = []
+    lock = smtp._lock  # pylint: disable=protected-access
+    monkeypatch.setattr(nr.time, "sleep", lambda delay: held.append((delay, lock.locked())))
+    recipients = ["one@example.com", "temp@example.com", "bad@example.com", "two@example.com"]
+    try:
+        refused = smtp.send(FROM, recipients, DATA)
+    finally:
+        smtp.close()
+    assert refused == {"bad@example.com": (550, "no such user")}
+    assert smtp_sink.sizes == [2, 1]
+    # One wait before the single retry round, with the connection released
+    assert held == [(5, False)]
+    assert counter("refused") == 1
+
+
+def test_no_retry_round_for_the_outbox(smtp_sink, monkeypatch):
+    smtp = pool(smtp_sink, retries=2)
+    monkeypatch.setattr(nr.time, "sleep", lambda delay: None)
+    try:
+        refused = smtp.send(FROM, ["temp@example.com", "one@example.com"], DATA, retries=0)
+    finally:
+        smtp.close()
+    assert refused == {"temp@example.com": (451, "try again later")}
+    assert smtp_sink.sizes == [1]
+
+
+def test_all_refused_is_not_sent(smtp_sink):
+    smtp = pool(smtp_sink)
+    try:
+        refused = smtp.send(FROM, ["bad@example.com", "bad2@example.com"], DATA)
+    finally:
+        smtp.close()
+    assert set(refused) == {"bad@example.com", "bad2@example.com"}
+    assert smtp_sink.sizes == []
+    assert counter("messages_sent") == 0
@@ -0,0 +1,64 @@
+"""
+Tenant resources: downloads are shared only for the same URL and file, and
+tenants naming the same suppression file share one list and its lock.
+"""
+import threading
+
+import pytest
+
+import net_reminder as nr
+
+
+@pytest.fixture
+def fetched(monkeypatch):
+    """Records the files fetch_remote_files is asked for instead of fetching"""
+    calls = []
+
+    def fetch(files, user, password, max_workers=4, max_bytes=None):
+        calls.append([(url, filename) for url, filename, _ in files])
+        return {filename: True for _, filename, _ in files}
+
+    monkeypatch.setattr(nr, "fetch_remote_files", fetch)
+    return calls
+
+
+def test_same_url_and_file_is_fetched_once(fetched, tmp_path):
+    resources = nr.TenantResources()
+    files = [("https://cloud.example.com/a.xlsx", str(tmp_path / "a.xlsx"), None)]
+    assert resources.fetch_remote_files(files, "a", "secret") == {str(tmp_path / "a.xlsx"): True}
+    assert resources.fetch_remote_files(files, "b", "secret") == {str(tmp_path / "a.xlsx"): True}
+    assert len(fetched) == 1
+
+
+def test_different_urls_for_one_file_are_refused(fetched, tmp_path):
+    resources = nr.TenantResources()
+    filename = str(tmp_path / "schedule.xlsx")
+    resources.fetch_remote_files([("https://a.example.com/s.xlsx", filename, None)], "a", "x")
+    with pytest.raises(nr.NetReminderError, match="fetched from both"):
+        resources.fetch_remote_files([("https://b.example.com/s.xlsx", filename, None)],
+                                     "b", "y")
+    assert len(fetched) == 1
+
+
+def test_tenants_share_the_suppression_list(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    resources = nr.TenantResources()
+    reminders = [nr.NetReminder({"suppression_file": name}, resources=resources)
+                 for name in ("suppressed.txt", str(tmp_path / "suppressed.txt"))]
+    lists = [reminder.suppression_list() for reminder in reminders]
+    assert lists[0] is lists[1]
+
+    def add(tenant):
+        for i in range(200):
+            lists[tenant % 2].add([f"bounce{tenant}-{i}@example.com"], "550 no such user")
+
+    threads = [threading.Thread(target=add, args=(tenant,)) for tenant in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    lines = (tmp_path / "suppressed.txt").read_text(encoding="UTF-8").splitlines()
+    assert len(lines) == 800
+    assert all(line.endswith(" 550 no such user") for line in lines)
+    assert len(nr.SuppressionList("suppressed.txt")) == 800
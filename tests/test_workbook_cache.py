@@ -0,0 +1,39 @@
+"""
+Workbook cache: entries are reused for an unchanged workbook and never across
+script versions or cache formats.
+"""
+import pytest
+
+import net_reminder as nr
+
+SCHEDULE = """Net Control Schedule
+DATE,,PRIMARY,BACKUP,Net
+06/20/2024,,Member 1,Member 2,Weekly
+"""
+
+
+def counter(name):
+    return nr.METRICS.counters.get((name, ""), 0)
+
+
+def read(filename, cache_dir):
+    return nr.read_workbook_cached(filename, ["Schedule"], skiprows=1,
+                                   columns=("DATE", "PRIMARY", "BACKUP", "Net"),
+                                   build=nr.schedule_table, cache_dir=cache_dir)
+
+
+@pytest.mark.parametrize("name, value", [("SCRIPT_VERSION", "0.0.0"),
+                                         ("WORKBOOK_CACHE_FORMAT", 0)])
+def test_cache_is_not_shared_across_versions(tmp_path, monkeypatch, name, value):
+    filename = str(tmp_path / "schedule.csv")
+    cache_dir = str(tmp_path / "cache")
+    with open(filename, "w", encoding="UTF-8") as f:
+        f.write(SCHEDULE)
+
+    first = read(filename, cache_dir)
+    assert read(filename, cache_dir) == first
+    assert (counter("workbook_cache_misses"), counter("workbook_cache_hits")) == (1, 1)
+
+    monkeypatch.setattr(nr, name, value)
+    assert read(filename, cache_dir) == first
+    assert (counter("workbook_cache_misses"), counter("workbook_cache_hits")) == (2, 1)